@@ -0,0 +1,111 @@
+"""Simulate workers loading per-project datasets and report their cache hit
+rate and pickup latency.
+
+Jobs of --projects projects (skewed: project p gets weight 1 / (p + 1))
+arrive every --interval seconds on average. Each of --workers workers keeps
+the datasets of its last --cache projects; a job takes --run seconds, plus
+--fetch seconds when its dataset is not cached. Policies:
+
+  fifo      ORDER BY priority, run_at (the default claim)
+  affinity  jobs of recently served projects first, otherwise those of the
+            projects owned by rendezvous hashing, otherwise those that
+            waited more than --max-wait seconds (Worker.affinity)
+
+    PYTHONPATH=. python benchmarks/affinity.py --workers 8 --projects 200
+"""
+import argparse
+import heapq
+import random
+from collections import OrderedDict
+from pyworker.affinity import rendezvous_owner
+
+
+def simulate(policy, args):
+    rng = random.Random(args.seed)
+    weights = [1.0 / (p + 1) for p in range(args.projects)]
+    arrivals = []
+    t = 0.0
+    while t < args.seconds:
+        t += rng.expovariate(1.0 / args.interval)
+        arrivals.append((t, rng.choices(range(args.projects), weights)[0]))
+    workers = ['worker-%d' % i for i in range(args.workers)]
+    owner = dict((p, rendezvous_owner(p, workers)) for p in range(args.projects))
+    caches = dict((worker, OrderedDict()) for worker in workers)
+    free_at = [(0.0, worker) for worker in workers]
+    ready = [] # (enqueued at, project), in run_at order
+    hits = fetches = 0
+    latencies = []
+    i = 0
+    while i < len(arrivals) or ready:
+        now, worker = heapq.heappop(free_at)
+        while i < len(arrivals) and arrivals[i][0] <= now:
+            ready.append(arrivals[i])
+            i += 1
+        index = None
+        if ready and policy == 'affinity':
+            cache = caches[worker]
+            candidates = ready[:args.candidates]
+            for rank in [lambda p, t: p in cache,
+                         lambda p, t: owner[p] == worker,
+                         lambda p, t: t < now - args.max_wait]:
+                index = next((c for c, (t, p) in enumerate(candidates)
+                    if rank(p, t)), None)
+                if index is not None:
+                    break
+        elif ready:
+            index = 0
+        if index is None:
+            # nothing for this worker: poll again shortly
+            next_arrival = arrivals[i][0] if i < len(arrivals) else now
+            heapq.heappush(free_at, (max(now + 1, next_arrival), worker))
+            continue
+        enqueued_at, project = ready.pop(index)
+        latencies.append(now - enqueued_at)
+        cache = caches[worker]
+        seconds = args.run
+        if project in cache:
+            hits += 1
+            cache.move_to_end(project)
+        else:
+            fetches += 1
+            seconds += args.fetch
+            cache[project] = True
+            if len(cache) > args.cache:
+                cache.popitem(last=False)
+        heapq.heappush(free_at, (now + seconds, worker))
+    return hits, fetches, latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--cache', type=int, default=10,
+        help='datasets cached per worker')
+    parser.add_argument('--interval', type=float, default=1.0,
+        help='mean seconds between two jobs')
+    parser.add_argument('--run', type=float, default=2.0)
+    parser.add_argument('--fetch', type=float, default=5.0)
+    parser.add_argument('--candidates', type=int, default=100)
+    parser.add_argument('--max-wait', type=float, default=30)
+    parser.add_argument('--seconds', type=int, default=7200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print('%-9s %8s %9s %13s %10s %10s' % (
+        'policy', 'jobs', 'hit rate', 'fetch s/job', 'mean s', 'p99 s'))
+    for policy in ['fifo', 'affinity']:
+        hits, fetches, latencies = simulate(policy, args)
+        jobs = hits + fetches
+        print('%-9s %8d %8.1f%% %13.2f %10.1f %10.1f' % (policy, jobs,
+            100.0 * hits / jobs, args.fetch * fetches / jobs,
+            sum(latencies) / jobs, percentile(latencies, 0.99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Simulate a mass failure and report the peak retry claim rate per backoff policy.
+
+All jobs fail at t=0 because a downstream dependency is down for `--outage`
+seconds; every retry that runs before the dependency recovers fails again.
+The peak claim rate is the largest number of jobs that become due within
+the same one-second bucket.
+
+    python benchmarks/backoff_stampede.py --jobs 10000 --outage 120
+"""
+import argparse
+from collections import Counter
+from types import SimpleNamespace
+
+from pyworker.backoff import ExponentialBackoff, LinearBackoff, \
+    FullJitterBackoff, DecorrelatedJitterBackoff
+
+
+def simulate(policy, jobs, outage, max_attempts):
+    claims = Counter()
+    for job_id in range(jobs):
+        job = SimpleNamespace(job_id=job_id, attempts=0)
+        now = 0.0
+        while job.attempts < max_attempts:
+            job.attempts += 1
+            now += policy.delay(job)
+            claims[int(now)] += 1
+            if now >= outage:
+                break
+    return claims
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=10000)
+    parser.add_argument('--outage', type=float, default=120)
+    parser.add_argument('--max-attempts', type=int, default=10)
+    args = parser.parse_args()
+
+    policies = [
+        ('exponential', ExponentialBackoff()),
+        ('linear', LinearBackoff(step=30)),
+        ('full-jitter', FullJitterBackoff(cap=3600)),
+        ('decorrelated-jitter', DecorrelatedJitterBackoff(cap=3600)),
+    ]
+    print('%-20s %12s %12s %12s' % ('policy', 'peak/s', 'retries', 'last@s'))
+    for name, policy in policies:
+        claims = simulate(policy, args.jobs, args.outage, args.max_attempts)
+        last = max(claims) if claims else 0
+        print('%-20s %12d %12d %12d' % (
+            name, max(claims.values()), sum(claims.values()), last))
+
+
+if __name__ == '__main__':
+    main()
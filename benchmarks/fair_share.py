@@ -0,0 +1,90 @@
+"""Simulate a skewed workload and report pickup latency per tenant.
+
+One large tenant enqueues --burst jobs at once into the queue, while
+--tenants small tenants each enqueue a job every --interval seconds. The
+worker pool claims --capacity jobs per second. Policies:
+
+  fifo         ORDER BY priority, run_at (the default claim)
+  round-robin  next tenant with ready jobs after the last one served
+               (Worker.fair_share_column)
+
+    python benchmarks/fair_share.py --burst 100000 --tenants 50
+"""
+import argparse
+import bisect
+import random
+from collections import deque
+
+
+def simulate(policy, args):
+    rng = random.Random(args.seed)
+    queues = {} # tenant: deque of enqueue times
+    ready_tenants = [] # sorted tenants with ready jobs
+    arrivals = deque()
+    arrivals.extend((0, 0) for _ in range(args.burst)) # tenant 0 is the large one
+    for tenant in range(1, args.tenants + 1):
+        offset = rng.randrange(args.interval)
+        for t in range(offset, args.seconds, args.interval):
+            arrivals.append((t, tenant))
+    arrivals = deque(sorted(arrivals))
+    fifo = deque()
+    latencies = {'large': [], 'small': []}
+    last_tenant = -1
+    for now in range(args.seconds):
+        while arrivals and arrivals[0][0] <= now:
+            t, tenant = arrivals.popleft()
+            fifo.append((t, tenant))
+            if not queues.get(tenant):
+                queues[tenant] = deque()
+                bisect.insort(ready_tenants, tenant)
+            queues[tenant].append(t)
+        for _ in range(args.capacity):
+            if policy == 'fifo':
+                if not fifo:
+                    break
+                t, tenant = fifo.popleft()
+            else:
+                if not ready_tenants:
+                    break
+                i = bisect.bisect_right(ready_tenants, last_tenant)
+                tenant = ready_tenants[i % len(ready_tenants)]
+                t = queues[tenant].popleft()
+                if not queues[tenant]:
+                    ready_tenants.remove(tenant)
+                last_tenant = tenant
+            latencies['large' if tenant == 0 else 'small'].append(now - t)
+    return latencies
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--burst', type=int, default=100000)
+    parser.add_argument('--tenants', type=int, default=50)
+    parser.add_argument('--interval', type=int, default=30,
+        help='seconds between two jobs of a small tenant')
+    parser.add_argument('--capacity', type=int, default=20,
+        help='jobs processed per second')
+    parser.add_argument('--seconds', type=int, default=7200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print('%-12s %-7s %8s %10s %10s %10s' % (
+        'policy', 'tenant', 'jobs', 'p50 s', 'p99 s', 'max s'))
+    for policy in ['fifo', 'round-robin']:
+        latencies = simulate(policy, args)
+        for tenant in ['large', 'small']:
+            values = latencies[tenant]
+            print('%-12s %-7s %8d %10d %10d %10d' % (policy, tenant,
+                len(values), percentile(values, 0.5),
+                percentile(values, 0.99), max(values) if values else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Measure the cold import time of pyworker under `python -X importtime`.
+
+Prints the cumulative import time of the module and its slowest imports:
+
+    python benchmarks/import_time.py --module pyworker.worker --top 10
+"""
+import argparse
+import subprocess
+import sys
+
+
+def import_times(module):
+    '''Returns {module: (self_us, cumulative_us)} for a fresh interpreter'''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='pyworker.worker')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = sorted(times[args.module][1] for times in runs)
+    print('%s: median %.1f ms, min %.1f ms over %d runs' % (
+        args.module, totals[len(totals) // 2] / 1000.0, totals[0] / 1000.0,
+        args.runs))
+    slowest = sorted(runs[-1].items(), key=lambda item: -item[1][0])
+    print('%-50s %10s %12s' % ('module', 'self ms', 'cumul. ms'))
+    for name, (self_us, cumulative_us) in slowest[:args.top]:
+        print('%-50s %10.1f %12.1f' % (
+            name, self_us / 1000.0, cumulative_us / 1000.0))
+
+
+if __name__ == '__main__':
+    main()
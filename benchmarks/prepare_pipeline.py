@@ -0,0 +1,70 @@
+"""Compare job throughput with and without the pipelined prepare stage.
+
+Each job downloads its inputs in prepare (simulated by sleeping --io seconds)
+then computes in run (busy loop of --cpu seconds). Without lookahead a job
+takes io + cpu, with it the worker approaches max(io, cpu) per job.
+
+    python benchmarks/prepare_pipeline.py --jobs 20 --io 0.05 --cpu 0.05
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+from pyworker.pipeline import PreparePipeline
+
+
+def make_job(job_id, io, cpu):
+    def prepare():
+        time.sleep(io)
+
+    def run():
+        deadline = time.perf_counter() + cpu
+        while time.perf_counter() < deadline:
+            pass
+
+    return SimpleNamespace(job_id=job_id, abstract=False, prepared=None,
+        prepare=prepare, run=run, unlock=lambda: None)
+
+
+def sequential(jobs):
+    for job in jobs:
+        job.prepare()
+        job.run()
+
+
+def pipelined(jobs, lookahead):
+    # same claim ahead loop as Worker._next_job
+    pipeline = PreparePipeline(lookahead)
+    pending = list(jobs)
+    while True:
+        while not pipeline.full() and pending:
+            pipeline.push(pending.pop(0))
+        job, _ = pipeline.pop()
+        if job is None:
+            break
+        job.prepared.result()
+        job.run()
+    pipeline.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--io', type=float, default=0.05)
+    parser.add_argument('--cpu', type=float, default=0.05)
+    parser.add_argument('--lookahead', type=int, default=1)
+    args = parser.parse_args()
+
+    print('%-12s %10s %10s' % ('mode', 'seconds', 'jobs/s'))
+    for name, run in [
+            ('sequential', sequential),
+            ('pipelined', lambda jobs: pipelined(jobs, args.lookahead))]:
+        jobs = [make_job(i, args.io, args.cpu) for i in range(args.jobs)]
+        started = time.perf_counter()
+        run(jobs)
+        elapsed = time.perf_counter() - started
+        print('%-12s %10.2f %10.1f' % (name, elapsed, args.jobs / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Simulate a bulk load of urgent jobs and report pickup latency per priority band.
+
+A single worker pool claims --capacity jobs per second. Background jobs of
+every band arrive steadily; during the first --bulk-hours, urgent (priority 0)
+jobs arrive faster than they can be processed. Policies:
+
+  strict   ORDER BY priority, run_at (the default claim)
+  aging    effective priority = priority - floor(wait / aging_interval), over
+           the candidate window of the claim query (first candidates by
+           priority plus the oldest ones)
+  exact    same effective priority over all ready jobs (a full scan)
+
+    python benchmarks/priority_aging.py --aging-interval 300 --candidates 100
+"""
+import argparse
+import heapq
+import itertools
+import random
+from collections import deque
+
+
+BANDS = {0: 0.5, 5: 1.0, 10: 0.5} # priority: steady jobs per second
+
+
+def effective(priority, run_at, now, aging_interval):
+    return (priority - (now - run_at) // aging_interval, run_at)
+
+
+def pick_strict(queues, now, args):
+    for priority in sorted(queues):
+        if queues[priority]:
+            return priority
+
+
+def pick_exact(queues, now, args):
+    # the head of a band is its oldest job, the best of the band
+    heads = [(effective(priority, queue[0], now, args.aging_interval), priority)
+             for priority, queue in queues.items() if queue]
+    return min(heads)[1] if heads else None
+
+
+def head(queue, priority, count):
+    return [(run_at, priority) for run_at in itertools.islice(queue, count)]
+
+
+def pick_window(queues, now, args):
+    by_priority = []
+    for priority in sorted(queues):
+        for run_at in itertools.islice(queues[priority],
+                                       args.candidates - len(by_priority)):
+            by_priority.append((run_at, priority))
+        if len(by_priority) >= args.candidates:
+            break
+    oldest = heapq.nsmallest(args.candidates, heapq.merge(*[
+        head(queue, priority, args.candidates)
+        for priority, queue in queues.items()]))
+    candidates = set(by_priority) | set(oldest)
+    if not candidates:
+        return None
+    return min(candidates, key=lambda c: effective(c[1], c[0], now,
+        args.aging_interval))[1]
+
+
+def simulate(pick, args):
+    rng = random.Random(args.seed)
+    queues = {priority: deque() for priority in BANDS}
+    latencies = {priority: [] for priority in BANDS}
+    for now in range(int(args.hours * 3600)):
+        rates = dict(BANDS)
+        if now < args.bulk_hours * 3600:
+            rates[0] += args.bulk_rate
+        for priority, rate in rates.items():
+            arrivals = int(rate) + (rng.random() < rate - int(rate))
+            queues[priority].extend([now] * arrivals)
+        for _ in range(args.capacity):
+            priority = pick(queues, now, args)
+            if priority is None:
+                break
+            latencies[priority].append(now - queues[priority].popleft())
+    return latencies
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, default=4)
+    parser.add_argument('--bulk-hours', type=float, default=2)
+    parser.add_argument('--bulk-rate', type=float, default=4,
+        help='extra urgent jobs per second during the bulk load')
+    parser.add_argument('--capacity', type=int, default=5,
+        help='jobs processed per second')
+    parser.add_argument('--aging-interval', type=int, default=300)
+    parser.add_argument('--candidates', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print('%-8s %8s %8s %10s %10s %10s' % (
+        'policy', 'priority', 'jobs', 'p50 s', 'p99 s', 'max s'))
+    for name, pick in [('strict', pick_strict), ('aging', pick_window),
+                       ('exact', pick_exact)]:
+        latencies = simulate(pick, args)
+        for priority in sorted(latencies):
+            values = latencies[priority]
+            print('%-8s %8d %8d %10d %10d %10d' % (name, priority, len(values),
+                percentile(values, 0.5), percentile(values, 0.99),
+                max(values) if values else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Measure the overhead of the sampling profiler on a CPU bound job run.
+
+Runs the same pure Python workload --repeat times without and with the
+profiler (alternating), and reports the median run times.
+
+    PYTHONPATH=. python benchmarks/profiler_overhead.py --interval 0.01
+"""
+import argparse
+import logging
+import statistics
+import tempfile
+import time
+from pyworker.profiler import SamplingProfiler
+
+
+def work(n):
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+
+class BusyJob(object):
+    class_name = 'BusyJob'
+    job_id = 1
+    logger = logging.getLogger('benchmark')
+
+    def __init__(self, n):
+        self.n = n
+
+    def run(self):
+        work(self.n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--interval', type=float, default=0.01)
+    parser.add_argument('--iterations', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=15)
+    args = parser.parse_args()
+
+    profiler = SamplingProfiler(tempfile.mkdtemp(), classes=['BusyJob'],
+        interval=args.interval)
+    job = BusyJob(args.iterations)
+    plain, profiled = [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        job.run()
+        plain.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        with profiler.profile(job):
+            job.run()
+        profiled.append(time.perf_counter() - start)
+    plain, profiled = statistics.median(plain), statistics.median(profiled)
+    print('interval %.3f s: %.3f s plain, %.3f s profiled, %+.1f%%' % (
+        args.interval, plain, profiled, 100.0 * (profiled - plain) / plain))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Measure the scheduler tick cost against the number of registered schedules.
+
+Schedules fire every --interval seconds with random offsets (cron minutes),
+the simulated clock advances one second per tick. Database calls go to an
+in-memory stub, so this measures the heap bookkeeping only.
+
+    python benchmarks/scheduler_tick.py --schedules 1000 10000 --ticks 3600
+"""
+import argparse
+import datetime
+import random
+import time
+from unittest.mock import MagicMock
+
+from pyworker.job import Job
+from pyworker.scheduler import Scheduler
+
+
+class StubCursor(object):
+    def execute(self, query, values=None):
+        self.locking = 'pg_try_advisory_xact_lock' in query
+
+    def fetchone(self):
+        # the lock is always granted, no schedule fired yet
+        return (True,) if self.locking else None
+
+
+class BenchmarkJob(Job):
+    def run(self):
+        pass
+
+
+def measure(schedules, ticks, interval):
+    start = datetime.datetime(2023, 10, 7)
+    now = [start]
+    database = MagicMock()
+    database.cursor.return_value = StubCursor()
+    scheduler = Scheduler(database, MagicMock(), clock=lambda: now[0])
+    BenchmarkJob.enqueue = MagicMock()
+    rng = random.Random(42)
+    for i in range(schedules):
+        scheduler.register(BenchmarkJob, name='schedule-%d' % i,
+            cron='%d * * * *' % rng.randrange(60) if interval == 3600 else None,
+            every=None if interval == 3600 else interval)
+    enqueued = 0
+    started = time.perf_counter()
+    for tick in range(ticks):
+        now[0] = start + datetime.timedelta(seconds=tick)
+        enqueued += scheduler.tick()
+    elapsed = time.perf_counter() - started
+    return elapsed / ticks * 1e6, elapsed / max(enqueued, 1) * 1e6, enqueued
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--schedules', type=int, nargs='+',
+        default=[100, 1000, 10000])
+    parser.add_argument('--ticks', type=int, default=3600)
+    parser.add_argument('--interval', type=int, default=3600,
+        help='seconds between occurrences, 3600 uses hourly cron expressions')
+    args = parser.parse_args()
+
+    print('%12s %12s %12s %12s' % ('schedules', 'us/tick', 'us/fire', 'enqueued'))
+    for schedules in args.schedules:
+        per_tick, per_fire, enqueued = measure(schedules, args.ticks,
+            args.interval)
+        print('%12d %12.1f %12.1f %12d' % (schedules, per_tick, per_fire,
+            enqueued))
+
+
+if __name__ == '__main__':
+    main()
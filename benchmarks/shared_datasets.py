@@ -0,0 +1,78 @@
+"""Load a dataset in several worker processes, privately or through the
+shared dataset cache, and report the loads, the time to the first byte and
+the memory used (proportional set size, shared pages split between
+processes).
+
+    PYTHONPATH=. python benchmarks/shared_datasets.py --processes 8 --mb 200
+"""
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+from pyworker.datasets import SharedDatasetCache
+
+
+def load(args):
+    time.sleep(args.load_seconds) # e.g. reading and parsing a file
+    return b'\x01' * (args.mb * 2 ** 20)
+
+
+def pss_bytes():
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def run(policy, args, directory, barrier, results):
+    barrier.wait()
+    start = time.time()
+    before = pss_bytes()
+    if policy == 'private':
+        data = memoryview(load(args))
+        loads = 1
+    else:
+        cache = SharedDatasetCache(directory)
+        dataset = cache.acquire('dataset', lambda: load(args))
+        data = dataset.buffer
+        loads = cache.loads
+    sum(data[::4096]) # touch every page
+    seconds = time.time() - start
+    barrier.wait() # everyone mapped, for a fair PSS
+    results.put((loads, seconds, pss_bytes() - before))
+    barrier.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--mb', type=int, default=200)
+    parser.add_argument('--load-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print('%-8s %6s %12s %12s %14s' % (
+        'policy', 'loads', 'mean s', 'max s', 'total MB'))
+    for policy in ['private', 'shared']:
+        directory = tempfile.mkdtemp(dir='/dev/shm')
+        barrier = multiprocessing.Barrier(args.processes)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=run,
+            args=(policy, args, directory, barrier, results))
+            for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        stats = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        shutil.rmtree(directory)
+        print('%-8s %6d %12.2f %12.2f %14.0f' % (policy,
+            sum(loads for loads, _, _ in stats),
+            sum(seconds for _, seconds, _ in stats) / len(stats),
+            max(seconds for _, seconds, _ in stats),
+            sum(pss for _, _, pss in stats) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
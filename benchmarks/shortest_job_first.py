@@ -0,0 +1,92 @@
+"""Simulate a mix of long batch jobs and short interactive jobs of the same
+priority and report pickup latency per kind of job.
+
+Batch jobs (about --batch-seconds long each) arrive every --batch-interval
+seconds and interactive jobs (about 1 second long) every --interval seconds,
+on average. --workers workers claim jobs. Policies:
+
+  fifo  ORDER BY priority, run_at (the default claim)
+  sjf   among the first --candidates ready jobs, the shortest expected one,
+        unless a job waited more than --max-wait seconds
+        (Worker.shortest_job_first), run times learned by DurationEstimator
+
+    PYTHONPATH=. python benchmarks/shortest_job_first.py --workers 4
+"""
+import argparse
+import heapq
+import random
+from pyworker.durations import DurationEstimator
+
+
+def simulate(policy, args):
+    rng = random.Random(args.seed)
+    arrivals = []
+    for kind, interval in [('batch', args.batch_interval),
+                           ('interactive', args.interval)]:
+        t = 0.0
+        while t < args.seconds:
+            t += rng.expovariate(1.0 / interval)
+            arrivals.append((t, kind))
+    arrivals.sort()
+    mean = {'batch': args.batch_seconds, 'interactive': 1.0}
+    estimator = DurationEstimator()
+    ready = [] # (enqueued at, kind), in run_at order
+    free_at = [0.0] * args.workers # heap of the times workers get free
+    latencies = {'batch': [], 'interactive': []}
+    i = 0
+    while i < len(arrivals) or ready:
+        now = heapq.heappop(free_at)
+        if not ready and arrivals[i][0] > now:
+            now = arrivals[i][0]
+        while i < len(arrivals) and arrivals[i][0] <= now:
+            ready.append(arrivals[i])
+            i += 1
+        index = 0
+        if policy == 'sjf':
+            candidates = ready[:args.candidates]
+            index = min(range(len(candidates)), key=lambda c: (
+                candidates[c][0] >= now - args.max_wait,
+                estimator.expected(candidates[c][1]) or 0,
+                candidates[c][0]))
+        enqueued_at, kind = ready.pop(index)
+        latencies[kind].append(now - enqueued_at)
+        seconds = rng.uniform(0.5, 1.5) * mean[kind]
+        estimator.record(kind, seconds)
+        heapq.heappush(free_at, now + seconds)
+    return latencies
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-seconds', type=float, default=60)
+    parser.add_argument('--batch-interval', type=float, default=20,
+        help='mean seconds between two batch jobs')
+    parser.add_argument('--interval', type=float, default=2,
+        help='mean seconds between two interactive jobs')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--candidates', type=int, default=100)
+    parser.add_argument('--max-wait', type=float, default=600)
+    parser.add_argument('--seconds', type=int, default=14400)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print('%-6s %-12s %8s %10s %10s %10s' % (
+        'policy', 'kind', 'jobs', 'mean s', 'p99 s', 'max s'))
+    for policy in ['fifo', 'sjf']:
+        latencies = simulate(policy, args)
+        for kind in ['batch', 'interactive']:
+            values = latencies[kind]
+            print('%-6s %-12s %8d %10.1f %10.1f %10.1f' % (policy, kind,
+                len(values), sum(values) / len(values),
+                percentile(values, 0.99), max(values)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import json
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+class ResourceAccountant(object):
+    '''Measures the resources used by each job execution and aggregates
+    them per job class: CPU user/system time, wall time and the growth of
+    the process peak RSS (only grows when a job needs more memory than any
+    job before it). A `tracemalloc_sample_rate` fraction of jobs is traced
+    to also record their top allocation sites.'''
+
+    def __init__(self, tracemalloc_sample_rate=0.0, tracemalloc_top=10,
+                 dump_path=None, dump_interval=60, rng=None):
+        super(ResourceAccountant, self).__init__()
+        self.tracemalloc_sample_rate = tracemalloc_sample_rate
+        self.tracemalloc_top = tracemalloc_top
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self._rng = rng or random.Random()
+        self._dumped_at = time.time()
+        self.stats = {}
+
+    @contextmanager
+    def measure(self, job):
+        '''Yields a dict filled with the job usage when the block exits'''
+        usage = {}
+        traced = self._rng.random() < self.tracemalloc_sample_rate
+        started_tracing = traced and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        start_time = time.time()
+        try:
+            yield usage
+        finally:
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            usage['wall_seconds'] = time.time() - start_time
+            usage['cpu_user_seconds'] = after.ru_utime - before.ru_utime
+            usage['cpu_system_seconds'] = after.ru_stime - before.ru_stime
+            usage['max_rss_delta_bytes'] = \
+                (after.ru_maxrss - before.ru_maxrss) * _MAXRSS_UNIT
+            if traced:
+                snapshot = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+                usage['top_allocations'] = [
+                    '%s: %d bytes in %d blocks' % (stat.traceback, stat.size, stat.count)
+                    for stat in snapshot.statistics('lineno')[:self.tracemalloc_top]]
+            self.record(job.class_name, usage)
+
+    def record(self, class_name, usage):
+        stats = self.stats.get(class_name)
+        if stats is None:
+            stats = self.stats[class_name] = {
+                'count': 0,
+                'wall_seconds': 0.0,
+                'cpu_user_seconds': 0.0,
+                'cpu_system_seconds': 0.0,
+                'max_rss_delta_bytes': 0
+            }
+        stats['count'] += 1
+        for key in ['wall_seconds', 'cpu_user_seconds', 'cpu_system_seconds']:
+            stats[key] += usage[key]
+        stats['max_rss_delta_bytes'] = max(stats['max_rss_delta_bytes'],
+            usage['max_rss_delta_bytes'])
+        if 'top_allocations' in usage:
+            stats['last_top_allocations'] = usage['top_allocations']
+        self.maybe_dump()
+
+    def summary(self):
+        '''Per job class totals and averages'''
+        summary = {}
+        for class_name, stats in self.stats.items():
+            summary[class_name] = dict(stats)
+            for key in ['wall_seconds', 'cpu_user_seconds', 'cpu_system_seconds']:
+                summary[class_name]['avg_' + key] = stats[key] / stats['count']
+        return summary
+
+    def maybe_dump(self):
+        if self.dump_path and time.time() - self._dumped_at >= self.dump_interval:
+            self.dump()
+
+    def dump(self, path=None):
+        path = path or self.dump_path
+        self._dumped_at = time.time()
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
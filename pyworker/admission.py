@@ -0,0 +1,186 @@
+import os
+import tempfile
+from contextlib import contextmanager, ExitStack
+
+
+CGROUP_CPU_STATS = [
+    '/sys/fs/cgroup/cpu.stat', # cgroup v2
+    '/sys/fs/cgroup/cpu,cpuacct/cpu.stat', # cgroup v1
+    '/sys/fs/cgroup/cpu/cpu.stat',
+]
+
+
+class LoadAverageCheck(object):
+    '''Defers while the 1 minute load average per CPU exceeds max_load'''
+    name = 'LoadAverage'
+
+    def __init__(self, max_load=1.0, cpu_count=None, loadavg=os.getloadavg):
+        super(LoadAverageCheck, self).__init__()
+        self.max_load = max_load
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        self._loadavg = loadavg
+
+    def check(self):
+        load = self._loadavg()[0] / self.cpu_count
+        if load > self.max_load:
+            return 'load average %.2f per CPU > %.2f' % (load, self.max_load)
+        return None
+
+
+class AvailableMemoryCheck(object):
+    '''Defers while the memory available for new work (MemAvailable in
+    /proc/meminfo) is below min_bytes or below min_ratio of the total'''
+    name = 'AvailableMemory'
+
+    def __init__(self, min_bytes=None, min_ratio=0.1, path='/proc/meminfo'):
+        super(AvailableMemoryCheck, self).__init__()
+        self.min_bytes = min_bytes
+        self.min_ratio = min_ratio
+        self.path = path
+
+    def _meminfo(self):
+        meminfo = {}
+        with open(self.path) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                fields = value.split()
+                if fields:
+                    # kB, whatever the line says
+                    meminfo[key] = int(fields[0]) * 1024
+        return meminfo
+
+    def check(self):
+        try:
+            meminfo = self._meminfo()
+            available, total = meminfo['MemAvailable'], meminfo['MemTotal']
+        except (OSError, IOError, ValueError, KeyError):
+            return None # no procfs (or too old a kernel), nothing to tell
+        if self.min_bytes and available < self.min_bytes:
+            return 'available memory %d MB < %d MB' % (
+                available // 2 ** 20, self.min_bytes // 2 ** 20)
+        if self.min_ratio and available < self.min_ratio * total:
+            return 'available memory %.1f%% < %.1f%%' % (
+                100.0 * available / total, 100.0 * self.min_ratio)
+        return None
+
+
+class CpuThrottlingCheck(object):
+    '''Defers while the cgroup of the worker is CPU throttled in more than
+    max_ratio of its scheduling periods, since the previous check'''
+    name = 'CpuThrottling'
+
+    def __init__(self, max_ratio=0.1, path=None):
+        super(CpuThrottlingCheck, self).__init__()
+        self.max_ratio = max_ratio
+        self.path = path
+        self._previous = None
+
+    def _stats(self):
+        paths = [self.path] if self.path else CGROUP_CPU_STATS
+        for path in paths:
+            try:
+                with open(path) as f:
+                    stats = dict(line.split() for line in f if line.strip())
+                return int(stats['nr_periods']), int(stats['nr_throttled'])
+            except (OSError, IOError, ValueError, KeyError):
+                continue
+        return None
+
+    def check(self):
+        stats = self._stats()
+        previous, self._previous = self._previous, stats
+        if stats is None or previous is None:
+            return None
+        periods = stats[0] - previous[0]
+        if periods <= 0:
+            return None
+        ratio = float(stats[1] - previous[1]) / periods
+        if ratio > self.max_ratio:
+            return 'CPU throttled in %.1f%% of periods > %.1f%%' % (
+                100.0 * ratio, 100.0 * self.max_ratio)
+        return None
+
+
+class InFlightCheck(object):
+    '''Defers while max_jobs jobs already run on the host, counted over the
+    workers sharing `directory`: each one holds a file named after its pid
+    in there while it runs a job'''
+    name = 'InFlight'
+
+    def __init__(self, max_jobs, directory=None):
+        super(InFlightCheck, self).__init__()
+        self.max_jobs = max_jobs
+        self.directory = directory or \
+            os.path.join(tempfile.gettempdir(), 'pyworker-in-flight')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def in_flight(self):
+        count = 0
+        for entry in os.listdir(self.directory):
+            try:
+                os.kill(int(entry), 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                # left behind by a killed worker
+                try:
+                    os.remove(os.path.join(self.directory, entry))
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass # alive, run by another user
+            count += 1
+        return count
+
+    def check(self):
+        count = self.in_flight()
+        if count >= self.max_jobs:
+            return '%d jobs in flight >= %d' % (count, self.max_jobs)
+        return None
+
+    @contextmanager
+    def track(self):
+        path = os.path.join(self.directory, str(os.getpid()))
+        open(path, 'w').close()
+        try:
+            yield
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class AdmissionControl(object):
+    '''Checks run by the worker before claiming a job. While one of them
+    defers, the worker leaves the jobs in the queue for less loaded workers
+    and checks again after retry_delay seconds.
+
+    A check is any object with a `name` and a `check()` method returning
+    why claiming should wait, or None. It may also have a `track()` context
+    manager, entered while the worker runs a job.'''
+
+    def __init__(self, checks, retry_delay=1):
+        super(AdmissionControl, self).__init__()
+        self.checks = list(checks)
+        self.retry_delay = retry_delay
+        self.deferrals = {} # check name: count
+
+    def check(self):
+        '''Returns the name and reason of the first deferring check,
+        or None to claim'''
+        for check in self.checks:
+            reason = check.check()
+            if reason is not None:
+                self.deferrals[check.name] = self.deferrals.get(check.name, 0) + 1
+                return check.name, reason
+        return None
+
+    @contextmanager
+    def track(self):
+        with ExitStack() as stack:
+            for check in self.checks:
+                if hasattr(check, 'track'):
+                    stack.enter_context(check.track())
+            yield
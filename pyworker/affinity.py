@@ -0,0 +1,118 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from pyworker.util import get_current_time, get_time_delta
+
+
+def rendezvous_owner(key, workers):
+    '''The worker owning a key: the highest md5(key:worker), as computed
+    by the claim query. Owners only change for the keys of the workers
+    joining or leaving.'''
+    return max(workers, key=lambda worker: hashlib.md5(
+        ('%s:%s' % (key, worker)).encode('utf-8')).hexdigest())
+
+
+# an attribute scalar of a YAML handler, single quoted, double quoted or plain;
+# raw attributes are indented by 4 spaces, see Job.build_handler
+_KEY_PATTERN = "\n    %s: (?:'((?:[^'\n]|'')*)'|\"([^\"\n]*)\"|([^'\"\n][^\n]*))"
+
+
+def handler_key(raw_handler, attribute):
+    '''The affinity key of a job read from its handler as the claim query
+    does (see handler_key_sql): the text of the attribute, unquoted'''
+    match = re.search(_KEY_PATTERN % re.escape(attribute), raw_handler)
+    if match is None:
+        return None
+    single, double, plain = match.groups()
+    if single is not None:
+        return single.replace("''", "'")
+    return double if double is not None else plain
+
+
+def handler_key_sql(attribute):
+    '''SQL reading the affinity key of a delayed_jobs row from its handler,
+    as handler_key does'''
+    pattern = (_KEY_PATTERN % attribute).replace('\\', '\\\\') \
+        .replace('\n', '\\n').replace("'", "''")
+    return "(SELECT coalesce(replace(key_match.groups[1], '''''', ''''), " \
+        "key_match.groups[2], key_match.groups[3]) " \
+        "FROM regexp_match(handler, E'%s') AS key_match(groups))" % pattern
+
+
+class Affinity(object):
+    '''Routes the jobs of a same key (e.g. a project whose dataset the jobs
+    load) to the workers that served it recently, and otherwise to the live
+    worker owning the key by rendezvous hashing. A worker leaves the jobs
+    of the keys it neither served nor owns to their owner, unless they
+    waited more than max_wait seconds.
+
+    The key is read from the `column` of delayed_jobs when set, otherwise
+    from the attribute named by the `affinity_attribute` of each job class.
+    Live workers are those with a recent heartbeat in `table`.'''
+
+    def __init__(self, database, column=None, warm_keys=100, max_wait=30,
+                 candidates=100, heartbeat_interval=10,
+                 table='pyworker_workers', clock=time.monotonic):
+        super(Affinity, self).__init__()
+        self.database = database
+        self.column = column
+        self.warm_keys = warm_keys
+        self.max_wait = max_wait
+        self.candidates = candidates
+        self.heartbeat_interval = heartbeat_interval
+        self.table = table
+        self._clock = clock
+        self._warm = OrderedDict()
+        self._heartbeat_at = None
+        self.live_workers = []
+
+    def ensure_schema(self):
+        self.database.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                name text PRIMARY KEY,
+                heartbeat_at timestamp NOT NULL
+            )
+        '''.format(table=self.table))
+        self.database.commit()
+
+    def served(self, key):
+        '''Records a key served by this worker, its jobs now go first'''
+        key = str(key)
+        self._warm[key] = True
+        self._warm.move_to_end(key)
+        while len(self._warm) > self.warm_keys:
+            self._warm.popitem(last=False)
+
+    def warm(self):
+        return list(self._warm)
+
+    def maybe_heartbeat(self, name):
+        now = self._clock()
+        if self._heartbeat_at is None or \
+                now - self._heartbeat_at >= self.heartbeat_interval:
+            self._heartbeat_at = now
+            self.heartbeat(name)
+
+    def heartbeat(self, name):
+        '''Marks this worker alive and reads the live workers'''
+        now = get_current_time()
+        cursor = self.database.cursor()
+        cursor.execute('''
+            INSERT INTO {table} (name, heartbeat_at) VALUES (%s, %s)
+            ON CONFLICT (name) DO UPDATE SET heartbeat_at = EXCLUDED.heartbeat_at
+        '''.format(table=self.table), (name, now))
+        # a few missed heartbeats before a worker is considered gone
+        cursor.execute('SELECT name FROM {table} WHERE heartbeat_at > %s ' \
+            'ORDER BY name'.format(table=self.table),
+            (now - get_time_delta(seconds=3 * self.heartbeat_interval),))
+        self.live_workers = [row[0] for row in cursor.fetchall()]
+        self.database.commit()
+
+    def leave(self, name):
+        '''Hands the keys of this worker over to the others right away'''
+        self.database.cursor().execute(
+            'DELETE FROM {table} WHERE name = %s'.format(table=self.table),
+            (name,))
+        self.database.commit()
+        self.live_workers = []
@@ -0,0 +1,145 @@
+import time
+from pyworker.util import get_current_time, get_time_delta
+
+
+class Archiver(object):
+    '''Moves permanently failed jobs out of delayed_jobs, in batches,
+    into an archive table partitioned by month of archival.
+
+    The archive table has the same columns as delayed_jobs (in the same order)
+    plus `archived_at`. When delayed_jobs gains columns, the archive table
+    must be altered accordingly.'''
+
+    def __init__(self, database, logger, table='delayed_jobs_archive',
+                 batch_size=1000, failed_older_than=0, max_batches=None,
+                 include_completed=False, reporter=None):
+        super(Archiver, self).__init__()
+        self.database = database
+        self.logger = logger
+        self.table = table
+        self.batch_size = batch_size
+        self.failed_older_than = failed_older_than # seconds
+        self.max_batches = max_batches
+        self.include_completed = include_completed
+        self.reporter = reporter
+        self._partitions = set()
+        self._bound = {}
+
+    def bind(self, database):
+        '''Same archiver in another jobs database (e.g. another shard)'''
+        if database is self.database:
+            return self
+        if id(database) not in self._bound:
+            self._bound[id(database)] = Archiver(database, self.logger,
+                table=self.table, batch_size=self.batch_size,
+                failed_older_than=self.failed_older_than,
+                max_batches=self.max_batches,
+                include_completed=self.include_completed, reporter=self.reporter)
+        return self._bound[id(database)]
+
+    def ensure_schema(self, now=None):
+        cursor = self.database.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                LIKE delayed_jobs INCLUDING DEFAULTS,
+                archived_at timestamp NOT NULL
+            ) PARTITION BY RANGE (archived_at)
+        '''.format(table=self.table))
+        self.database.commit()
+        self.ensure_partitions(now)
+
+    def ensure_partitions(self, now=None):
+        '''Creates the partitions of this month and the next one, ahead of
+        the completions archived inside job transactions'''
+        now = now or get_current_time()
+        self._ensure_partition(now)
+        self._ensure_partition(now.replace(day=1) + get_time_delta(months=1))
+
+    def _ensure_partition(self, now):
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        partition = '%s_%s' % (self.table, start.strftime('%Y%m'))
+        if partition in self._partitions:
+            return
+        end = start + get_time_delta(months=1)
+        cursor = self.database.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+            FOR VALUES FROM ('{start}') TO ('{end}')
+        '''.format(partition=partition, table=self.table,
+                   start=start.date(), end=end.date()))
+        self.database.commit()
+        self._partitions.add(partition)
+
+    def archive_batch(self, now=None):
+        '''Archives up to batch_size failed jobs in a single statement,
+        returns the number of archived jobs'''
+        now = now or get_current_time()
+        failed_before = now - get_time_delta(seconds=self.failed_older_than)
+        try:
+            self._ensure_partition(now)
+            cursor = self.database.cursor()
+            cursor.execute('''
+                WITH moved AS (
+                    DELETE FROM delayed_jobs WHERE id IN (
+                        SELECT id FROM delayed_jobs
+                        WHERE failed_at IS NOT NULL AND failed_at <= %s
+                        ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+                    RETURNING delayed_jobs.*)
+                INSERT INTO {table} SELECT moved.*, %s FROM moved
+            '''.format(table=self.table), (failed_before, self.batch_size, now))
+            self.database.commit()
+        except Exception:
+            # e.g. the archive table lacks a column added to delayed_jobs
+            self.database.rollback()
+            raise
+        return cursor.rowcount
+
+    def archive(self, max_batches=None):
+        '''Archives failed jobs until none is left or max_batches is reached,
+        returns throughput stats'''
+        max_batches = max_batches or self.max_batches
+        self.ensure_partitions()
+        start_time = time.time()
+        archived = batches = 0
+        while max_batches is None or batches < max_batches:
+            count = self.archive_batch()
+            batches += 1
+            archived += count
+            if count < self.batch_size:
+                break
+        seconds = time.time() - start_time
+        stats = {
+            'archived': archived,
+            'batches': batches,
+            'seconds': seconds,
+            'rows_per_second': archived / seconds if seconds > 0 else 0.0
+        }
+        self.logger.info('Archived %d failed jobs in %d batches (%.1f rows/s)',
+            archived, batches, stats['rows_per_second'], phase='archive')
+        if self.reporter:
+            self.reporter.record_metric('Custom/Archiver/Archived', archived)
+            self.reporter.record_metric('Custom/Archiver/RowsPerSecond',
+                stats['rows_per_second'])
+        return stats
+
+    def archive_completed(self, job_ids, now=None, locked_by=None,
+                          commit=True):
+        '''Moves successfully completed jobs to the archive instead of
+        deleting them, in one statement. With locked_by, only the jobs
+        still locked by that worker are moved. Returns their number.
+
+        Nothing is committed but the move (when commit is set): the
+        partition must exist, see ensure_partitions.'''
+        now = now or get_current_time()
+        guard = 'AND locked_by = %(locked_by)s' if locked_by is not None else ''
+        cursor = self.database.cursor()
+        cursor.execute('''
+            WITH moved AS (
+                DELETE FROM delayed_jobs WHERE id = ANY(%(job_ids)s) {guard}
+                RETURNING delayed_jobs.*)
+            INSERT INTO {table} SELECT moved.*, %(now)s FROM moved
+        '''.format(table=self.table, guard=guard),
+            {'job_ids': list(job_ids), 'now': now, 'locked_by': locked_by})
+        if commit:
+            self.database.commit()
+        return cursor.rowcount
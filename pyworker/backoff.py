@@ -0,0 +1,76 @@
+import random
+
+
+class RetryAfterException(Exception):
+    '''Raise from a job to ask for the next attempt after `retry_after` seconds'''
+    def __init__(self, message='', retry_after=None):
+        super(RetryAfterException, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class Backoff(object):
+    '''Base retry backoff policy, returns the delay in seconds before
+    the next attempt of a job that has just failed'''
+
+    def delay(self, job):
+        raise NotImplementedError
+
+
+class ExponentialBackoff(Backoff):
+    '''delayed_job default: attempts**4 + 5 seconds'''
+
+    def delay(self, job):
+        return (job.attempts ** 4) + 5
+
+
+class LinearBackoff(Backoff):
+    '''base + step * attempts seconds'''
+
+    def __init__(self, step=60, base=5):
+        super(LinearBackoff, self).__init__()
+        self.step = step
+        self.base = base
+
+    def delay(self, job):
+        return self.base + self.step * job.attempts
+
+
+class FullJitterBackoff(Backoff):
+    '''Full jitter: delay = uniform(0, min(cap, base * 2**attempts)), so that
+    jobs failing together do not all come back at the same time'''
+
+    def __init__(self, base=5, cap=None, rng=None):
+        super(FullJitterBackoff, self).__init__()
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.Random()
+
+    def delay(self, job):
+        upper = self.base * 2 ** job.attempts
+        if self.cap:
+            upper = min(upper, self.cap)
+        return self.rng.uniform(0, upper)
+
+
+class DecorrelatedJitterBackoff(Backoff):
+    '''Decorrelated jitter: delay = min(cap, uniform(base, previous * 3)).
+    The previous delays are not stored anywhere, so the sequence is replayed
+    from a generator seeded with the job id: every job gets a stable but
+    distinct sequence of delays'''
+
+    def __init__(self, base=5, cap=None):
+        super(DecorrelatedJitterBackoff, self).__init__()
+        self.base = base
+        self.cap = cap
+
+    def delay(self, job):
+        rng = random.Random(job.job_id)
+        delay = self.base
+        for _ in range(job.attempts):
+            delay = rng.uniform(self.base, delay * 3)
+            if self.cap:
+                delay = min(delay, self.cap)
+        return delay
+
+
+DEFAULT_BACKOFF = ExponentialBackoff()
@@ -0,0 +1,56 @@
+import json
+from pyworker.util import get_current_time
+
+
+class CheckpointStore(object):
+    '''Progress states of running jobs, in a side table of the jobs
+    database. A job resumes from its last checkpoint when it is retried.
+    Rows reference delayed_jobs and go away with their job.'''
+
+    def __init__(self, database, table='delayed_job_checkpoints'):
+        super(CheckpointStore, self).__init__()
+        self.database = database
+        self.table = table
+
+    def bind(self, database):
+        '''Same store in another jobs database (e.g. another shard)'''
+        if database is self.database:
+            return self
+        return CheckpointStore(database, table=self.table)
+
+    def ensure_schema(self):
+        self.database.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                job_id bigint PRIMARY KEY
+                    REFERENCES delayed_jobs (id) ON DELETE CASCADE,
+                state text NOT NULL,
+                updated_at timestamp NOT NULL
+            )
+        '''.format(table=self.table))
+        self.database.commit()
+
+    def save(self, job_id, state):
+        '''Stores the JSON serializable state of a job, and commits'''
+        self.database.cursor().execute('''
+            INSERT INTO {table} (job_id, state, updated_at) VALUES (%s, %s, %s)
+            ON CONFLICT (job_id) DO UPDATE
+            SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at
+        '''.format(table=self.table),
+            (job_id, json.dumps(state), get_current_time()))
+        self.database.commit()
+
+    def load(self, job_id):
+        '''Returns the last stored state of a job, or None'''
+        cursor = self.database.cursor()
+        cursor.execute('SELECT state FROM {table} WHERE job_id = %s'.format(
+            table=self.table), (job_id,))
+        row = cursor.fetchone()
+        # no transaction left open (nor snapshot held) while the job runs
+        self.database.commit()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, job_id):
+        self.database.cursor().execute(
+            'DELETE FROM {table} WHERE job_id = %s'.format(table=self.table),
+            (job_id,))
+        self.database.commit()
@@ -0,0 +1,85 @@
+import time
+from collections import deque
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Circuit(object):
+    def __init__(self, window_size):
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window_size)
+        self.opened_at = None
+
+
+class CircuitBreaker(object):
+    '''Per job class circuit breaker.
+
+    Outcomes of the last `window_size` jobs of each class are kept. Once at
+    least `min_calls` outcomes are known and the error rate reaches
+    `error_rate_threshold`, the circuit opens and the class is excluded from
+    claiming for `cooldown` seconds. After the cooldown the circuit is half
+    open: the class is claimable again and the next outcome either closes
+    the circuit (success) or opens it for another cooldown (error).'''
+
+    def __init__(self, error_rate_threshold=0.5, window_size=20,
+                 min_calls=10, cooldown=60, clock=time.monotonic):
+        super(CircuitBreaker, self).__init__()
+        self.error_rate_threshold = error_rate_threshold
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._clock = clock
+        self._circuits = {}
+
+    def _circuit(self, class_name):
+        circuit = self._circuits.get(class_name)
+        if circuit is None:
+            circuit = self._circuits[class_name] = _Circuit(self.window_size)
+        return circuit
+
+    def state(self, class_name):
+        circuit = self._circuits.get(class_name)
+        if circuit is None:
+            return CLOSED
+        if circuit.state == OPEN and \
+                self._clock() - circuit.opened_at >= self.cooldown:
+            circuit.state = HALF_OPEN
+        return circuit.state
+
+    def states(self):
+        return {class_name: self.state(class_name)
+                for class_name in self._circuits}
+
+    def excluded_classes(self):
+        '''Job classes that must be left out of the claim query'''
+        return sorted(class_name
+                      for class_name, state in self.states().items()
+                      if state == OPEN)
+
+    def record(self, class_name, error):
+        '''Records a job outcome, returns the new state if it changed'''
+        previous = self.state(class_name)
+        circuit = self._circuit(class_name)
+        if previous == HALF_OPEN:
+            circuit.outcomes.clear()
+            if error:
+                self._open(circuit)
+            else:
+                circuit.state = CLOSED
+        else:
+            circuit.outcomes.append(bool(error))
+            calls = len(circuit.outcomes)
+            if previous == CLOSED and calls >= self.min_calls and \
+                    sum(circuit.outcomes) >= self.error_rate_threshold * calls:
+                self._open(circuit)
+        if circuit.state != previous:
+            return circuit.state
+        return None
+
+    def _open(self, circuit):
+        circuit.state = OPEN
+        circuit.opened_at = self._clock()
+        circuit.outcomes.clear()
@@ -0,0 +1,206 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+
+
+# 8 bytes header length, JSON header, padding up to the data offset
+_HEADER_LENGTH = struct.Struct('<Q')
+_ALIGNMENT = 64
+
+
+def default_directory():
+    # tmpfs: the files are the shared memory, mapped by every process
+    shm = '/dev/shm'
+    base = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) \
+        else tempfile.gettempdir()
+    return os.path.join(base, 'pyworker-datasets')
+
+
+class SharedDataset(object):
+    '''A dataset mapped read-only in this process. The file stays mapped,
+    and can not be evicted, until every reference to it is released.'''
+
+    def __init__(self, key, path, fd, mapped, header, offset):
+        super(SharedDataset, self).__init__()
+        self.key = key
+        self.path = path
+        self.header = header
+        self.size = header['size']
+        self._fd = fd # holds a shared lock, the reference of this process
+        self._mmap = mapped
+        self._offset = offset
+        self.references = 0
+
+    @property
+    def buffer(self):
+        '''Zero-copy read-only view of the data'''
+        return memoryview(self._mmap)[self._offset:self._offset + self.size]
+
+    def array(self):
+        '''Zero-copy read-only NumPy view of an array dataset'''
+        # imported here, numpy is optional
+        import numpy
+        if 'dtype' not in self.header:
+            raise ValueError('Dataset %s is not an array' % self.key)
+        return numpy.frombuffer(self._mmap, dtype=self.header['dtype'],
+            count=self.size // numpy.dtype(self.header['dtype']).itemsize,
+            offset=self._offset).reshape(self.header['shape'])
+
+    def close(self):
+        '''Unmaps the dataset, returns False while views of it are alive'''
+        try:
+            self._mmap.close()
+        except BufferError:
+            return False
+        os.close(self._fd)
+        return True
+
+
+class SharedDatasetCache(object):
+    '''Read-only datasets shared by the worker processes of a host, as
+    files mapped in memory (on /dev/shm when available).
+
+    The first process requesting a key loads it, under an exclusive lock
+    of the key, while the others wait and then map the same file. Each
+    process holding a dataset keeps a shared lock on its file: datasets
+    are only evicted, least recently used first, when no process holds
+    them and the files exceed max_bytes.'''
+
+    def __init__(self, directory=None, max_bytes=None):
+        super(SharedDatasetCache, self).__init__()
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.loads = 0
+        self.hits = 0
+        self._datasets = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    @contextmanager
+    def _locked(self, path):
+        # serializes loading, mapping and evicting a key across processes
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def acquire(self, key, loader):
+        '''Returns the dataset of key, calling loader() to build it if no
+        process did yet. The loader returns bytes or a NumPy array. Each
+        acquire must be followed by a release.'''
+        dataset = self._datasets.get(key)
+        if dataset is None:
+            path = self._path(key)
+            with self._locked(path):
+                if os.path.exists(path):
+                    self.hits += 1
+                else:
+                    self._write(key, path, loader())
+                    self.loads += 1
+                dataset = self._map(key, path)
+            self._datasets[key] = dataset
+            if self.max_bytes is not None:
+                self.evict()
+        dataset.references += 1
+        return dataset
+
+    def release(self, dataset):
+        dataset.references -= 1
+        if dataset.references <= 0 and dataset.close():
+            del self._datasets[dataset.key]
+
+    @contextmanager
+    def open(self, key, loader):
+        dataset = self.acquire(key, loader)
+        try:
+            yield dataset
+        finally:
+            self.release(dataset)
+
+    def _write(self, key, path, data):
+        header = {'key': key}
+        if hasattr(data, 'dtype') and hasattr(data, 'shape'):
+            header.update(dtype=data.dtype.str, shape=list(data.shape))
+            # imported here, only arrays need it
+            import numpy
+            data = numpy.ascontiguousarray(data).data.cast('B')
+        else:
+            data = memoryview(data).cast('B')
+        header['size'] = data.nbytes
+        encoded = json.dumps(header).encode('utf-8')
+        offset = _HEADER_LENGTH.size + len(encoded)
+        padding = -offset % _ALIGNMENT
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER_LENGTH.pack(len(encoded) + padding))
+                f.write(encoded + b' ' * padding)
+                f.write(data)
+            # readers only ever see complete files
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _map(self, key, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            os.utime(fd) # last use, for eviction
+            mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            os.close(fd)
+            raise
+        length, = _HEADER_LENGTH.unpack_from(mapped)
+        offset = _HEADER_LENGTH.size + length
+        header = json.loads(bytes(mapped[_HEADER_LENGTH.size:offset]).decode('utf-8'))
+        return SharedDataset(key, path, fd, mapped, header, offset)
+
+    def evict(self):
+        '''Removes the datasets no process holds, least recently used first,
+        until the files fit in max_bytes. Returns the number removed.'''
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if '.' in name:
+                continue # lock and temporary files
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if self._evict(path):
+                total -= size
+                evicted += 1
+        return evicted
+
+    def _evict(self, path):
+        with self._locked(path):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                return False
+            try:
+                # held by a process as long as it has a shared lock on it
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+            finally:
+                os.close(fd)
+            os.unlink(path)
+            return True
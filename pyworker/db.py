@@ -4,7 +4,6 @@ if major_version == 2:
     from urlparse import urlparse, parse_qs
 elif major_version == 3:
     from urllib.parse import urlparse, parse_qs
-import psycopg2
 
 class DBConnector(object):
     def __init__(self, dbstring, logger):
@@ -18,8 +17,12 @@ class DBConnector(object):
         qs = parse_qs(url.query)
         self._sslmode = qs.get('sslmode', ['prefer'])[0]
         self.logger = logger
+        self._connection = None
 
     def connect(self): 
+        if self._connection is not None and not self._connection.closed:
+            return self # e.g. connected on first use by a setup step
+        import psycopg2 # loaded on first connection, keeps imports fast
         self._connection = psycopg2.connect(database=self._database,
             user=self._username, password=self._passwd,
             host=self._host, port=self._port, sslmode=self._sslmode)
@@ -27,11 +30,26 @@ class DBConnector(object):
         self.logger.info("Connected to database")
         return self
         
+    def _connected(self):
+        # connects on first use, so that tables can be created before run()
+        return self.connect()._connection
+
     def cursor(self):
-        return self._connection.cursor()
+        return self._connected().cursor()
 
     def commit(self):
-        self._connection.commit()
+        self._connected().commit()
+
+    def rollback(self):
+        self._connected().rollback()
+
+    def in_transaction(self):
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+        return self._connected().get_transaction_status() != \
+            TRANSACTION_STATUS_IDLE
+
+    def set_autocommit(self, autocommit):
+        self._connected().autocommit = autocommit
 
     def disconnect(self):
         self._connection.close(); 
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def attributes_digest(class_name, attributes):
+    '''Stable digest of a job class and its parsed attributes'''
+    serialized = json.dumps([class_name, attributes], sort_keys=True,
+        default=str, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def handler_digest(handler):
+    '''md5 of the raw handler, matches md5(handler) computed by Postgres'''
+    return hashlib.md5(handler.encode('utf-8')).hexdigest()
+
+
+class DigestCache(object):
+    '''Bounded LRU of the digests of recently completed jobs'''
+
+    def __init__(self, maxsize=10000, clock=time.monotonic):
+        super(DigestCache, self).__init__()
+        self.maxsize = maxsize
+        self._clock = clock
+        self._completed_at = OrderedDict()
+
+    def add(self, digest):
+        self._completed_at[digest] = self._clock()
+        self._completed_at.move_to_end(digest)
+        while len(self._completed_at) > self.maxsize:
+            self._completed_at.popitem(last=False)
+
+    def seen_within(self, digest, seconds):
+        completed_at = self._completed_at.get(digest)
+        if completed_at is None:
+            return False
+        if self._clock() - completed_at > seconds:
+            del self._completed_at[digest]
+            return False
+        return True
+
+    def __len__(self):
+        return len(self._completed_at)
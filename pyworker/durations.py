@@ -0,0 +1,98 @@
+import math
+from pyworker.util import get_current_time
+
+
+class DurationEstimate(object):
+    '''Exponentially weighted mean and mean absolute deviation of the run
+    time of a job class'''
+
+    def __init__(self, mean, deviation=0.0, samples=1):
+        super(DurationEstimate, self).__init__()
+        self.mean = mean
+        self.deviation = deviation
+        self.samples = samples
+
+    def update(self, seconds, alpha):
+        self.deviation += alpha * (abs(seconds - self.mean) - self.deviation)
+        self.mean += alpha * (seconds - self.mean)
+        self.samples += 1
+
+    def high(self, deviations=3):
+        '''Pessimistic run time, well above most runs'''
+        return self.mean + deviations * self.deviation
+
+
+class DurationEstimator(object):
+    '''Rolling per job class run time estimates, learned from successful
+    runs. Estimates can be shared by the workers of a fleet through a
+    small table, see sync.'''
+
+    def __init__(self, alpha=0.2, min_samples=5, limit_factor=3,
+                 min_run_time=60, table='pyworker_job_durations'):
+        super(DurationEstimator, self).__init__()
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.limit_factor = limit_factor
+        self.min_run_time = min_run_time
+        self.table = table
+        self.estimates = {}
+
+    def record(self, class_name, seconds):
+        estimate = self.estimates.get(class_name)
+        if estimate is None:
+            self.estimates[class_name] = DurationEstimate(seconds)
+        else:
+            estimate.update(seconds, self.alpha)
+
+    def expected(self, class_name):
+        '''Expected run time in seconds, None while not enough is known'''
+        estimate = self.estimates.get(class_name)
+        if estimate is None or estimate.samples < self.min_samples:
+            return None
+        return estimate.mean
+
+    def run_time_limit(self, class_name, default):
+        '''A run time limit for the class, limit_factor times its pessimistic
+        run time, never above default (the lock expiry of the claim)'''
+        estimate = self.estimates.get(class_name)
+        if estimate is None or estimate.samples < self.min_samples:
+            return default
+        limit = int(math.ceil(self.limit_factor * estimate.high()))
+        return min(default, max(self.min_run_time, limit))
+
+    def ensure_schema(self, database):
+        database.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                class_name text PRIMARY KEY,
+                mean double precision NOT NULL,
+                deviation double precision NOT NULL,
+                samples bigint NOT NULL,
+                updated_at timestamp NOT NULL
+            )
+        '''.format(table=self.table))
+        database.commit()
+
+    def sync(self, database):
+        '''Blends the local estimates into the shared ones, then adopts the
+        shared estimates'''
+        cursor = database.cursor()
+        now = get_current_time()
+        for class_name, estimate in self.estimates.items():
+            cursor.execute('''
+                INSERT INTO {table} AS shared
+                    (class_name, mean, deviation, samples, updated_at)
+                VALUES (%(class_name)s, %(mean)s, %(deviation)s, %(samples)s, %(now)s)
+                ON CONFLICT (class_name) DO UPDATE SET
+                    mean = shared.mean + %(alpha)s * (EXCLUDED.mean - shared.mean),
+                    deviation = shared.deviation +
+                        %(alpha)s * (EXCLUDED.deviation - shared.deviation),
+                    samples = GREATEST(shared.samples, EXCLUDED.samples),
+                    updated_at = EXCLUDED.updated_at
+            '''.format(table=self.table), {'class_name': class_name,
+                'mean': estimate.mean, 'deviation': estimate.deviation,
+                'samples': estimate.samples, 'now': now, 'alpha': self.alpha})
+        cursor.execute('SELECT class_name, mean, deviation, samples ' \
+            'FROM {table}'.format(table=self.table))
+        for class_name, mean, deviation, samples in cursor.fetchall():
+            self.estimates[class_name] = DurationEstimate(mean, deviation, samples)
+        database.commit()
@@ -0,0 +1,167 @@
+import hashlib
+import re
+from pyworker.job import _job_class_registry
+
+
+def _normalize(sql):
+    # spells the recommended definitions and those printed by postgres alike:
+    # no casts, IN lists as = ANY, no parentheses, case or whitespace
+    sql = re.sub(r'::(?:character varying|[a-z_]+)(?:\[\])?', '', sql.lower())
+    def in_list(match):
+        values = match.group(2)
+        return '%s = %s' % (match.group(1),
+            values if ',' not in values else 'any array[%s]' % values)
+    sql = re.sub(r'(\w+) in \(([^)]*)\)', in_list, sql)
+    sql = re.sub(r'\barray\b', '', sql)
+    return re.sub(r'[\s()\[\]]', '', sql)
+
+
+def _split_definition(definition):
+    '''Normalized (key columns, predicate) of an index definition, given as
+    "ON table (columns) WHERE ..." or as a pg_indexes indexdef'''
+    start = definition.index('(',
+        re.search(r'\bON\b', definition, re.IGNORECASE).end())
+    depth = 0
+    for end in range(start, len(definition)):
+        depth += {'(': 1, ')': -1}.get(definition[end], 0)
+        if depth == 0:
+            break
+    rest = definition[end + 1:]
+    match = re.search(r'\bWHERE\b(.*)$', rest, re.IGNORECASE | re.DOTALL)
+    return (_normalize(definition[start:end + 1]),
+        _normalize(match.group(1)) if match else '')
+
+
+class IndexAdvisor(object):
+    '''Checks that delayed_jobs has indexes matching the claim query of a
+    configured worker, and measures the claim latency with
+    EXPLAIN (ANALYZE, BUFFERS). Explained claims are rolled back.'''
+
+    def __init__(self, worker, database=None, runs=5):
+        super(IndexAdvisor, self).__init__()
+        self.worker = worker
+        self.database = database or worker.database
+        self.logger = worker.logger
+        self.runs = runs
+
+    def existing_indexes(self):
+        cursor = self.database.cursor()
+        cursor.execute('''
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = 'delayed_jobs'
+        ''')
+        rows = cursor.fetchall()
+        self.database.rollback()
+        return dict(rows)
+
+    def recommended_indexes(self):
+        '''Partial indexes matching the claim query, as (name, definition)'''
+        queues = sorted(self.worker.queue_names.split(','))
+        queues_slug = re.sub(r'\W+', '_', '_'.join(queues))[:40]
+        queues_sql = ', '.join(["'%s'" % q for q in queues])
+        indexes = [(
+            'index_delayed_jobs_pyworker_claim_%s' % queues_slug,
+            'ON delayed_jobs (priority, run_at) ' \
+                'WHERE failed_at IS NULL AND queue IN (%s)' % queues_sql
+        )]
+        if self.worker.fair_share_column:
+            # next tenant lookups and the next job of a tenant
+            column = self.worker.fair_share_column
+            indexes.append((
+                'index_delayed_jobs_pyworker_%s_%s' % (column, queues_slug),
+                'ON delayed_jobs (%s, priority, run_at) ' \
+                    'WHERE failed_at IS NULL AND queue IN (%s)' % \
+                    (column, queues_sql)
+            ))
+        if self.worker.aging_interval:
+            # candidates aged the most, see Worker._next_job_query
+            indexes.append((
+                'index_delayed_jobs_pyworker_aging_%s' % queues_slug,
+                'ON delayed_jobs (run_at) ' \
+                    'WHERE failed_at IS NULL AND queue IN (%s)' % queues_sql
+            ))
+        if self.worker.queue_stats:
+            # pending jobs counted per queue by an index only scan
+            indexes.append((
+                'index_delayed_jobs_pyworker_stats',
+                'ON delayed_jobs (queue, run_at, locked_at) WHERE failed_at IS NULL'
+            ))
+        if self.worker.archiver or self.worker.queue_stats:
+            # failed jobs to archive, or failed since the last stats count
+            indexes.append((
+                'index_delayed_jobs_pyworker_failed_at',
+                'ON delayed_jobs (failed_at) WHERE failed_at IS NOT NULL'
+            ))
+        if any(job_class.deduplicate
+               for job_class in _job_class_registry.values()):
+            # duplicates are looked up by the md5 of their handler
+            indexes.append((
+                'index_delayed_jobs_pyworker_handler_md5',
+                'ON delayed_jobs (md5(handler)) WHERE failed_at IS NULL'
+            ))
+        return indexes
+
+    def missing_indexes(self):
+        '''Recommended indexes without an existing index on the same columns
+        and predicate, whatever its name'''
+        existing = self.existing_indexes()
+        existing_definitions = set(_split_definition(indexdef)
+            for indexdef in existing.values())
+        missing = []
+        for name, definition in self.recommended_indexes():
+            if _split_definition(definition) in existing_definitions:
+                continue
+            if name in existing:
+                # e.g. another queue list truncated to the same name
+                name = '%s_%s' % (name[:54],
+                    hashlib.md5(definition.encode('utf-8')).hexdigest()[:8])
+            missing.append((name, definition))
+        return missing
+
+    def explain(self):
+        '''Runs the claim statement under EXPLAIN (ANALYZE, BUFFERS) and rolls
+        it back, returns the plan lines and the execution time in ms'''
+        cursor = self.database.cursor()
+        try:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS) %s' % \
+                self.worker.claim_query())
+            plan = [row[0] for row in cursor.fetchall()]
+        finally:
+            self.database.rollback()
+        execution_time = None
+        for line in plan:
+            match = re.match(r'\s*Execution Time: ([\d.]+) ms', line)
+            if match:
+                execution_time = float(match.group(1))
+        return plan, execution_time
+
+    def claim_latency(self):
+        '''Median claim execution time in ms over several runs'''
+        timings = sorted(self.explain()[1] for _ in range(self.runs))
+        return timings[len(timings) // 2]
+
+    def create_index(self, name, definition):
+        # CREATE INDEX CONCURRENTLY can not run inside a transaction
+        self.logger.info('Creating index %s', name)
+        self.database.set_autocommit(True)
+        try:
+            self.database.cursor().execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS %s %s' % \
+                    (name, definition))
+        finally:
+            self.database.set_autocommit(False)
+
+    def advise(self, create=False):
+        report = {
+            'plan_before': self.explain()[0],
+            'latency_before_ms': self.claim_latency(),
+            'missing_indexes': self.missing_indexes(),
+            'plan_after': None,
+            'latency_after_ms': None
+        }
+        if create and report['missing_indexes']:
+            for name, definition in report['missing_indexes']:
+                self.create_index(name, definition)
+            report['plan_after'] = self.explain()[0]
+            report['latency_after_ms'] = self.claim_latency()
+        return report
@@ -1,6 +1,8 @@
 import re
-import yaml
 from pyworker.util import get_current_time, get_time_delta
+from pyworker.backoff import DEFAULT_BACKOFF
+from pyworker.logger import Logger
+from pyworker.dedup import attributes_digest, handler_digest
 
 
 _job_class_registry = {}
@@ -16,23 +18,50 @@ class Meta(type):
         return cls
 
 
-# Add a YAML constructor to ignore Ruby-specific tags (required once at module load time)
 def no_ruby_objects(loader, tag_suffix, node):
     # Construct mapping normally, ignoring Ruby-specific tags
     return loader.construct_mapping(node)
 
-yaml.SafeLoader.add_multi_constructor("!ruby/object:", no_ruby_objects)
+
+_yaml = None
+
+def _get_yaml():
+    # PyYAML is loaded on the first parsed job rather than at import time
+    global _yaml
+    if _yaml is None:
+        import yaml
+        # Add a YAML constructor to ignore Ruby-specific tags (required once)
+        yaml.SafeLoader.add_multi_constructor("!ruby/object:", no_ruby_objects)
+        _yaml = yaml
+    return _yaml
 
 
 class Job(object, metaclass=Meta):
     """docstring for Job"""
+    # retry backoff policy (pyworker.backoff.Backoff), overrides the worker's
+    backoff = None
+    # run identical pending jobs (same class and attributes) only once
+    deduplicate = False
+    # seconds during which an identical job is skipped after one completed
+    dedup_window = 60
+    # the job writes through self.database without committing, its writes
+    # are committed together with its completion, or rolled back on error
+    transactional = False
+    # attribute routing the job to the workers that ran jobs of the same
+    # value recently (e.g. 'project_id'), see pyworker.affinity
+    affinity_attribute = None
+
     def __init__(self, class_name, database, logger,
                  job_id, queue, run_at, attempts=0, max_attempts=1,
                  attributes=None, abstract=False, extra_fields=None,
-                 reporter=None, max_backoff_delay_seconds=None):
+                 reporter=None, max_backoff_delay_seconds=None,
+                 default_backoff=None, archiver=None, checkpoint_store=None,
+                 locked_by=None, dataset_cache=None):
         super(Job, self).__init__()
         self.class_name = class_name
         self.database = database
+        if not isinstance(logger, Logger):
+            logger = Logger(logger)
         self.logger = logger
         self.job_id = job_id
         self.job_name = '%s#run' % class_name
@@ -47,13 +76,29 @@ class Job(object, metaclass=Meta):
         self.abstract = abstract
         self.extra_fields = extra_fields
         self.reporter = reporter
+        self.default_backoff = default_backoff
+        self.archiver = archiver
+        self.checkpoint_store = checkpoint_store
+        self.dataset_cache = dataset_cache
+        self._datasets = []
+        # name of the worker holding the lock, guards the completion writes
+        self.locked_by = locked_by
+        self.handler_digest = None
+        self.coalesced_ids = []
+        self.prepared = None # future of prepare, when run ahead by the worker
+        self.load_error = None # raised when handled, e.g. undecodable payload
+        self.raw_handler = None # as claimed, see from_row
+        self._restored = False
+        self._restored_state = None
 
     def __str__(self):
         return "%s: %s" % (self.__class__.__name__, str(self.__dict__))
 
     @classmethod
     def from_row(cls, job_row, max_attempts, database, logger,
-                 extra_fields=None, reporter=None, max_backoff_delay_seconds=None):
+                 extra_fields=None, reporter=None, max_backoff_delay_seconds=None,
+                 default_backoff=None, archiver=None, payload_codec=None,
+                 checkpoint_store=None, locked_by=None, dataset_cache=None):
         '''job_row is a tuple of (id, attempts, run_at, queue, handler, *extra_fields)'''
         def extract_class_name(line):
             regex = re.compile('object: !ruby/object:(.+)')
@@ -69,37 +114,106 @@ class Job(object, metaclass=Meta):
 
             return dict(zip(extra_fields, extra_field_values))
 
-        job_id, attempts, run_at, queue, handler, *extra_field_values = job_row
+        job_id, attempts, run_at, queue, raw_handler, *extra_field_values = job_row
         extra_fields_dict = extract_extra_fields(extra_fields, extra_field_values)
-        handler = handler.splitlines()
+        handler = raw_handler.splitlines()
 
         class_name = extract_class_name(handler[1])
-        logger.debug("Found Job %d with class name: %s" % (job_id, class_name))
-        try:
-            target_class = _job_class_registry[class_name]
-        except KeyError:
-            return Job(class_name=class_name, logger=logger,
+        if not isinstance(logger, Logger):
+            logger = Logger(logger)
+        logger = logger.bind(job_id=job_id, job_class=class_name, queue=queue)
+        logger.debug("Found Job %d with class name: %s", job_id, class_name,
+            phase='claim')
+        def abstract_job(load_error=None):
+            job = Job(class_name=class_name, logger=logger,
                 max_attempts=max_attempts,
                 job_id=job_id, attempts=attempts,
                 run_at=run_at, queue=queue, database=database,
                 abstract=True, extra_fields=extra_fields_dict,
-                reporter=reporter, max_backoff_delay_seconds=max_backoff_delay_seconds
+                reporter=reporter, max_backoff_delay_seconds=max_backoff_delay_seconds,
+                default_backoff=default_backoff, archiver=archiver,
+                checkpoint_store=checkpoint_store, locked_by=locked_by,
+                dataset_cache=dataset_cache
             )
+            job.load_error = load_error
+            return job
+
+        try:
+            target_class = _job_class_registry[class_name]
+        except KeyError:
+            return abstract_job()
         attributes = handler[3:]
-        logger.debug("Found attributes: %s" % str(attributes))
+        logger.debug("Found attributes: %s", attributes, phase='claim')
 
         stripped = '\n'.join(['object:', '  raw_attributes:'] + attributes)
+        yaml = _get_yaml()
         payload = yaml.load(stripped, Loader=yaml.SafeLoader)
-        logger.debug("payload object: %s" % str(payload))
+        logger.debug("payload object: %s", payload, phase='claim')
+        attributes = payload['object']['raw_attributes']
+        if payload_codec and attributes:
+            try:
+                attributes = payload_codec.decode(attributes)
+            except Exception as exception:
+                # the claim is committed: the job fails through the worker
+                # like any other, rather than the worker itself
+                return abstract_job(exception)
 
-        return target_class(class_name=class_name, logger=logger,
+        job = target_class(class_name=class_name, logger=logger,
             job_id=job_id, attempts=attempts,
             run_at=run_at, queue=queue, database=database,
             max_attempts=max_attempts,
-            attributes=payload['object']['raw_attributes'],
+            attributes=attributes,
             abstract=False, extra_fields=extra_fields_dict,
-            reporter=reporter, max_backoff_delay_seconds=max_backoff_delay_seconds
+            reporter=reporter, max_backoff_delay_seconds=max_backoff_delay_seconds,
+            default_backoff=default_backoff, archiver=archiver,
+            checkpoint_store=checkpoint_store, locked_by=locked_by,
+            dataset_cache=dataset_cache
         )
+        if target_class.deduplicate:
+            job.handler_digest = handler_digest(raw_handler)
+        if target_class.affinity_attribute:
+            job.raw_handler = raw_handler
+        return job
+
+    @staticmethod
+    def build_handler(class_name, attributes):
+        '''YAML handler of a job, in the format produced by delayed_job'''
+        yaml = _get_yaml()
+        dumped = yaml.safe_dump(attributes or {}, default_flow_style=False,
+            allow_unicode=True)
+        return '\n'.join([
+            '--- !ruby/object:Delayed::PerformableMethod',
+            'object: !ruby/object:%s' % class_name,
+            '  raw_attributes:'] +
+            ['    %s' % line for line in dumped.splitlines()] + [
+            'method_name: :run',
+            'args: []',
+            ''])
+
+    @classmethod
+    def enqueue(cls, database, attributes=None, queue='default', priority=0,
+                run_at=None, payload_codec=None, commit=True):
+        '''Inserts a job of this class in delayed_jobs, returns its id'''
+        if payload_codec and attributes:
+            attributes = payload_codec.encode(attributes, commit=commit)
+        now = get_current_time()
+        cursor = database.cursor()
+        cursor.execute('''
+            INSERT INTO delayed_jobs
+                (priority, attempts, handler, run_at, queue, created_at, updated_at)
+            VALUES (%s, 0, %s, %s, %s, %s, %s) RETURNING id
+        ''', (priority, cls.build_handler(cls.__name__, attributes),
+              run_at or now, queue, now, now))
+        job_id = cursor.fetchone()[0]
+        if commit:
+            database.commit()
+        return job_id
+
+    def prepare(self):
+        # I/O bound setup (e.g. downloading inputs), the worker may run it
+        # on a background thread while the previous job runs, so it must not
+        # use the database connection, shared with that job
+        self.logger.debug("Running Job.prepare hook")
 
     def before(self):
         self.logger.debug("Running Job.before hook")
@@ -116,9 +230,11 @@ class Job(object, metaclass=Meta):
     def success(self):
         self.logger.debug("Running Job.success hook")
 
-    def set_error_unlock(self, error):
+    def set_error_unlock(self, error, exception=None):
         failed = False
-        self.logger.error('Job %d raised error: %s' % (self.job_id, error))
+        self.rollback()
+        self.logger.error('Job %d raised error: %s', self.job_id, error,
+            phase='error')
         # run error hook
         self.error(error)
         self.attempts += 1
@@ -142,26 +258,208 @@ class Job(object, metaclass=Meta):
             values.append(now)
             self.failure(error)
         else:
-            # set new exponential run_at
+            # set new run_at according to the backoff policy
             setters.append('run_at = %s')
-            delta = (self.attempts**4) + 5
-            if self.max_backoff_delay_seconds and delta > self.max_backoff_delay_seconds:
-                delta = self.max_backoff_delay_seconds
+            delta = self.backoff_delay(exception)
             values.append(str(now + get_time_delta(seconds=delta)))
 
         self._update_job(setters, values)
+        self._release_coalesced()
         return failed
 
-    def remove(self):
-        self.logger.debug('Job %d finished successfully' % self.job_id)
-        query = 'DELETE FROM delayed_jobs WHERE id = %d' % self.job_id
-        self.database.cursor().execute(query)
+    def backoff_delay(self, exception=None):
+        # a retry-after hint from the raised exception wins over the policy
+        delta = getattr(exception, 'retry_after', None)
+        if delta is None:
+            policy = self.backoff or self.default_backoff or DEFAULT_BACKOFF
+            delta = policy.delay(self)
+        if self.max_backoff_delay_seconds and delta > self.max_backoff_delay_seconds:
+            delta = self.max_backoff_delay_seconds
+        return delta
+
+    def unlock(self):
+        # release the job without counting an attempt
+        self.logger.debug('Releasing lock of Job %d', self.job_id, phase='unlock')
+        self.rollback()
+        self._update_job(['locked_at = %s', 'locked_by = %s'], [None, None])
+        self._release_coalesced()
+
+    def checkpoint(self, state):
+        '''Durably stores the progress of this job (any JSON serializable
+        state), a retry finds it in restored_state and can resume from it'''
+        if self.checkpoint_store is None:
+            raise ValueError('Job %d can not checkpoint: no checkpoint ' \
+                'store is configured' % self.job_id)
+        if self.transactional:
+            # saving commits, with the job writes that must wait for completion
+            raise ValueError('Job %d can not checkpoint: transactional jobs ' \
+                'commit only on completion' % self.job_id)
+        self.checkpoint_store.save(self.job_id, state)
+        self._restored = True
+        self._restored_state = state
+        self.logger.debug('Job %d checkpointed', self.job_id,
+            phase='checkpoint')
+
+    @property
+    def restored_state(self):
+        '''Last checkpointed state of this job, None on a fresh start'''
+        if not self._restored:
+            self._restored = True
+            # transactional jobs never checkpoint, and loading ends the
+            # transaction of the job
+            if self.checkpoint_store is not None and not self.transactional:
+                self._restored_state = self.checkpoint_store.load(self.job_id)
+                if self._restored_state is not None:
+                    self.logger.info('Job %d resuming from checkpoint',
+                        self.job_id, phase='checkpoint')
+        return self._restored_state
+
+    def dataset(self, key, loader):
+        '''Read-only dataset shared by the workers of the host, loaded by
+        loader() (returning bytes or a NumPy array) in the first of them.
+        Held until the job ends: use its buffer or array() views meanwhile.'''
+        if self.dataset_cache is None:
+            raise ValueError('Job %d can not load shared datasets: no dataset ' \
+                'cache is configured' % self.job_id)
+        dataset = self.dataset_cache.acquire(key, loader)
+        self._datasets.append(dataset)
+        return dataset
+
+    def release_datasets(self):
+        while self._datasets:
+            self.dataset_cache.release(self._datasets.pop())
+
+    def refresh_lock(self):
+        '''Renews the lock of a job claimed ahead of its run, returns
+        False if the lock expired and was taken over meanwhile'''
+        query, values = self._guarded(
+            'UPDATE delayed_jobs SET locked_at = %%s WHERE id = %d' % self.job_id,
+            [get_current_time()])
+        cursor = self.database.cursor()
+        cursor.execute(query, values)
+        owned = self._check_owned(cursor.rowcount)
+        self.database.commit()
+        return owned
+
+    def rollback(self):
+        '''Discards the uncommitted writes of a transactional job, or the
+        aborted transaction of a failed completion. The claim is committed
+        already, so there is nothing else to lose.'''
+        if self.transactional:
+            self.logger.debug('Rolling back Job %d writes', self.job_id,
+                phase='rollback')
+        self.database.rollback()
+
+    def enqueue_followup(self, job_class, **kwargs):
+        '''Enqueues a job in the database of this one. For a transactional
+        job it is only committed, atomically, with this job completion.'''
+        kwargs.setdefault('commit', not self.transactional)
+        return job_class.enqueue(self.database, **kwargs)
+
+    @property
+    def affinity_key(self):
+        '''Value of the affinity attribute of the job, as a string: its text
+        in the handler, as read by the claim query, for claimed jobs'''
+        if not self.affinity_attribute:
+            return None
+        if self.raw_handler is not None:
+            from pyworker.affinity import handler_key
+            return handler_key(self.raw_handler, self.affinity_attribute)
+        if not isinstance(self.attributes, dict):
+            return None
+        value = self.attributes.get(self.affinity_attribute)
+        return None if value is None else str(value)
+
+    @property
+    def digest(self):
+        return attributes_digest(self.class_name, self.attributes)
+
+    def coalesce(self, locked_by, max_run_time):
+        '''Locks the pending duplicates of this job, they are completed
+        together with it. Duplicates are matched on the md5 of their raw
+        handler, which an expression index can serve.'''
+        now = get_current_time()
+        expired = now - get_time_delta(seconds=max_run_time)
+        cursor = self.database.cursor()
+        cursor.execute('''
+            UPDATE delayed_jobs SET locked_at = %s, locked_by = %s
+            WHERE id IN (SELECT id FROM delayed_jobs
+                WHERE md5(handler) = %s AND id <> %s AND queue = %s
+                AND failed_at IS NULL AND run_at <= %s
+                AND (locked_at IS NULL OR locked_at < %s)
+                FOR UPDATE SKIP LOCKED)
+            RETURNING id
+        ''', (now, locked_by, self.handler_digest, self.job_id, self.queue,
+              now, expired))
+        self.coalesced_ids = [row[0] for row in cursor.fetchall()]
         self.database.commit()
+        if self.coalesced_ids:
+            self.logger.info('Job %d coalesced %d duplicates', self.job_id,
+                len(self.coalesced_ids), phase='coalesce')
+        return self.coalesced_ids
+
+    def _release_coalesced(self):
+        # duplicates did not run, give them back without counting an attempt
+        if not self.coalesced_ids:
+            return
+        query, values = self._guarded(
+            'UPDATE delayed_jobs SET locked_at = NULL, locked_by = NULL ' \
+            'WHERE id = ANY(%s)', [self.coalesced_ids])
+        self.database.cursor().execute(query, values)
+        self.database.commit()
+        self.coalesced_ids = []
+
+    def _guarded(self, query, values):
+        # the claim is committed right away, so the row lock is gone while
+        # the job runs: only write to the row if this worker still owns it
+        if self.locked_by is None:
+            return query, tuple(values)
+        return query + ' AND locked_by = %s', tuple(values) + (self.locked_by,)
+
+    def _check_owned(self, rowcount):
+        if self.locked_by is None or rowcount != 0:
+            return True
+        self.logger.warning('Job %d is no longer locked by %s, its lock ' \
+            'expired and was taken over: dropping the result', self.job_id,
+            self.locked_by, phase='complete')
+        if self.reporter:
+            self.reporter.record_metric('Custom/Job/LockLost', 1)
+        return False
+
+    def remove(self):
+        self.logger.debug('Job %d finished successfully', self.job_id,
+            phase='complete')
+        job_ids = [self.job_id] + self.coalesced_ids
+        if self.archiver and self.archiver.include_completed:
+            rowcount = self.archiver.archive_completed(job_ids,
+                locked_by=self.locked_by, commit=False)
+        else:
+            if len(job_ids) == 1:
+                query = 'DELETE FROM delayed_jobs WHERE id = %d' % self.job_id
+            else:
+                query = 'DELETE FROM delayed_jobs WHERE id IN (%s)' % \
+                    ', '.join(['%d' % job_id for job_id in job_ids])
+            query, values = self._guarded(query, [])
+            cursor = self.database.cursor()
+            if values:
+                cursor.execute(query, values)
+            else:
+                cursor.execute(query)
+            rowcount = cursor.rowcount
+        # a single commit for the completion and, when transactional,
+        # the job writes, which are dropped if the job was taken over
+        if self._check_owned(rowcount):
+            self.database.commit()
+        else:
+            self.database.rollback()
 
     def _update_job(self, setters, values):
         query = 'UPDATE delayed_jobs SET %s WHERE id = %d' % \
             (', '.join(setters), self.job_id)
-        self.logger.debug('update query: %s' % query)
-        self.logger.debug('update values: %s' % str(values))
-        self.database.cursor().execute(query, tuple(values))
+        query, values = self._guarded(query, values)
+        self.logger.debug('update query: %s', query)
+        self.logger.debug('update values: %s', values)
+        cursor = self.database.cursor()
+        cursor.execute(query, values)
+        self._check_owned(cursor.rowcount)
         self.database.commit()
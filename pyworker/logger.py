@@ -1,27 +1,88 @@
+import logging
+
+
 class Logger(object):
-    def __init__(self, logger):
+    '''Wraps a `logging` logger, or prints when there is none.
+
+    Messages are %-formatted with their args only when their level is
+    enabled, so callers should pass args instead of formatting eagerly.
+    Structured fields (job_id, job_class, queue, phase...) are either bound
+    with `bind` or passed as keyword arguments, and reach handlers as
+    attributes of the log record (and all together as `record.fields`).'''
+
+    def __init__(self, logger, **fields):
         self.logger = logger
+        self.fields = fields
 
-    def debug(self, message):
-        try:
-            self.logger.debug(message)
-        except:
-            print("DEBUG: %s" % message)
+    def bind(self, **fields):
+        '''Returns a logger adding the given fields to every message'''
+        bound_fields = dict(self.fields)
+        bound_fields.update(fields)
+        return Logger(self.logger, **bound_fields)
 
-    def info(self, message):
+    def is_enabled_for(self, level):
         try:
-            self.logger.info(message)
+            return self.logger.isEnabledFor(level)
         except:
-            print("INFO: %s" % message)
+            return True
 
-    def warning(self, message):
+    def _log(self, level, message, args, fields):
+        if not self.is_enabled_for(level):
+            return
+        if fields:
+            bound_fields = dict(self.fields)
+            bound_fields.update(fields)
+            fields = bound_fields
+        else:
+            fields = self.fields
         try:
-            self.logger.warning(message)
+            extra = dict(fields)
+            extra['fields'] = fields
+            self.logger.log(level, message, *args, extra=extra)
         except:
-            print("WARNING: %s" % message)
+            if args:
+                message = message % args
+            if fields:
+                message = '%s [%s]' % (message, ' '.join(
+                    '%s=%s' % item for item in fields.items()))
+            # loggers with only the level methods, then print
+            try:
+                getattr(self.logger, logging.getLevelName(level).lower())(message)
+            except:
+                print('%s: %s' % (logging.getLevelName(level), message))
 
-    def error(self, message):
-        try:
-            self.logger.error(message)
-        except:
-            print("ERROR: %s" % message)
+    def debug(self, message, *args, **fields):
+        self._log(logging.DEBUG, message, args, fields)
+
+    def info(self, message, *args, **fields):
+        self._log(logging.INFO, message, args, fields)
+
+    def warning(self, message, *args, **fields):
+        self._log(logging.WARNING, message, args, fields)
+
+    def error(self, message, *args, **fields):
+        self._log(logging.ERROR, message, args, fields)
+
+
+def start_async_logging(logger):
+    '''Moves the handlers of a `logging` logger (including the ones it
+    propagates to) behind a QueueHandler, so that log I/O happens on a
+    background thread. Returns the started QueueListener, stop it on exit'''
+    import logging.handlers
+    import queue
+    handlers = []
+    current = logger
+    while current:
+        handlers.extend(current.handlers)
+        if not current.propagate:
+            break
+        current = current.parent
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    log_queue = queue.Queue(-1)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(log_queue, *handlers,
+        respect_handler_level=True)
+    listener.start()
+    return listener
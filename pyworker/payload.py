@@ -0,0 +1,215 @@
+import base64
+import hashlib
+import lzma
+import mmap
+import os
+import tempfile
+import zlib
+
+
+# Encoded attribute values are strings of the form:
+#   pyworker:<compression>:<base64 of the compressed utf-8 value>
+#   pyworker:ref:<compression>:<blob key>   (compressed value kept in a blob store)
+PREFIX = 'pyworker:'
+
+_COMPRESSORS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+
+class FileBlobStore(object):
+    '''Content addressed blobs in a local (or shared) directory,
+    read through memory maps'''
+
+    def __init__(self, root):
+        super(FileBlobStore, self).__init__()
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data, key=None, commit=True):
+        # commit: for the database store, files are written right away
+        key = key or hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # write then rename so that readers never see partial blobs
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return key
+
+    def get(self, key):
+        '''Returns a read only buffer over the blob, or None'''
+        try:
+            with open(self._path(key), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b''
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+
+class DatabaseBlobStore(object):
+    '''Content addressed blobs in a side table of the jobs database'''
+
+    def __init__(self, database, table='delayed_job_blobs'):
+        super(DatabaseBlobStore, self).__init__()
+        self.database = database
+        self.table = table
+
+    def ensure_schema(self):
+        self.database.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                key text PRIMARY KEY,
+                data bytea NOT NULL,
+                created_at timestamp NOT NULL DEFAULT now()
+            )
+        '''.format(table=self.table))
+        self.database.commit()
+
+    def put(self, data, key=None, commit=True):
+        key = key or hashlib.sha256(data).hexdigest()
+        self.database.cursor().execute('''
+            INSERT INTO {table} (key, data) VALUES (%s, %s)
+            ON CONFLICT (key) DO NOTHING
+        '''.format(table=self.table), (key, bytes(data)))
+        if commit:
+            self.database.commit()
+        return key
+
+    def get(self, key):
+        # fetched lazily while a job runs: the read transaction is ended unless
+        # it belongs to the job (transactional jobs), which ends it itself
+        started = not self.database.in_transaction()
+        cursor = self.database.cursor()
+        try:
+            cursor.execute('SELECT data FROM {table} WHERE key = %s'.format(
+                table=self.table), (key,))
+            row = cursor.fetchone()
+        finally:
+            if started:
+                self.database.rollback()
+        return row[0] if row else None
+
+
+class CachedBlobStore(object):
+    '''Keeps a local on-disk copy of the blobs fetched from another store,
+    for blobs shared by many jobs. Blobs are content addressed, so cached
+    copies never go stale.'''
+
+    def __init__(self, store, cache_root):
+        super(CachedBlobStore, self).__init__()
+        self.store = store
+        self.cache = FileBlobStore(cache_root)
+
+    def put(self, data, key=None, commit=True):
+        return self.store.put(data, key=key, commit=commit)
+
+    def get(self, key):
+        data = self.cache.get(key)
+        if data is None:
+            data = self.store.get(key)
+            if data is not None:
+                self.cache.put(data, key=key)
+                data = self.cache.get(key)
+        return data
+
+
+class BlobReference(object):
+    def __init__(self, codec, compression, key):
+        self.codec = codec
+        self.compression = compression
+        self.key = key
+
+    def fetch(self):
+        data = self.codec.store.get(self.key)
+        if data is None:
+            raise KeyError('Missing payload blob %s' % self.key)
+        return self.codec.decompress(self.compression, data)
+
+    def __repr__(self):
+        return '<BlobReference %s>' % self.key
+
+
+class LazyAttributes(dict):
+    '''Job attributes whose stored values are fetched on first access'''
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, BlobReference):
+            value = value.fetch()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+
+class PayloadCodec(object):
+    '''Compresses large string attributes of enqueued jobs, and keeps the
+    largest ones in a blob store, leaving only a reference in the handler
+    (claim check). Only top level string attributes are encoded.'''
+
+    def __init__(self, compression='zlib', compress_threshold=64 * 1024,
+                 store=None, external_threshold=1024 * 1024):
+        super(PayloadCodec, self).__init__()
+        if compression not in _COMPRESSORS:
+            raise ValueError('Unsupported compression: %s' % compression)
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.store = store
+        self.external_threshold = external_threshold
+
+    def decompress(self, compression, data):
+        return _COMPRESSORS[compression][1](data).decode('utf-8')
+
+    def encode_value(self, value, commit=True):
+        if not isinstance(value, str):
+            return value
+        data = value.encode('utf-8')
+        if len(data) < self.compress_threshold:
+            return value
+        compressed = _COMPRESSORS[self.compression][0](data)
+        if self.store is not None and len(compressed) >= self.external_threshold:
+            return '%sref:%s:%s' % (PREFIX, self.compression,
+                self.store.put(compressed, commit=commit))
+        return '%s%s:%s' % (PREFIX, self.compression,
+            base64.b64encode(compressed).decode('ascii'))
+
+    def decode_value(self, value):
+        if not isinstance(value, str) or not value.startswith(PREFIX):
+            return value
+        mode, _, rest = value[len(PREFIX):].partition(':')
+        if mode == 'ref':
+            compression, _, key = rest.partition(':')
+            if self.store is None:
+                raise ValueError('Job payload references a blob but ' \
+                    'no blob store is configured')
+            return BlobReference(self, compression, key)
+        if mode in _COMPRESSORS:
+            return self.decompress(mode, base64.b64decode(rest))
+        return value
+
+    def encode(self, attributes, commit=True):
+        '''commit=False leaves the blobs in the transaction of the caller,
+        e.g. an enqueue that commits with the job writes'''
+        return {key: self.encode_value(value, commit=commit)
+                for key, value in attributes.items()}
+
+    def decode(self, attributes):
+        decoded = {key: self.decode_value(value)
+                   for key, value in attributes.items()}
+        if any(isinstance(value, BlobReference) for value in decoded.values()):
+            return LazyAttributes(decoded)
+        return decoded
@@ -0,0 +1,58 @@
+import time
+from collections import deque
+
+
+class PreparePipeline(object):
+    '''Jobs claimed ahead of their run, up to `lookahead` besides the one
+    about to run. Their prepare hook runs on a background thread, in claim
+    order, while the worker runs the previous jobs.'''
+
+    def __init__(self, lookahead=1, logger=None, clock=time.monotonic):
+        super(PreparePipeline, self).__init__()
+        self.lookahead = lookahead
+        self.logger = logger
+        self._clock = clock
+        self._jobs = deque()
+        self._executor = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def job_ids(self):
+        return [job.job_id for job, _ in self._jobs]
+
+    def full(self):
+        return len(self._jobs) > self.lookahead
+
+    def push(self, job):
+        if self._executor is None:
+            # imported here, only needed when pipelining
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=1,
+                thread_name_prefix='pyworker-prepare')
+        if not job.abstract:
+            job.prepared = self._executor.submit(job.prepare)
+        self._jobs.append((job, self._clock()))
+
+    def pop(self):
+        '''Returns the next job and the seconds it waited since its claim,
+        or (None, 0) when empty'''
+        if not self._jobs:
+            return None, 0
+        job, claimed_at = self._jobs.popleft()
+        return job, self._clock() - claimed_at
+
+    def release(self):
+        '''Gives the jobs claimed ahead back to the queue'''
+        while self._jobs:
+            job, _ = self._jobs.popleft()
+            if job.prepared is not None:
+                job.prepared.cancel()
+            try:
+                job.unlock()
+            except Exception:
+                if self.logger:
+                    self.logger.error('Could not release Job %d', job.job_id)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
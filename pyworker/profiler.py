@@ -0,0 +1,121 @@
+import inspect
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+def _label(frame):
+    # functions rather than lines, so that the samples of a function merge
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno)
+
+
+class StackSampler(object):
+    '''Samples the stack of a thread from a background thread, every
+    `interval` seconds once `delay` seconds passed. No signal is involved,
+    so it runs along the SIGALRM run time limit. With `root_code` (e.g. the
+    code of Job.run), only the stacks running it are counted, from it down.'''
+
+    def __init__(self, thread_id, root_code=None, interval=0.01, delay=0):
+        super(StackSampler, self).__init__()
+        self.thread_id = thread_id
+        self.root_code = root_code
+        self.interval = interval
+        self.delay = delay
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        labels = []
+        while frame is not None:
+            labels.append(_label(frame))
+            if frame.f_code is self.root_code:
+                break
+            frame = frame.f_back
+        else:
+            if self.root_code is not None:
+                return # out of the sampled block, e.g. while stopping
+        if labels:
+            self.stacks[';'.join(reversed(labels))] += 1
+
+    def _run(self):
+        if self.delay and self._stopped.wait(self.delay):
+            return
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+            name='pyworker-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def collapsed(self):
+        '''Stacks in the collapsed format of flame graph tools
+        (one "frame;frame;... count" line per stack)'''
+        return ''.join(['%s %d\n' % (stack, count)
+            for stack, count in sorted(self.stacks.items())])
+
+
+class SamplingProfiler(object):
+    '''Profiles the run of jobs with a StackSampler, when their class is
+    in `classes`, for a `sample_rate` share of the other jobs, and past
+    `slow_threshold` seconds for all of them. Each profile is written to
+    `directory` as a collapsed stacks file.'''
+
+    def __init__(self, directory=None, classes=(), sample_rate=0.0,
+                 slow_threshold=None, interval=0.01, rng=random.random):
+        super(SamplingProfiler, self).__init__()
+        self.directory = directory or \
+            os.path.join(tempfile.gettempdir(), 'pyworker-profiles')
+        self.classes = set(classes)
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        self._rng = rng
+        os.makedirs(self.directory, exist_ok=True)
+
+    def delay_for(self, class_name):
+        '''Seconds after which a job of the class is sampled, None if not'''
+        if class_name in self.classes or \
+                (self.sample_rate and self._rng() < self.sample_rate):
+            return 0
+        return self.slow_threshold
+
+    @contextmanager
+    def profile(self, job):
+        '''Samples the block, run by the calling thread'''
+        delay = self.delay_for(job.class_name)
+        if delay is None:
+            yield
+            return
+        sampler = StackSampler(threading.get_ident(),
+            root_code=getattr(inspect.unwrap(job.run), '__code__', None),
+            interval=self.interval, delay=delay)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            if sampler.stacks:
+                path = self.write(job, sampler)
+                job.logger.info('Job %d profile written to %s', job.job_id,
+                    path, phase='profile')
+
+    def write(self, job, sampler):
+        path = os.path.join(self.directory, '%s.%s.%d.collapsed' % (
+            job.class_name, job.job_id, int(time.time())))
+        with open(path, 'w') as f:
+            f.write(sampler.collapsed())
+        return path
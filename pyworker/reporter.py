@@ -24,6 +24,11 @@ class Reporter(object):
         # report to NewRelic
         self._report_newrelic(attributes)
 
+    def record_metric(self, name, value):
+        # custom metrics are reported outside of any job transaction
+        newrelic.agent.record_custom_metric(name, value,
+            application=self._newrelic_app)
+
     @contextmanager
     def recorder(self, name):
         with newrelic.agent.BackgroundTask(
@@ -70,7 +75,7 @@ class Reporter(object):
 
     def _report_newrelic(self, attributes):
         if self._logger:
-            self._logger.debug('Reporter: reporting to NewRelic: %s' % attributes)
+            self._logger.debug('Reporter: reporting to NewRelic: %s', attributes)
         # report user id if available in attributes in any form
         possible_keys = [f'{self._prefix}userId', f'{self._prefix}user_id', 'userId', 'user_id']
         possible_values = [attributes.get(key) for key in possible_keys if key in attributes]
@@ -78,7 +83,7 @@ class Reporter(object):
             user_id = str(possible_values[0])
             newrelic.agent.set_user_id(user_id)
             if self._logger:
-                self._logger.debug('Reporter: reporting to NewRelic user_id: %s' % user_id)
+                self._logger.debug('Reporter: reporting to NewRelic user_id: %s', user_id)
         # convert attributes dict to list of tuples
         attributes = list(attributes.items())
         newrelic.agent.add_custom_attributes(attributes)
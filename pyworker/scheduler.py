@@ -0,0 +1,305 @@
+import datetime
+import heapq
+import itertools
+from collections import deque
+from pyworker.util import get_current_time
+
+
+# catch-up policies, for occurrences missed while no worker was running
+ALL = 'all'     # enqueue every missed occurrence (up to max_catch_up)
+ONCE = 'once'   # enqueue a single job for all missed occurrences
+SKIP = 'skip'   # enqueue nothing unless the last occurrence is within misfire_grace
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# arbitrary advisory lock key shared by the fleet, "pyworker" in ascii
+DEFAULT_LOCK_KEY = 0x7079776f726b6572
+
+
+class Spec(object):
+    '''When a schedule fires. Times are naive UTC datetimes, as returned
+    by get_current_time.'''
+
+    def next_after(self, dt):
+        raise NotImplementedError()
+
+    def occurrences(self, after, until):
+        '''Occurrences t with after < t <= until, in order'''
+        t = self.next_after(after)
+        while t <= until:
+            yield t
+            t = self.next_after(t)
+
+    def latest(self, after, until):
+        '''Last occurrence t with after < t <= until, or None'''
+        last = self.last_occurrences(after, until, 1)
+        return last[0] if last else None
+
+    def last_occurrences(self, after, until, count):
+        '''Last `count` occurrences t with after < t <= until, in order,
+        without walking the older ones of a long downtime'''
+        span = datetime.timedelta(minutes=count)
+        while True:
+            start = max(after, until - span)
+            last = deque(self.occurrences(start, until), maxlen=count)
+            if len(last) == count or start == after:
+                return list(last)
+            span *= 2
+
+
+class IntervalSpec(Spec):
+    '''Every `seconds`, aligned on the epoch so that all workers agree on
+    the occurrences'''
+
+    def __init__(self, seconds):
+        super(IntervalSpec, self).__init__()
+        if seconds <= 0:
+            raise ValueError('Interval must be positive: %r' % seconds)
+        self.step = datetime.timedelta(seconds=seconds)
+
+    def next_after(self, dt):
+        return EPOCH + ((dt - EPOCH) // self.step + 1) * self.step
+
+    def latest(self, after, until):
+        t = EPOCH + ((until - EPOCH) // self.step) * self.step
+        return t if t > after else None
+
+    def last_occurrences(self, after, until, count):
+        latest = self.latest(after, until)
+        if latest is None:
+            return []
+        t = max(latest - (count - 1) * self.step, self.next_after(after))
+        last = []
+        while t <= latest:
+            last.append(t)
+            t += self.step
+        return last
+
+    def __repr__(self):
+        return '<IntervalSpec every %ds>' % self.step.total_seconds()
+
+
+_CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7), # 0 and 7 are sunday
+]
+
+
+def _parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        term, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if term == '*':
+            start, end = low, high
+        elif '-' in term:
+            start, end = [int(value) for value in term.split('-', 1)]
+        else:
+            start = int(term)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError('Invalid cron field: %s' % field)
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSpec(Spec):
+    '''Standard 5 fields cron expression (minute hour day month weekday),
+    evaluated in UTC. Supports *, lists, ranges and steps.'''
+
+    def __init__(self, expression):
+        super(CronSpec, self).__init__()
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(_CRON_FIELDS):
+            raise ValueError('Cron expression needs 5 fields: %s' % expression)
+        parsed = [_parse_cron_field(field, low, high)
+                  for field, (_, low, high) in zip(fields, _CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = frozenset(weekday % 7 for weekday in weekdays)
+        # as in cron, when both day fields are restricted either one matches
+        self._days_restricted = not fields[2].startswith('*')
+        self._weekdays_restricted = not fields[4].startswith('*')
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, dt):
+        t = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # skip whole months, days and hours that can not match
+        limit = t + datetime.timedelta(days=5 * 366)
+        while t < limit:
+            if t.month not in self.months:
+                if t.month == 12:
+                    t = t.replace(year=t.year + 1, month=1, day=1, hour=0, minute=0)
+                else:
+                    t = t.replace(month=t.month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('Cron expression never fires: %s' % self.expression)
+
+    def __repr__(self):
+        return '<CronSpec %s>' % self.expression
+
+
+class Schedule(object):
+    '''A recurring Job subclass'''
+
+    def __init__(self, job_class, spec, name=None, attributes=None,
+                 queue='default', priority=0, catch_up=ONCE,
+                 misfire_grace=60, max_catch_up=100):
+        super(Schedule, self).__init__()
+        if catch_up not in (ALL, ONCE, SKIP):
+            raise ValueError('Unknown catch up policy: %s' % catch_up)
+        self.job_class = job_class
+        self.spec = spec
+        self.name = name or job_class.__name__
+        self.attributes = attributes
+        self.queue = queue
+        self.priority = priority
+        self.catch_up = catch_up
+        self.misfire_grace = misfire_grace
+        self.max_catch_up = max_catch_up
+        self.registered_at = None
+        self.next_fire_at = None
+
+    def fire_times(self, after, now):
+        '''Run times of the jobs to enqueue for the occurrences in (after, now]'''
+        if self.catch_up == ALL:
+            return self.spec.last_occurrences(after, now, self.max_catch_up)
+        latest = self.spec.latest(after, now)
+        if latest is None:
+            return []
+        if self.catch_up == SKIP and \
+                (now - latest).total_seconds() > self.misfire_grace:
+            return []
+        return [latest]
+
+
+class Scheduler(object):
+    '''Enqueues recurring jobs into delayed_jobs.
+
+    Every worker of the fleet can run a scheduler with the same schedules:
+    the next fire times are kept in a heap, so a tick costs O(1) when
+    nothing is due and O(log n) per due schedule. Due schedules are fired
+    under a transaction level advisory lock, against the last fire times
+    stored in the schedules table, so each occurrence is enqueued once.'''
+
+    def __init__(self, database, logger, table='pyworker_schedules',
+                 lock_key=DEFAULT_LOCK_KEY, retry_delay=10,
+                 clock=get_current_time):
+        super(Scheduler, self).__init__()
+        self.database = database
+        self.logger = logger
+        self.table = table
+        self.lock_key = lock_key
+        self.retry_delay = retry_delay # seconds, after a failed or contended tick
+        self._clock = clock
+        self._heap = []
+        self._counter = itertools.count() # ties on fire times
+        self.schedules = {}
+
+    def ensure_schema(self):
+        self.database.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                name text PRIMARY KEY,
+                last_fire_at timestamp NOT NULL
+            )
+        '''.format(table=self.table))
+        self.database.commit()
+
+    def register(self, job_class, every=None, cron=None, **options):
+        '''Registers a recurring job class, either every N seconds or on
+        a cron expression. See Schedule for the options.'''
+        if (every is None) == (cron is None):
+            raise ValueError('Schedule needs one of every or cron')
+        spec = IntervalSpec(every) if every is not None else CronSpec(cron)
+        schedule = Schedule(job_class, spec, **options)
+        if schedule.name in self.schedules:
+            raise ValueError('Schedule already registered: %s' % schedule.name)
+        now = self._clock()
+        schedule.registered_at = now
+        self.schedules[schedule.name] = schedule
+        # due right away: the first tick catches up the occurrences missed
+        # since the last fire time stored in the table
+        self._push(schedule, now)
+        return schedule
+
+    def _push(self, schedule, fire_at):
+        schedule.next_fire_at = fire_at
+        heapq.heappush(self._heap, (fire_at, next(self._counter), schedule))
+
+    def seconds_until_next(self, now=None):
+        if not self._heap:
+            return None
+        now = now or self._clock()
+        return max((self._heap[0][0] - now).total_seconds(), 0)
+
+    def tick(self, now=None):
+        '''Enqueues the jobs of the due schedules, returns their number'''
+        now = now or self._clock()
+        if not self._heap or self._heap[0][0] > now:
+            return 0
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        enqueued = 0
+        try:
+            cursor = self.database.cursor()
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (self.lock_key,))
+            if not cursor.fetchone()[0]:
+                # another worker is firing, its last fire times will be seen
+                # on the next tick
+                self.database.rollback()
+                self._retry(due, now)
+                return 0
+            for _, _, schedule in due:
+                enqueued += self._fire(cursor, schedule, now)
+            self.database.commit()
+        except Exception:
+            self.database.rollback()
+            self._retry(due, now)
+            raise
+        for _, _, schedule in due:
+            self._push(schedule, schedule.spec.next_after(now))
+        return enqueued
+
+    def _retry(self, due, now):
+        # later rather than right away, the worker sleeps until then
+        retry_at = now + datetime.timedelta(seconds=self.retry_delay)
+        for _, _, schedule in due:
+            self._push(schedule, retry_at)
+
+    def _fire(self, cursor, schedule, now):
+        cursor.execute('SELECT last_fire_at FROM {table} WHERE name = %s' \
+            .format(table=self.table), (schedule.name,))
+        row = cursor.fetchone()
+        after = row[0] if row else schedule.registered_at
+        latest = schedule.spec.latest(after, now)
+        if latest is None:
+            return 0 # already fired by another worker
+        fire_times = schedule.fire_times(after, now)
+        for run_at in fire_times:
+            schedule.job_class.enqueue(self.database,
+                attributes=schedule.attributes, queue=schedule.queue,
+                priority=schedule.priority, run_at=run_at, commit=False)
+        cursor.execute('''
+            INSERT INTO {table} (name, last_fire_at) VALUES (%s, %s)
+            ON CONFLICT (name) DO UPDATE SET last_fire_at = EXCLUDED.last_fire_at
+        '''.format(table=self.table), (schedule.name, latest))
+        self.logger.info('Schedule %s enqueued %d jobs', schedule.name,
+            len(fire_times), phase='schedule')
+        return len(fire_times)
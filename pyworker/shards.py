@@ -0,0 +1,71 @@
+import random
+import time
+
+
+ROUND_ROBIN = 'round_robin'
+WEIGHTED = 'weighted'
+
+# last tenant served when it was the jobs without tenant
+NO_TENANT = object()
+
+
+class Shard(object):
+    '''A jobs database polled by the worker'''
+
+    def __init__(self, database, name):
+        super(Shard, self).__init__()
+        self.database = database
+        self.name = name
+        self.cursor = None
+        self.depth = None # estimated ready jobs, for the weighted policy
+        self.empty_polls = 0
+        self.skip_until = 0
+        self.last_tenant = None # fair share rotation, see Worker._fair_share_query
+
+    def connect(self):
+        self.cursor = self.database.connect().cursor()
+
+    def disconnect(self):
+        self.database.disconnect()
+
+
+class ShardSelector(object):
+    '''Decides in which order shards are polled for the next job.
+
+    `round_robin` starts from the next shard on every claim, `weighted`
+    picks shards at random weighted by their estimated queue depth.
+    Shards found empty are skipped for exponentially longer periods,
+    up to `max_backoff` seconds, while other shards are polled.'''
+
+    def __init__(self, shards, policy=ROUND_ROBIN, max_backoff=10,
+                 clock=time.monotonic, rng=None):
+        super(ShardSelector, self).__init__()
+        self.shards = shards
+        self.policy = policy
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._next = 0
+
+    def order(self):
+        if len(self.shards) == 1:
+            return list(self.shards)
+        now = self._clock()
+        if self.policy == WEIGHTED:
+            # weighted random permutation (Efraimidis-Spirakis)
+            shards = sorted(self.shards, key=lambda shard:
+                -self._rng.random() ** (1.0 / (1 + (shard.depth or 0))))
+        else:
+            start = self._next % len(self.shards)
+            self._next += 1
+            shards = self.shards[start:] + self.shards[:start]
+        return [shard for shard in shards if shard.skip_until <= now]
+
+    def record(self, shard, found):
+        if found:
+            shard.empty_polls = 0
+            shard.skip_until = 0
+        else:
+            shard.empty_polls += 1
+            backoff = min(self.max_backoff, 2 ** (shard.empty_polls - 1))
+            shard.skip_until = self._clock() + backoff
@@ -0,0 +1,233 @@
+import json
+import threading
+from pyworker.util import get_current_time, get_time_delta
+
+
+# arbitrary advisory lock key shared by the fleet, "pyqstats" in ascii
+DEFAULT_LOCK_KEY = 0x7079717374617473
+
+_COUNTERS = ['ready', 'locked', 'scheduled', 'failed']
+
+
+class QueueStats(object):
+    '''Per queue counts of ready, locked, scheduled (run_at in the future)
+    and failed jobs, plus the lag of the oldest ready job.
+
+    Counting delayed_jobs is expensive, so one worker of the fleet (the one
+    getting the advisory lock) counts every `refresh_interval` seconds and
+    stores the counts in a small shared table, that the other workers read.
+    Pending jobs are counted in one pass over the `failed_at IS NULL` rows,
+    an index only scan given the stats index listed by `pyworker indexes`,
+    so its cost follows the backlog rather than the table size. Failed
+    jobs, that can be many, are counted incrementally every
+    `failed_refresh_interval` seconds (the jobs failed since, a range of
+    the failed_at index), and recounted in full every
+    `failed_recount_interval` seconds to drop archived or retried ones.'''
+
+    def __init__(self, database, logger, table='pyworker_queue_stats',
+                 refresh_interval=30, failed_refresh_interval=600,
+                 failed_recount_interval=86400, max_run_time=3600, lock_key=DEFAULT_LOCK_KEY, reporter=None,
+                 clock=get_current_time):
+        super(QueueStats, self).__init__()
+        self.database = database
+        self.logger = logger
+        self.table = table
+        self.refresh_interval = refresh_interval
+        self.failed_refresh_interval = failed_refresh_interval
+        self.failed_recount_interval = failed_recount_interval
+        self.max_run_time = max_run_time
+        self.lock_key = lock_key
+        self.reporter = reporter
+        self._clock = clock
+        self._read_at = None
+        self.queues = {}
+        self.refreshed_at = None
+
+    def ensure_schema(self):
+        self.database.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                queue text PRIMARY KEY,
+                ready bigint NOT NULL DEFAULT 0,
+                locked bigint NOT NULL DEFAULT 0,
+                scheduled bigint NOT NULL DEFAULT 0,
+                failed bigint NOT NULL DEFAULT 0,
+                oldest_ready_at timestamp,
+                refreshed_at timestamp NOT NULL,
+                failed_refreshed_at timestamp
+            )
+        '''.format(table=self.table))
+        # tables created before incremental failed counts
+        self.database.cursor().execute('''
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS failed_recounted_at timestamp
+        '''.format(table=self.table))
+        self.database.commit()
+
+    def maybe_refresh(self, now=None):
+        '''Refreshes the local snapshot at most every refresh_interval'''
+        now = now or self._clock()
+        if self._read_at is not None and \
+                (now - self._read_at).total_seconds() < self.refresh_interval:
+            return False
+        self._read_at = now
+        self.refresh(now)
+        return True
+
+    def refresh(self, now=None):
+        now = now or self._clock()
+        cursor = self.database.cursor()
+        try:
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (self.lock_key,))
+            if cursor.fetchone()[0]:
+                self._count(cursor, now)
+            self.database.commit()
+            self._read(cursor, now)
+        except Exception:
+            # e.g. no stats table yet, the next claim needs the connection
+            self.database.rollback()
+            raise
+
+    def _count(self, cursor, now):
+        cursor.execute('SELECT max(refreshed_at), min(failed_refreshed_at), ' \
+            'min(failed_recounted_at) FROM {table}'.format(table=self.table))
+        refreshed_at, failed_refreshed_at, failed_recounted_at = cursor.fetchone()
+        if refreshed_at is not None and \
+                (now - refreshed_at).total_seconds() < self.refresh_interval:
+            return # counted by another worker in the meantime
+        expired = now - get_time_delta(seconds=self.max_run_time)
+        cursor.execute('''
+            SELECT queue,
+                count(*) FILTER (WHERE run_at <= %(now)s
+                    AND (locked_at IS NULL OR locked_at < %(expired)s)),
+                count(*) FILTER (WHERE locked_at >= %(expired)s),
+                count(*) FILTER (WHERE run_at > %(now)s
+                    AND (locked_at IS NULL OR locked_at < %(expired)s)),
+                min(run_at) FILTER (WHERE run_at <= %(now)s
+                    AND (locked_at IS NULL OR locked_at < %(expired)s))
+            FROM delayed_jobs WHERE failed_at IS NULL
+            GROUP BY queue
+        ''', {'now': now, 'expired': expired})
+        pending = cursor.fetchall()
+        cursor.execute('''
+            UPDATE {table} SET ready = 0, locked = 0, scheduled = 0,
+                oldest_ready_at = NULL, refreshed_at = %s
+        '''.format(table=self.table), (now,))
+        for queue, ready, locked, scheduled, oldest_ready_at in pending:
+            cursor.execute('''
+                INSERT INTO {table}
+                    (queue, ready, locked, scheduled, oldest_ready_at, refreshed_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (queue) DO UPDATE SET ready = EXCLUDED.ready,
+                    locked = EXCLUDED.locked, scheduled = EXCLUDED.scheduled,
+                    oldest_ready_at = EXCLUDED.oldest_ready_at,
+                    refreshed_at = EXCLUDED.refreshed_at
+            '''.format(table=self.table),
+                (queue, ready, locked, scheduled, oldest_ready_at, now))
+        if failed_refreshed_at is None or failed_recounted_at is None or \
+                (now - failed_recounted_at).total_seconds() >= \
+                self.failed_recount_interval:
+            self._count_failed(cursor, now)
+        elif (now - failed_refreshed_at).total_seconds() >= \
+                self.failed_refresh_interval:
+            self._count_failed(cursor, now, since=failed_refreshed_at)
+        self.logger.debug('Queue stats counted', phase='stats')
+        self._report(pending, now)
+
+    def _count_failed(self, cursor, now, since=None):
+        # all failed jobs, or only those failed since the last count, added
+        if since is None:
+            cursor.execute('''
+                SELECT queue, count(*) FROM delayed_jobs
+                WHERE failed_at IS NOT NULL GROUP BY queue
+            ''')
+            failed = cursor.fetchall()
+            cursor.execute('UPDATE {table} SET failed = 0, ' \
+                'failed_refreshed_at = %s, failed_recounted_at = %s' \
+                .format(table=self.table), (now, now))
+            total = 'EXCLUDED.failed'
+        else:
+            cursor.execute('''
+                SELECT queue, count(*) FROM delayed_jobs
+                WHERE failed_at > %s AND failed_at <= %s GROUP BY queue
+            ''', (since, now))
+            failed = cursor.fetchall()
+            cursor.execute('UPDATE {table} SET failed_refreshed_at = %s' \
+                .format(table=self.table), (now,))
+            total = '{table}.failed + EXCLUDED.failed'.format(table=self.table)
+        for queue, count in failed:
+            cursor.execute('''
+                INSERT INTO {table} (queue, failed, refreshed_at,
+                    failed_refreshed_at, failed_recounted_at)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (queue) DO UPDATE SET failed = {total},
+                    failed_refreshed_at = EXCLUDED.failed_refreshed_at
+            '''.format(table=self.table, total=total),
+                (queue, count, now, now, now))
+
+    def _report(self, pending, now):
+        # reported once per interval by the counting worker only
+        if not self.reporter:
+            return
+        for queue, ready, locked, scheduled, oldest_ready_at in pending:
+            lag = (now - oldest_ready_at).total_seconds() if oldest_ready_at else 0
+            for name, value in [('Ready', ready), ('Locked', locked),
+                                ('Scheduled', scheduled), ('Lag', lag)]:
+                self.reporter.record_metric(
+                    'Custom/Queue/%s/%s' % (queue, name), value)
+
+    def _read(self, cursor, now):
+        cursor.execute('''
+            SELECT queue, ready, locked, scheduled, failed, oldest_ready_at,
+                refreshed_at
+            FROM {table}
+        '''.format(table=self.table))
+        queues = {}
+        refreshed_at = None
+        for row in cursor.fetchall():
+            queue, counters, oldest_ready_at, row_refreshed_at = \
+                row[0], row[1:5], row[5], row[6]
+            stats = dict(zip(_COUNTERS, counters))
+            stats['lag_seconds'] = (now - oldest_ready_at).total_seconds() \
+                if oldest_ready_at else 0
+            queues[queue] = stats
+            refreshed_at = max(refreshed_at or row_refreshed_at, row_refreshed_at)
+        self.database.commit()
+        self.queues = queues
+        self.refreshed_at = refreshed_at
+
+    def snapshot(self):
+        return {
+            'refreshed_at': self.refreshed_at.isoformat() \
+                if self.refreshed_at else None,
+            'queues': self.queues,
+        }
+
+
+def start_stats_server(stats, port, host='127.0.0.1'):
+    '''Serves the last snapshot of a QueueStats as JSON on GET /stats,
+    from a daemon thread. Requests never hit the database.'''
+    # imported here, only needed when the endpoint is enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/stats':
+                self.send_error(404)
+                return
+            body = json.dumps(stats.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # keep access logs out of the worker logs
+
+    server = ThreadingHTTPServer((host, port), StatsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever,
+        name='pyworker-stats')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -1,10 +1,16 @@
 import time
 import datetime
-import dateutil.relativedelta
+
+_TIMEDELTA_UNITS = {'weeks', 'days', 'hours', 'minutes', 'seconds',
+                    'milliseconds', 'microseconds'}
 
 def get_current_time():
     # TODO return timezone or utc? get config from user?
     return datetime.datetime.utcnow()
 
 def get_time_delta(**kwargs):
+    # calendar units (months, years...) need dateutil, load it only for those
+    if set(kwargs) <= _TIMEDELTA_UNITS:
+        return datetime.timedelta(**kwargs)
+    import dateutil.relativedelta
     return dateutil.relativedelta.relativedelta(**kwargs)
@@ -0,0 +1,70 @@
+import os
+import resource
+import sys
+import threading
+from contextlib import contextmanager
+
+
+SOFT_LIMIT = 'soft_memory_limit'
+HARD_LIMIT = 'hard_memory_limit'
+
+
+def current_rss():
+    '''Resident set size of this process in bytes'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IOError, ValueError, IndexError):
+        # no procfs: fall back to the peak RSS, the best we can get
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class MemoryWatchdog(object):
+    '''Watches the worker RSS against a soft and a hard limit (in bytes).
+
+    Between jobs, exceeding any limit makes the worker exit cleanly so that
+    its supervisor restarts it. During a job, a monitor thread checks the
+    hard limit every `check_interval` seconds (when set) and calls back to
+    abort the job.'''
+
+    def __init__(self, soft_limit=None, hard_limit=None, check_interval=None,
+                 rss=current_rss):
+        super(MemoryWatchdog, self).__init__()
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.check_interval = check_interval
+        self._rss = rss
+
+    def check(self):
+        '''Returns the exceeded limit, if any'''
+        rss = self._rss()
+        if self.hard_limit and rss >= self.hard_limit:
+            return HARD_LIMIT
+        if self.soft_limit and rss >= self.soft_limit:
+            return SOFT_LIMIT
+        return None
+
+    @contextmanager
+    def monitor(self, on_hard_limit):
+        '''Calls on_hard_limit from a monitor thread, at most once, if the
+        hard limit is exceeded while the block runs'''
+        if not self.check_interval or not self.hard_limit:
+            yield
+            return
+        stopped = threading.Event()
+
+        def watch():
+            while not stopped.wait(self.check_interval):
+                if self._rss() >= self.hard_limit:
+                    on_hard_limit()
+                    return
+
+        thread = threading.Thread(target=watch, name='pyworker-watchdog')
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
@@ -1,30 +1,97 @@
 import sys
 import os, signal, traceback
 import time
+import threading
 from contextlib import contextmanager
 from pyworker.db import DBConnector
-from pyworker.job import Job
-from pyworker.logger import Logger
+from pyworker.job import Job, _job_class_registry
+from pyworker.logger import Logger, start_async_logging
 from pyworker.util import get_current_time, get_time_delta
-from pyworker.reporter import Reporter
+from pyworker.circuit_breaker import CLOSED
+from pyworker.watchdog import HARD_LIMIT
+from pyworker.shards import Shard, ShardSelector, WEIGHTED, NO_TENANT
+from pyworker.dedup import DigestCache
 
 class TimeoutException(Exception): pass
 class TerminatedException(Exception): pass
+class MemoryLimitException(Exception): pass
+
+def _handler_pattern(class_name):
+    # LIKE pattern matching the handlers of a job class,
+    # see Job.from_row for the matched line
+    return '%%object: !ruby/object:%s\n%%' % \
+        class_name.replace('_', '\\_').replace('%', '\\%').replace("'", "''")
+
+
+def _sql_literal(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'%s'" % str(value).replace("'", "''")
+
 
 class Worker(object):
     def __init__(self, dbstring, logger=None,
                  extra_delayed_job_fields=None,
                  reported_attributes_prefix='',
-                 max_backoff_delay_seconds=None):
+                 max_backoff_delay_seconds=None,
+                 async_logging=False):
         super(Worker, self).__init__()
+        self._log_listener = None
+        if logger is not None and async_logging:
+            self._log_listener = start_async_logging(logger)
         self.logger = Logger(logger)
         self.logger.info('Starting pyworker...')
-        self.database = DBConnector(dbstring, self.logger)
+        # a list of database urls makes the worker poll all of them (shards)
+        dbstrings = [dbstring] if isinstance(dbstring, str) else list(dbstring)
+        self.shards = [Shard(DBConnector(url, self.logger), 'shard-%d' % index)
+                       for index, url in enumerate(dbstrings)]
+        self.shard_selector = ShardSelector(self.shards)
+        self.shard_depth_interval = 30
+        self._shard_depths_at = 0
+        self.database = self.shards[0].database
         self.sleep_delay = 10
         self.max_attempts = 3
         self.max_run_time = 3600
         self.max_backoff_delay_seconds = max_backoff_delay_seconds
+        self.backoff = None
+        self.circuit_breaker = None
+        self.archiver = None
+        self.archive_interval = 3600
+        self.archive_max_batches = 10
+        self._archived_at = None
+        self.resource_accountant = None
+        self.payload_codec = None
+        self.dedup_cache = DigestCache()
+        self.checkpoint_store = None
+        self.dataset_cache = None
+        self.scheduler = None
+        self.queue_stats = None
+        self.stats_port = None
+        self._stats_server = None
+        self.lookahead = 0
+        self._pipeline = None
+        self.aging_interval = None
+        self.aging_candidates = 100
+        self.fair_share_column = None
+        self.affinity = None
+        self.duration_estimator = None
+        self.shortest_job_first = False
+        self.sjf_candidates = 100
+        self.sjf_max_wait = 600
+        self.adaptive_run_time = False
+        self.duration_sync_interval = None
+        self._durations_synced_at = None
+        self.admission = None
+        self.profiler = None
+        self.memory_watchdog = None
+        self.recycle_reason = None
+        self._job_running = False
         self.queue_names = 'default'
+        self.drain_timeout = None
+        self._draining = False
+        self._interruptible = False
+        self._drain_timer = None
+        self._stopping = False
         hostname = os.uname()[1]
         pid = os.getpid()
         self.name = 'host:%s pid:%d' % (hostname, pid)
@@ -37,6 +104,8 @@ class Worker(object):
 
         # Register application reporter if configured
         if NEW_RELIC_LICENSE_KEY and NEW_RELIC_APP_NAME:
+            # imported here, loading newrelic is costly and only needed when reporting
+            from pyworker.reporter import Reporter
             self.reporter = Reporter(
                 attribute_prefix=reported_attributes_prefix, logger=self.logger)
 
@@ -45,7 +114,7 @@ class Worker(object):
         def signal_handler(signum, frame):
             raise TimeoutException(('Execution expired. Either do ' + \
                 'the job faster or raise max_run_time > %d seconds') % \
-                self.max_run_time)
+                seconds)
         signal.signal(signal.SIGALRM, signal_handler)
         signal.alarm(seconds)
         try:
@@ -57,11 +126,124 @@ class Worker(object):
     def _terminatable(self):
         def signal_handler(signum, frame):
             signal_name = 'SIGTERM' if signum == 15 else 'SIGINT'
-            self.logger.info('Received signal: %s' % signal_name)
-            raise TerminatedException(signal_name)
+            self.logger.info('Received signal: %s', signal_name)
+            if self._stopping:
+                return # already shutting down, let the cleanup finish
+            # interrupt right away unless we can drain: stop claiming and let
+            # the running job finish, a second signal interrupts it
+            if self.drain_timeout is None or self._draining or \
+                    self._interruptible:
+                raise TerminatedException(signal_name)
+            self._start_draining()
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
-        yield
+        try:
+            yield
+        finally:
+            if self._drain_timer:
+                self._drain_timer.cancel()
+
+    def _stop_terminating(self):
+        # the loop exited: neither the drain deadline nor another signal may
+        # interrupt the shutdown steps
+        self._stopping = True
+        if self._drain_timer:
+            self._drain_timer.cancel()
+
+    def _start_draining(self):
+        self.logger.info('Draining: no more jobs will be picked up, ' \
+            'interrupting in %d seconds', self.drain_timeout, phase='drain')
+        self._draining = True
+        # past the grace deadline, signal ourselves again to interrupt the job
+        self._drain_timer = threading.Timer(self.drain_timeout,
+            os.kill, (os.getpid(), signal.SIGTERM))
+        self._drain_timer.daemon = True
+        self._drain_timer.start()
+
+    @contextmanager
+    def _memory_watched(self):
+        if self.memory_watchdog is None:
+            yield
+            return
+        def signal_handler(signum, frame):
+            # the watchdog thread may fire right after the job finished
+            if self._job_running:
+                raise MemoryLimitException('Worker RSS exceeded the hard memory limit')
+        signal.signal(signal.SIGUSR1, signal_handler)
+        main_thread = threading.get_ident()
+        with self.memory_watchdog.monitor(
+                lambda: signal.pthread_kill(main_thread, signal.SIGUSR1)):
+            self._job_running = True
+            try:
+                yield
+            finally:
+                self._job_running = False
+
+    @contextmanager
+    def _profiled(self, job):
+        if self.profiler is None:
+            yield
+            return
+        with self.profiler.profile(job):
+            yield
+
+    def _admission_deferred(self):
+        # while the host is saturated, claim nothing: the jobs stay in the
+        # queue for the workers of less loaded hosts
+        if self.admission is None:
+            return False
+        deferral = self.admission.check()
+        if deferral is None:
+            return False
+        check_name, reason = deferral
+        self.logger.info('Deferring claims: %s', reason, phase='admission')
+        if self.reporter:
+            self.reporter.record_metric(
+                'Custom/Admission/Deferred/%s' % check_name, 1)
+        if self._pipeline:
+            self._pipeline.release()
+        self.run_maintenance()
+        self._sleep(self.admission.retry_delay)
+        return True
+
+    @contextmanager
+    def _admission_tracked(self):
+        if self.admission is None:
+            yield
+            return
+        with self.admission.track():
+            yield
+
+    def _memory_exceeded(self):
+        # checked between jobs, past any limit we exit cleanly and let
+        # the supervisor restart a fresh worker
+        if self.memory_watchdog is None:
+            return False
+        reason = self.memory_watchdog.check()
+        if reason:
+            self._recycle(reason)
+        return reason is not None
+
+    def _recycle(self, reason):
+        self.recycle_reason = reason
+        self.logger.warning('Recycling worker: %s', reason, phase='recycle')
+        if self.reporter:
+            self.reporter.record_metric('Custom/Worker/Recycle/%s' % reason, 1)
+
+    def _sleep(self, delay=None):
+        # nothing to lose while sleeping, signals interrupt right away
+        self._interruptible = True
+        try:
+            delay = delay or self.sleep_delay
+            if self.scheduler is not None:
+                # wake up for the next recurring job rather than after it
+                until_next = self.scheduler.seconds_until_next()
+                if until_next is not None:
+                    # at least a second, never a busy loop on a late schedule
+                    delay = min(delay, max(until_next, 1))
+            time.sleep(delay)
+        finally:
+            self._interruptible = False
 
     @contextmanager
     def _instrument(self, job):
@@ -89,7 +271,7 @@ class Worker(object):
                 )
 
                 # Record extra fields if configured
-                self.logger.debug('job extra fields: %s' % job.extra_fields)
+                self.logger.debug('job extra fields: %s', job.extra_fields)
                 if job.extra_fields is not None:
                     self.reporter.report(**job.extra_fields)
 
@@ -97,98 +279,539 @@ class Worker(object):
         else:
             yield
 
+    @contextmanager
+    def _account(self, job):
+        if self.resource_accountant is None:
+            yield
+            return
+        with self.resource_accountant.measure(job) as usage:
+            yield
+        # usage is filled once measured, still inside the job transaction
+        if self.reporter:
+            self.reporter.report(
+                job_cpu_user_seconds=usage['cpu_user_seconds'],
+                job_cpu_system_seconds=usage['cpu_system_seconds'],
+                job_max_rss_delta_bytes=usage['max_rss_delta_bytes'])
+
     def run(self):
         # continuously check for new jobs on specified queue from db
-        self._cursor = self.database.connect().cursor()
+        for shard in self.shards:
+            shard.connect()
+        if self.archiver is not None and self.archiver.include_completed:
+            # completed jobs are archived from the first one on, within the
+            # job transaction where no partition can be created
+            for shard in self.shards:
+                self._maintain('Archive partitions',
+                    self.archiver.bind(shard.database).ensure_partitions,
+                    database=shard.database)
+        if self.queue_stats is not None and self.stats_port:
+            # imported here, the endpoint is optional
+            from pyworker.stats import start_stats_server
+            self._stats_server = start_stats_server(self.queue_stats,
+                self.stats_port)
         with self._terminatable():
-            while True:
+            while not self._draining:
+                try:
+                    if self._admission_deferred():
+                        continue
+                except TerminatedException:
+                    break
                 self.logger.debug('Picking up jobs...')
-                job = self.get_job()
+                job = self._next_job()
                 self._current_job = job # used in signal handlers
+                if job is not None and self._draining:
+                    # signaled while claiming, leave the job to other workers
+                    job.unlock()
+                    break
                 try:
                     if job is not None:
-                        self.handle_job(job)
-                    else: # sleep for a while before checking again for new jobs
-                        time.sleep(self.sleep_delay)
+                        with self._admission_tracked():
+                            self.handle_job(job)
+                    if not self._draining: # keep the grace period for shutdown
+                        self.run_maintenance()
+                    if job is None: # sleep for a while before checking again for new jobs
+                        self._sleep()
                 except TerminatedException:
                     break
+                except MemoryLimitException:
+                    self._recycle(HARD_LIMIT)
+                    break
+                if self._memory_exceeded():
+                    break
+            self._stop_terminating()
 
-            self.database.disconnect()
+            if self._pipeline:
+                self._pipeline.release()
+
+            if self.affinity is not None:
+                try:
+                    self.affinity.leave(self.name)
+                except Exception:
+                    self.logger.error('Could not leave the affinity workers: %s',
+                        traceback.format_exc())
+
+            if self._stats_server:
+                self._stats_server.shutdown()
+
+            for shard in self.shards:
+                shard.disconnect()
 
             # If configured shutdown reporter to upload data on shutdown
             if self.reporter:
                 self.reporter.shutdown()
 
-    def get_job(self):
-        def get_job_row():
-            now = get_current_time()
-            expired = now - get_time_delta(seconds=self.max_run_time)
-            now, expired = str(now), str(expired)
-            queues = self.queue_names.split(',')
-            queues = ', '.join(["'%s'" % q for q in queues])
-            fields = ['id', 'attempts', 'run_at', 'queue', 'handler']
-            if self.extra_delayed_job_fields:
-                fields += self.extra_delayed_job_fields
-            fields = ', '.join(fields)
-            query = '''
-            UPDATE delayed_jobs SET locked_at = '%s', locked_by = '%s'
-            WHERE id IN (SELECT delayed_jobs.id FROM delayed_jobs
-                WHERE ((run_at <= '%s'
+            if self.resource_accountant and self.resource_accountant.dump_path:
+                self.resource_accountant.dump()
+
+            # flush pending log records
+            if self._log_listener:
+                self._log_listener.stop()
+
+    def _next_job(self):
+        if not self.lookahead:
+            return self.get_job()
+        if self._pipeline is None:
+            # imported here, pipelining is optional
+            from pyworker.pipeline import PreparePipeline
+            self._pipeline = PreparePipeline(self.lookahead, self.logger)
+        # claim ahead so that the next jobs prepare while this one runs
+        while not self._pipeline.full() and not self._draining:
+            job = self.get_job()
+            if job is None:
+                break
+            self._pipeline.push(job)
+        while True:
+            job, waited = self._pipeline.pop()
+            # the job gets the whole max_run_time from now on, its lock must
+            # not expire before that, whatever it waited
+            if job is None or waited <= 0 or job.refresh_lock():
+                return job
+
+    def run_maintenance(self):
+        # low priority housekeeping, runs between jobs
+        if self.scheduler is not None:
+            self._maintain('Scheduling', self.scheduler.tick)
+        if self.affinity is not None:
+            self._maintain('Affinity heartbeat', self.affinity.maybe_heartbeat,
+                self.name)
+        if self.duration_estimator and self.duration_sync_interval:
+            now = time.time()
+            if self._durations_synced_at is None or \
+                    now - self._durations_synced_at >= self.duration_sync_interval:
+                self._durations_synced_at = now
+                self._maintain('Duration estimates sync',
+                    self.duration_estimator.sync, self.database)
+        if self.queue_stats is not None:
+            self._maintain('Queue stats refresh', self.queue_stats.maybe_refresh)
+        # archiving runs at most every interval
+        if self.archiver is None:
+            return
+        now = time.time()
+        if self._archived_at is not None and \
+                now - self._archived_at < self.archive_interval:
+            return
+        self._archived_at = now
+        # bounded, claiming waits for it; failed jobs pile up in every shard,
+        # while the other steps share their tables through the first one
+        for shard in self.shards:
+            archiver = self.archiver.bind(shard.database)
+            self._maintain('Archiving %s' % shard.name, archiver.archive,
+                archiver.max_batches or self.archive_max_batches,
+                database=shard.database)
+
+    def _maintain(self, step_name, step, *args, database=None):
+        # a failing step is logged and does not stop the worker, but signals
+        # and memory limits interrupt maintenance like they interrupt jobs
+        try:
+            step(*args)
+        except (TerminatedException, MemoryLimitException):
+            raise
+        except Exception:
+            self.logger.error('%s failed: %s', step_name, traceback.format_exc())
+            # the next claim needs a usable connection
+            try:
+                (database or self.database).rollback()
+            except Exception:
+                self.logger.error('Rollback failed: %s', traceback.format_exc())
+
+    def _ready_conditions(self):
+        '''WHERE conditions of the jobs this worker can claim now'''
+        now = get_current_time()
+        expired = now - get_time_delta(seconds=self.max_run_time)
+        now, expired = str(now), str(expired)
+        queues = self.queue_names.split(',')
+        queues = ', '.join(["'%s'" % q for q in queues])
+        exclusions = ''.join([
+            "\n                AND delayed_jobs.handler NOT LIKE '%s'" % pattern
+            for pattern in self._excluded_handler_patterns()])
+        if self._pipeline and len(self._pipeline):
+            # our own locks are claimable (to resume after a crash), but not
+            # those of the jobs claimed ahead
+            exclusions += '\n                AND delayed_jobs.id NOT IN (%s)' % \
+                ', '.join(['%d' % job_id for job_id in self._pipeline.job_ids()])
+        return '''((run_at <= '%s'
                 AND (locked_at IS NULL OR locked_at < '%s')
                 OR locked_by = '%s') AND failed_at IS NULL)
-                AND delayed_jobs.queue IN (%s)
-            ORDER BY priority ASC, run_at ASC LIMIT 1 FOR UPDATE) RETURNING
+                AND delayed_jobs.queue IN (%s)%s''' % \
+            (now, expired, self.name, queues, exclusions)
+
+    def _claim_fields(self):
+        fields = ['id', 'attempts', 'run_at', 'queue', 'handler']
+        if self.extra_delayed_job_fields:
+            fields += self.extra_delayed_job_fields
+        for column in [self.fair_share_column,
+                       self.affinity and self.affinity.column]:
+            if column and column not in fields:
+                fields.append(column)
+        return fields
+
+    def claim_query(self, shard=None):
+        '''The statement that locks the next job to run (in shard, whose
+        fair share rotation it continues) and returns its row'''
+        now = str(get_current_time())
+        fields = ', '.join(self._claim_fields())
+        return '''
+            UPDATE delayed_jobs SET locked_at = '%s', locked_by = '%s'
+            WHERE id IN (%s) RETURNING
                 %s
-            ''' % (now, self.name, now, expired, self.name, queues, fields)
-            self.logger.debug('query: %s' % query)
-            self._cursor.execute(query)
-            return self._cursor.fetchone()
-
-        job_row = get_job_row()
-        if job_row:
-            return Job.from_row(job_row, max_attempts=self.max_attempts,
-                database=self.database, logger=self.logger,
-                extra_fields=self.extra_delayed_job_fields,
-                reporter=self.reporter, max_backoff_delay_seconds=self.max_backoff_delay_seconds
-            )
+            ''' % (now, self.name, self._next_job_query(now, shard), fields)
+
+    def _next_job_query(self, now, shard=None):
+        ready = self._ready_conditions()
+        if self.fair_share_column:
+            return self._fair_share_query(ready,
+                shard.last_tenant if shard else None)
+        if self.affinity:
+            key = self._affinity_key_expression()
+            if key:
+                return self._affinity_query(ready, now, key)
+        if self.shortest_job_first and not self.aging_interval and \
+                self.duration_estimator and self.duration_estimator.estimates:
+            return self._shortest_job_first_query(ready, now)
+        if not self.aging_interval:
+            return '''SELECT delayed_jobs.id FROM delayed_jobs
+                WHERE %s
+            ORDER BY priority ASC, run_at ASC LIMIT 1 FOR UPDATE''' % ready
+        # aging: the priority improves by one every aging_interval seconds
+        # waited. Ordering all ready jobs by it would scan them all, so only
+        # the first candidates by priority and the oldest ones (those that
+        # aged the most) are compared, each read from an index.
+        return '''SELECT delayed_jobs.id FROM delayed_jobs
+                WHERE delayed_jobs.id = (SELECT candidates.id FROM (
+                    (SELECT id, priority, run_at FROM delayed_jobs
+                        WHERE %(ready)s
+                    ORDER BY priority ASC, run_at ASC LIMIT %(limit)d)
+                    UNION
+                    (SELECT id, priority, run_at FROM delayed_jobs
+                        WHERE %(ready)s
+                    ORDER BY run_at ASC LIMIT %(limit)d)) candidates
+                ORDER BY candidates.priority - floor(extract(epoch FROM
+                    '%(now)s'::timestamp - candidates.run_at) / %(aging)d) ASC,
+                    candidates.run_at ASC
+                LIMIT 1)
+                AND %(ready)s
+            FOR UPDATE''' % {'ready': ready, 'limit': self.aging_candidates,
+                'now': now, 'aging': self.aging_interval}
+
+    def _affinity_query(self, ready, now, key):
+        # among the first candidates, the jobs of the keys this worker
+        # served recently go first within a priority. The jobs of other keys
+        # are left to the live worker owning them (highest md5 of key and
+        # worker name) until they waited more than max_wait.
+        affinity = self.affinity
+        workers = sorted(set(affinity.live_workers) | set([self.name]))
+        warm = affinity.warm()
+        warm = 'candidates.affinity_key IN (%s)' % \
+            ', '.join([_sql_literal(k) for k in warm]) if warm else 'false'
+        return '''SELECT delayed_jobs.id FROM delayed_jobs
+                WHERE delayed_jobs.id = (SELECT candidates.id FROM
+                    (SELECT id, priority, run_at, %(key)s AS affinity_key
+                        FROM delayed_jobs
+                        WHERE %(ready)s
+                    ORDER BY priority ASC, run_at ASC LIMIT %(limit)d) candidates
+                WHERE candidates.affinity_key IS NULL OR %(warm)s
+                    OR candidates.run_at < '%(now)s'::timestamp -
+                        interval '%(max_wait)d seconds'
+                    OR (SELECT workers.name FROM (VALUES %(workers)s) workers (name)
+                        ORDER BY md5(candidates.affinity_key || ':' || workers.name) DESC
+                        LIMIT 1) = %(name)s
+                ORDER BY candidates.priority ASC, (%(warm)s) IS TRUE DESC,
+                    candidates.run_at ASC
+                LIMIT 1)
+                AND %(ready)s
+            FOR UPDATE''' % {'ready': ready, 'key': key,
+                'limit': affinity.candidates, 'warm': warm, 'now': now,
+                'max_wait': affinity.max_wait, 'name': _sql_literal(self.name),
+                'workers': ', '.join(['(%s)' % _sql_literal(worker)
+                    for worker in workers])}
+
+    def _shortest_job_first_query(self, ready, now):
+        # among the first candidates of the same priority, the job expected
+        # to be the shortest goes first (classes not known yet first, to
+        # learn them), unless one waited more than sjf_max_wait
+        expected = ''.join([
+            "\n                        WHEN candidates.handler LIKE '%s' THEN %f" % \
+                (_handler_pattern(class_name), seconds)
+            for class_name, seconds in sorted(
+                (class_name, self.duration_estimator.expected(class_name))
+                for class_name in self.duration_estimator.estimates)
+            if seconds is not None])
+        if not expected:
+            expected = '\n                        WHEN false THEN 0'
+        return '''SELECT delayed_jobs.id FROM delayed_jobs
+                WHERE delayed_jobs.id = (SELECT candidates.id FROM
+                    (SELECT id, priority, run_at, handler FROM delayed_jobs
+                        WHERE %(ready)s
+                    ORDER BY priority ASC, run_at ASC LIMIT %(limit)d) candidates
+                ORDER BY candidates.priority ASC,
+                    candidates.run_at < '%(now)s'::timestamp -
+                        interval '%(max_wait)d seconds' DESC,
+                    CASE%(expected)s
+                        ELSE 0 END ASC,
+                    candidates.run_at ASC
+                LIMIT 1)
+                AND %(ready)s
+            FOR UPDATE''' % {'ready': ready, 'limit': self.sjf_candidates,
+                'now': now, 'max_wait': self.sjf_max_wait, 'expected': expected}
+
+    def _fair_share_query(self, ready, last_tenant=None):
+        # round robin over tenants: the next job of the first tenant with
+        # ready jobs after the last one served, then of the jobs without
+        # tenant as one more tenant, wrapping around. Each min() and the
+        # jobs without tenant are single descents of the tenant index.
+        column = self.fair_share_column
+        first_tenant = '''%s = (SELECT min(%s) FROM delayed_jobs
+                        WHERE %s)''' % (column, column, ready)
+        no_tenant = '%s IS NULL' % column
+        if last_tenant is None or last_tenant is NO_TENANT:
+            tenants = [first_tenant, no_tenant]
         else:
+            next_tenant = '''%s = (SELECT min(%s) FROM delayed_jobs
+                        WHERE %s AND %s > %s)''' % (column, column, ready,
+                            column, _sql_literal(last_tenant))
+            tenants = [next_tenant, no_tenant, first_tenant]
+        return '''SELECT delayed_jobs.id FROM delayed_jobs
+                WHERE delayed_jobs.id = COALESCE(%s)
+                AND %s
+            FOR UPDATE''' % (','.join(['''
+                    (SELECT id FROM delayed_jobs
+                        WHERE %s AND %s
+                    ORDER BY priority ASC, run_at ASC LIMIT 1)''' % \
+                    (ready, tenant) for tenant in tenants]), ready)
+
+    def depth_query(self, limit=1000):
+        '''Counts the claimable jobs, up to limit to keep it cheap'''
+        return '''
+            SELECT count(*) FROM (SELECT 1 FROM delayed_jobs
+                WHERE %s
+                LIMIT %d) ready
+            ''' % (self._ready_conditions(), limit)
+
+    def _refresh_shard_depths(self):
+        now = time.time()
+        if self.shard_selector.policy != WEIGHTED or len(self.shards) == 1 or \
+                now - self._shard_depths_at < self.shard_depth_interval:
+            return
+        self._shard_depths_at = now
+        query = self.depth_query()
+        for shard in self.shards:
+            try:
+                shard.cursor.execute(query)
+                shard.depth = shard.cursor.fetchone()[0]
+                shard.database.commit()
+            except Exception:
+                self._shard_failed(shard, 'count ready jobs')
+
+    def _shard_failed(self, shard, action):
+        # an unreachable shard must not stop the worker polling the others:
+        # it is skipped like an empty one, with a usable connection or a new
+        # one by the next time
+        self.logger.error('Could not %s in %s: %s', action, shard.name,
+            traceback.format_exc(), shard=shard.name)
+        try:
+            shard.database.rollback()
+        except Exception:
+            try:
+                shard.connect()
+            except Exception:
+                self.logger.error('Could not reconnect to %s: %s', shard.name,
+                    traceback.format_exc(), shard=shard.name)
+        self.shard_selector.record(shard, False)
+
+    def get_job(self):
+        def get_job_row(shard):
+            query = self.claim_query(shard)
+            self.logger.debug('query: %s', query, phase='claim', shard=shard.name)
+            shard.cursor.execute(query)
+            job_row = shard.cursor.fetchone()
+            # commit the claim right away: no transaction (nor row lock) is
+            # held while the job runs, locked_by tells who owns it
+            shard.database.commit()
+            return job_row
+
+        self._refresh_shard_depths()
+        for shard in self.shard_selector.order():
+            try:
+                job_row = get_job_row(shard)
+            except Exception:
+                if len(self.shards) == 1:
+                    raise
+                self._shard_failed(shard, 'claim a job')
+                continue
+            self.shard_selector.record(shard, job_row is not None)
+            if job_row:
+                if self.fair_share_column:
+                    tenant = job_row[
+                        self._claim_fields().index(self.fair_share_column)]
+                    shard.last_tenant = NO_TENANT if tenant is None else tenant
+                checkpoint_store = self.checkpoint_store and \
+                    self.checkpoint_store.bind(shard.database)
+                archiver = self.archiver and self.archiver.bind(shard.database)
+                job = Job.from_row(job_row, max_attempts=self.max_attempts,
+                    database=shard.database, logger=self.logger,
+                    extra_fields=self.extra_delayed_job_fields,
+                    reporter=self.reporter, max_backoff_delay_seconds=self.max_backoff_delay_seconds,
+                    default_backoff=self.backoff, archiver=archiver,
+                    payload_codec=self.payload_codec,
+                    checkpoint_store=checkpoint_store, locked_by=self.name,
+                    dataset_cache=self.dataset_cache
+                )
+                if self.affinity:
+                    self._record_affinity(job, job_row)
+                return job
+        return None
+
+    def _record_affinity(self, job, job_row):
+        if self.affinity.column:
+            key = job_row[self._claim_fields().index(self.affinity.column)]
+        else:
+            key = job.affinity_key
+        if key is not None:
+            self.affinity.served(key)
+
+    def _affinity_key_expression(self):
+        # the SQL reading the affinity key of a delayed_jobs row, None when
+        # no job class has one
+        if self.affinity.column:
+            return '%s::text' % self.affinity.column
+        # unquoted like Job.affinity_key, so that both agree on the key
+        from pyworker.affinity import handler_key_sql
+        cases = ''.join([
+            "\n                        WHEN handler LIKE '%s' THEN %s" % (
+                _handler_pattern(class_name),
+                handler_key_sql(job_class.affinity_attribute))
+            for class_name, job_class in sorted(_job_class_registry.items())
+            if job_class.affinity_attribute])
+        if not cases:
             return None
+        return 'CASE%s\n                    END' % cases
+
+    def _excluded_handler_patterns(self):
+        # job classes are only known from the YAML handler column,
+        # see Job.from_row for the matched line
+        if not self.circuit_breaker:
+            return []
+        return [_handler_pattern(class_name)
+            for class_name in self.circuit_breaker.excluded_classes()]
+
+    def _record_circuit_outcome(self, job, error):
+        if job.class_name is None:
+            return # unparsable handler, no class to exclude from claims
+        state = self.circuit_breaker.record(job.class_name, error)
+        if state is None:
+            return
+        self.logger.warning('Circuit breaker for %s is now %s',
+            job.class_name, state)
+        if self.reporter:
+            self.reporter.record_metric(
+                'Custom/CircuitBreaker/%s/Open' % job.class_name,
+                0 if state == CLOSED else 1)
+
+    def _completed_recently(self, job):
+        if not job.deduplicate:
+            return False
+        if not self.dedup_cache.seen_within(job.digest, job.dedup_window):
+            return False
+        if self.reporter:
+            self.reporter.record_metric(
+                'Custom/Dedup/%s/Skipped' % job.class_name, 1)
+        return True
+
+    def _run_time_limit(self, job):
+        # never above max_run_time: past it the job lock expires
+        if self.adaptive_run_time and self.duration_estimator:
+            return self.duration_estimator.run_time_limit(job.class_name,
+                self.max_run_time)
+        return self.max_run_time
 
     def handle_job(self, job):
         if job is None:
             return
-        with self._instrument(job):
+        with self._instrument(job), self._account(job):
             start_time = time.time()
-            error = failed = False
+            error = failed = interrupted = False
+            run_seconds = None
             caught_exc_info = None
             try:
-                if job.abstract:
+                if job.load_error is not None:
+                    raise job.load_error
+                elif job.abstract:
                     raise ValueError(('Unsupported Job: %s, please import it ' \
                         + 'before you can handle it') % job.class_name)
+                elif self._completed_recently(job):
+                    job.logger.info('Job %d duplicates a job completed ' \
+                        'recently, skipping it', job.job_id, phase='dedup')
+                    job.remove()
                 else:
-                    self.logger.info('Running Job %d' % job.job_id)
-                    with self._time_limit(self.max_run_time):
+                    if job.handler_digest:
+                        job.coalesce(self.name, self.max_run_time)
+                    job.logger.info('Running Job %d', job.job_id, phase='run')
+                    with self._time_limit(self._run_time_limit(job)), \
+                            self._memory_watched():
+                        if job.prepared is not None:
+                            job.prepared.result() # raises what prepare raised
+                        else:
+                            job.prepare()
+                        run_started = time.time()
                         job.before()
-                        job.run()
+                        with self._profiled(job):
+                            job.run()
                         job.after()
+                        run_seconds = time.time() - run_started
                     job.success()
                     job.remove()
+                    if job.deduplicate:
+                        self.dedup_cache.add(job.digest)
+            except MemoryLimitException:
+                interrupted = True
+                # not the job's fault: release it without counting an attempt
+                job.unlock()
+                raise
             except Exception as exception:
                 error = True
                 caught_exc_info = sys.exc_info() # tuple of type, value, traceback
                 # handle error
                 error_str = traceback.format_exc()
-                failed = job.set_error_unlock(error_str)
+                failed = job.set_error_unlock(error_str, exception)
                 # if that was a termination error, bubble up to caller
                 if type(exception) == TerminatedException:
+                    interrupted = True
                     raise exception
             finally:
+                if self.dataset_cache is not None:
+                    job.release_datasets()
                 # report error status
                 if self.reporter:
                     self.reporter.report_raw(error=error)
                     self.reporter.report(job_failure=failed)
                     if caught_exc_info:
                         self.reporter.record_exception(caught_exc_info)
+                # interruptions say nothing about the health of the job class
+                if self.circuit_breaker and not interrupted:
+                    self._record_circuit_outcome(job, error)
+                if self.duration_estimator and run_seconds is not None and \
+                        not error:
+                    self.duration_estimator.record(job.class_name, run_seconds)
                 time_diff = time.time() - start_time
-                self.logger.info('Job %d finished in %d seconds' % \
-                    (job.job_id, time_diff))
+                job.logger.info('Job %d finished in %d seconds',
+                    job.job_id, time_diff, phase='finish')
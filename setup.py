@@ -16,5 +16,8 @@ setup(
     url="https://github.com/rayyansys/pyworker",
     license="MIT",
     packages=['pyworker'],
-    install_requires = requirements
+    install_requires = requirements,
+    entry_points = {
+        'console_scripts': ['pyworker=pyworker.cli:main']
+    }
 )
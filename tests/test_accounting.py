@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.accounting import ResourceAccountant
+
+
+class TestResourceAccountant(TestCase):
+    def setUp(self):
+        self.job = SimpleNamespace(class_name='TestJob')
+        self.accountant = ResourceAccountant()
+
+    def usage(self, wall=1.0, user=0.5, system=0.1, rss=0):
+        return {'wall_seconds': wall, 'cpu_user_seconds': user,
+                'cpu_system_seconds': system, 'max_rss_delta_bytes': rss}
+
+    def test_measure_fills_usage_and_records_class_stats(self):
+        with self.accountant.measure(self.job) as usage:
+            sum(range(10000))
+
+        for key in ['wall_seconds', 'cpu_user_seconds', 'cpu_system_seconds',
+                    'max_rss_delta_bytes']:
+            self.assertIn(key, usage)
+        self.assertNotIn('top_allocations', usage)
+        self.assertEqual(self.accountant.stats['TestJob']['count'], 1)
+
+    def test_measure_records_even_when_job_raises(self):
+        with self.assertRaises(ValueError):
+            with self.accountant.measure(self.job):
+                raise ValueError('test error')
+
+        self.assertEqual(self.accountant.stats['TestJob']['count'], 1)
+
+    def test_measure_sampled_job_records_top_allocations(self):
+        accountant = ResourceAccountant(tracemalloc_sample_rate=1.0, tracemalloc_top=3)
+
+        with accountant.measure(self.job) as usage:
+            data = [str(i) for i in range(1000)]
+
+        self.assertLessEqual(len(usage['top_allocations']), 3)
+        self.assertIn('last_top_allocations', accountant.stats['TestJob'])
+
+    def test_summary_aggregates_per_class(self):
+        self.accountant.record('TestJob', self.usage(wall=1.0, user=0.5, rss=100))
+        self.accountant.record('TestJob', self.usage(wall=3.0, user=1.5, rss=50))
+        self.accountant.record('OtherJob', self.usage())
+
+        summary = self.accountant.summary()
+
+        self.assertEqual(summary['TestJob']['count'], 2)
+        self.assertEqual(summary['TestJob']['wall_seconds'], 4.0)
+        self.assertEqual(summary['TestJob']['avg_cpu_user_seconds'], 1.0)
+        self.assertEqual(summary['TestJob']['max_rss_delta_bytes'], 100)
+        self.assertEqual(summary['OtherJob']['count'], 1)
+
+    def test_dump_writes_summary_as_json(self):
+        self.accountant.record('TestJob', self.usage())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stats.json')
+            self.accountant.dump(path)
+
+            with open(path) as f:
+                self.assertEqual(json.load(f)['TestJob']['count'], 1)
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.admission import LoadAverageCheck, AvailableMemoryCheck, \
+    CpuThrottlingCheck, InFlightCheck, AdmissionControl
+
+
+class TestLoadAverageCheck(TestCase):
+    def test_check_compares_load_per_cpu(self):
+        self.load = 3.0
+        check = LoadAverageCheck(max_load=1.0, cpu_count=4,
+            loadavg=lambda: (self.load, 0, 0))
+
+        self.assertIsNone(check.check())
+
+        self.load = 6.0
+        self.assertEqual(check.check(), 'load average 1.50 per CPU > 1.00')
+
+
+class TestFileChecks(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stats')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_available_memory_below_ratio_defers(self):
+        self.write('MemTotal:       1000000 kB\n' \
+                   'MemFree:          20000 kB\n' \
+                   'MemAvailable:     50000 kB\n')
+
+        reason = AvailableMemoryCheck(min_ratio=0.1, path=self.path).check()
+
+        self.assertEqual(reason, 'available memory 5.0% < 10.0%')
+
+    def test_available_memory_below_bytes_defers(self):
+        self.write('MemTotal: 1000000 kB\nMemAvailable: 500000 kB\n')
+
+        self.assertIsNone(AvailableMemoryCheck(min_bytes=2 ** 28,
+            path=self.path).check())
+        self.assertIsNotNone(AvailableMemoryCheck(min_bytes=2 ** 29,
+            path=self.path).check())
+
+    def test_available_memory_without_procfs_admits(self):
+        self.assertIsNone(AvailableMemoryCheck(path=self.path).check())
+
+    def test_cpu_throttling_compares_periods_since_previous_check(self):
+        check = CpuThrottlingCheck(max_ratio=0.1, path=self.path)
+        self.write('usage_usec 100\nnr_periods 100\nnr_throttled 50\n')
+        self.assertIsNone(check.check())
+
+        self.write('usage_usec 200\nnr_periods 200\nnr_throttled 55\n')
+        self.assertIsNone(check.check())
+
+        self.write('usage_usec 300\nnr_periods 300\nnr_throttled 75\n')
+        self.assertEqual(check.check(),
+            'CPU throttled in 20.0% of periods > 10.0%')
+
+    def test_in_flight_counts_jobs_of_live_workers(self):
+        check = InFlightCheck(max_jobs=1, directory=self.directory)
+        self.assertIsNone(check.check())
+
+        with check.track():
+            self.assertEqual(check.check(), '1 jobs in flight >= 1')
+
+        self.assertIsNone(check.check())
+
+    def test_in_flight_removes_files_of_dead_workers(self):
+        check = InFlightCheck(max_jobs=1, directory=self.directory)
+        dead = os.path.join(self.directory, '999999999')
+        open(dead, 'w').close()
+
+        self.assertEqual(check.in_flight(), 0)
+        self.assertFalse(os.path.exists(dead))
+
+
+class TestAdmissionControl(TestCase):
+    def make_check(self, name, reason=None):
+        check = MagicMock(spec=['name', 'check'])
+        check.name = name
+        check.check.return_value = reason
+        return check
+
+    def test_check_returns_first_deferring_check(self):
+        admission = AdmissionControl([self.make_check('A'),
+            self.make_check('B', 'busy'), self.make_check('C', 'full')])
+
+        self.assertEqual(admission.check(), ('B', 'busy'))
+        self.assertEqual(admission.deferrals, {'B': 1})
+
+    def test_check_admits_when_no_check_defers(self):
+        self.assertIsNone(AdmissionControl([self.make_check('A')]).check())
+
+    def test_track_enters_checks_tracking_jobs(self):
+        tracked = MagicMock(spec=['name', 'check', 'track'])
+        admission = AdmissionControl([self.make_check('A'), tracked])
+
+        with admission.track():
+            tracked.track.return_value.__enter__.assert_called_once()
+            tracked.track.return_value.__exit__.assert_not_called()
+
+        tracked.track.return_value.__exit__.assert_called_once()
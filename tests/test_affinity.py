@@ -0,0 +1,82 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.affinity import Affinity, rendezvous_owner, handler_key, \
+    handler_key_sql
+
+
+class TestRendezvousOwner(TestCase):
+    def test_owner_is_stable_when_other_workers_join(self):
+        workers = ['worker-%d' % i for i in range(5)]
+        owners = dict((key, rendezvous_owner(key, workers)) for key in range(100))
+
+        moved = [key for key in range(100)
+            if rendezvous_owner(key, workers + ['worker-5']) != owners[key]]
+
+        self.assertTrue(all(rendezvous_owner(key, workers + ['worker-5']) ==
+            'worker-5' for key in moved))
+        self.assertLess(len(moved), 40)
+
+
+class TestHandlerKey(TestCase):
+    def test_quoted_and_plain_scalars(self):
+        handler = "object: !ruby/object:ProjectJob\n  raw_attributes:\n" \
+            "    a: '00123'\n    b: 'it''s'\n    c: \"yes\"\n    d: 42\n"
+
+        self.assertEqual([handler_key(handler, name) for name in 'abcde'],
+            ['00123', "it's", 'yes', '42', None])
+
+    def test_sql_unquotes_like_handler_key(self):
+        sql = handler_key_sql('project_id')
+
+        self.assertIn("E'\\n    project_id: (?:''((?:[^''\\n]|'''')*)''|" \
+            "\"([^\"\\n]*)\"|([^''\"\\n][^\\n]*))'", sql)
+        self.assertIn("replace(key_match.groups[1], '''''', '''')", sql)
+
+
+class TestAffinity(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.database = MagicMock()
+        self.cursor = self.database.cursor.return_value
+        self.affinity = Affinity(self.database, warm_keys=2,
+            heartbeat_interval=10, clock=lambda: self.now)
+
+    def test_served_keeps_most_recent_keys(self):
+        self.affinity.served(1)
+        self.affinity.served(2)
+        self.affinity.served(1)
+        self.affinity.served(3)
+
+        self.assertEqual(self.affinity.warm(), ['1', '3'])
+
+    def test_heartbeat_upserts_and_reads_live_workers(self):
+        self.cursor.fetchall.return_value = [('a',), ('b',)]
+
+        self.affinity.heartbeat('a')
+
+        upsert = self.cursor.execute.call_args_list[0][0]
+        self.assertIn('ON CONFLICT (name) DO UPDATE', upsert[0])
+        self.assertEqual(upsert[1][0], 'a')
+        self.assertEqual(self.affinity.live_workers, ['a', 'b'])
+        self.database.commit.assert_called_once_with()
+
+    def test_maybe_heartbeat_once_per_interval(self):
+        self.affinity.heartbeat = MagicMock()
+
+        self.affinity.maybe_heartbeat('a')
+        self.now = 9
+        self.affinity.maybe_heartbeat('a')
+        self.now = 10
+        self.affinity.maybe_heartbeat('a')
+
+        self.assertEqual(self.affinity.heartbeat.call_count, 2)
+
+    def test_leave_deletes_heartbeat(self):
+        self.affinity.live_workers = ['a', 'b']
+
+        self.affinity.leave('a')
+
+        query, params = self.cursor.execute.call_args[0]
+        self.assertIn('DELETE FROM pyworker_workers', query)
+        self.assertEqual(params, ('a',))
+        self.assertEqual(self.affinity.live_workers, [])
@@ -0,0 +1,127 @@
+import datetime
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.archiver import Archiver
+
+
+class TestArchiver(TestCase):
+    def setUp(self):
+        self.database = MagicMock()
+        self.cursor = self.database.cursor.return_value
+        self.now = datetime.datetime(2023, 10, 7, 12, 0, 0)
+        self.archiver = Archiver(self.database, MagicMock(), batch_size=100,
+            failed_older_than=60)
+
+    def executed_queries(self):
+        return [call[0][0] for call in self.cursor.execute.call_args_list]
+
+    def test_ensure_schema_creates_partitioned_table_and_current_partition(self):
+        self.archiver.ensure_schema(now=self.now)
+
+        queries = self.executed_queries()
+        self.assertIn('PARTITION BY RANGE (archived_at)', queries[0])
+        self.assertIn('delayed_jobs_archive_202310 PARTITION OF delayed_jobs_archive', queries[1])
+        self.assertIn("FROM ('2023-10-01') TO ('2023-11-01')", queries[1])
+
+    def test_archive_batch_moves_failed_jobs_in_one_statement(self):
+        self.cursor.rowcount = 42
+
+        count = self.archiver.archive_batch(now=self.now)
+
+        self.assertEqual(count, 42)
+        query, values = self.cursor.execute.call_args[0]
+        self.assertIn('DELETE FROM delayed_jobs', query)
+        self.assertIn('INSERT INTO delayed_jobs_archive', query)
+        self.assertIn('FOR UPDATE SKIP LOCKED', query)
+        self.assertEqual(values, (datetime.datetime(2023, 10, 7, 11, 59, 0), 100, self.now))
+        self.database.commit.assert_called()
+
+    def test_archive_batch_failure_rolls_back(self):
+        self.cursor.execute.side_effect = [None, Exception('column mismatch')]
+
+        with self.assertRaises(Exception):
+            self.archiver.archive_batch(now=self.now)
+
+        self.database.rollback.assert_called_once_with()
+
+    def test_archive_batch_creates_partition_once(self):
+        self.archiver.archive_batch(now=self.now)
+        self.archiver.archive_batch(now=self.now)
+
+        partitions = [q for q in self.executed_queries() if 'PARTITION OF' in q]
+        self.assertEqual(len(partitions), 1)
+
+    def test_archive_stops_when_batch_is_not_full(self):
+        self.archiver.archive_batch = MagicMock(side_effect=[100, 100, 7])
+
+        stats = self.archiver.archive()
+
+        self.assertEqual(stats['archived'], 207)
+        self.assertEqual(stats['batches'], 3)
+
+    def test_archive_stops_at_max_batches(self):
+        self.archiver.archive_batch = MagicMock(return_value=100)
+
+        stats = self.archiver.archive(max_batches=2)
+
+        self.assertEqual(stats['archived'], 200)
+        self.assertEqual(stats['batches'], 2)
+
+    def test_archive_reports_throughput(self):
+        self.archiver.reporter = MagicMock()
+        self.archiver.archive_batch = MagicMock(return_value=5)
+
+        self.archiver.archive()
+
+        self.archiver.reporter.record_metric.assert_any_call('Custom/Archiver/Archived', 5)
+
+    def test_archive_completed_moves_jobs_in_one_statement(self):
+        self.archiver.archive_completed([1, 2], now=self.now)
+
+        query, values = self.cursor.execute.call_args[0]
+        self.assertIn('DELETE FROM delayed_jobs WHERE id = ANY(%(job_ids)s)', query)
+        self.assertNotIn('locked_by', query)
+        self.assertEqual(values['job_ids'], [1, 2])
+        self.assertEqual(values['now'], self.now)
+
+    def test_archive_completed_without_commit(self):
+        self.archiver.archive_completed([1], now=self.now, commit=False)
+
+        self.database.commit.assert_not_called()
+        self.assertFalse([q for q in self.executed_queries() if 'PARTITION OF' in q])
+
+    def test_ensure_partitions_creates_this_month_and_next(self):
+        self.archiver.ensure_partitions(now=datetime.datetime(2023, 12, 31))
+
+        partitions = [q for q in self.executed_queries() if 'PARTITION OF' in q]
+        self.assertIn("FROM ('2023-12-01') TO ('2024-01-01')", partitions[0])
+        self.assertIn("FROM ('2024-01-01') TO ('2024-02-01')", partitions[1])
+
+    def test_archive_creates_partitions_ahead(self):
+        self.archiver.archive_batch = MagicMock(return_value=0)
+
+        self.archiver.archive()
+
+        self.assertEqual(len([q for q in self.executed_queries()
+            if 'PARTITION OF' in q]), 2)
+
+    def test_bind_to_another_database_keeps_settings(self):
+        database = MagicMock()
+
+        bound = self.archiver.bind(database)
+
+        self.assertIs(self.archiver.bind(self.database), self.archiver)
+        self.assertIs(self.archiver.bind(database), bound)
+        self.assertIs(bound.database, database)
+        self.assertEqual(bound.table, self.archiver.table)
+
+    def test_archive_completed_guards_on_locked_by(self):
+        self.cursor.rowcount = 0
+
+        moved = self.archiver.archive_completed([1], now=self.now,
+            locked_by='host:pytest pid:1')
+
+        query, values = self.cursor.execute.call_args[0]
+        self.assertIn('AND locked_by = %(locked_by)s', query)
+        self.assertEqual(values['locked_by'], 'host:pytest pid:1')
+        self.assertEqual(moved, 0)
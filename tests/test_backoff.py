@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+from unittest import TestCase
+from pyworker.backoff import ExponentialBackoff, LinearBackoff, \
+    FullJitterBackoff, DecorrelatedJitterBackoff
+
+
+class TestBackoff(TestCase):
+
+    def job(self, attempts, job_id=1):
+        return SimpleNamespace(attempts=attempts, job_id=job_id)
+
+    def test_exponential_backoff_matches_delayed_job(self):
+        backoff = ExponentialBackoff()
+
+        self.assertEqual(backoff.delay(self.job(1)), 6)
+        self.assertEqual(backoff.delay(self.job(3)), 86)
+
+    def test_linear_backoff(self):
+        backoff = LinearBackoff(step=10, base=5)
+
+        self.assertEqual(backoff.delay(self.job(1)), 15)
+        self.assertEqual(backoff.delay(self.job(4)), 45)
+
+    def test_full_jitter_backoff_stays_within_bounds(self):
+        backoff = FullJitterBackoff(base=5, cap=30)
+
+        delays = [backoff.delay(self.job(3)) for _ in range(100)]
+
+        self.assertTrue(all(0 <= delay <= 30 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_decorrelated_jitter_backoff_is_stable_per_job(self):
+        backoff = DecorrelatedJitterBackoff(base=5, cap=100)
+
+        self.assertEqual(backoff.delay(self.job(3, job_id=7)),
+                         backoff.delay(self.job(3, job_id=7)))
+        self.assertNotEqual(backoff.delay(self.job(3, job_id=7)),
+                            backoff.delay(self.job(3, job_id=8)))
+
+    def test_decorrelated_jitter_backoff_respects_cap(self):
+        backoff = DecorrelatedJitterBackoff(base=5, cap=30)
+
+        for job_id in range(50):
+            self.assertLessEqual(backoff.delay(self.job(10, job_id=job_id)), 30)
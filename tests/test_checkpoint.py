@@ -0,0 +1,47 @@
+import datetime
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from pyworker.checkpoint import CheckpointStore
+
+
+class TestCheckpointStore(TestCase):
+    def setUp(self):
+        self.database = MagicMock()
+        self.cursor = self.database.cursor.return_value
+        self.store = CheckpointStore(self.database)
+
+    def test_ensure_schema_references_delayed_jobs(self):
+        self.store.ensure_schema()
+
+        query = self.cursor.execute.call_args[0][0]
+        self.assertIn('CREATE TABLE IF NOT EXISTS delayed_job_checkpoints', query)
+        self.assertIn('REFERENCES delayed_jobs (id) ON DELETE CASCADE', query)
+
+    @patch('pyworker.checkpoint.get_current_time')
+    def test_save_upserts_serialized_state_and_commits(self, mock_get_current_time):
+        now = datetime.datetime(2023, 10, 7, 0, 0, 0)
+        mock_get_current_time.return_value = now
+
+        self.store.save(1, {'offset': 100})
+
+        query, values = self.cursor.execute.call_args[0]
+        self.assertIn('ON CONFLICT (job_id) DO UPDATE', query)
+        self.assertEqual(values, (1, '{"offset": 100}', now))
+        self.database.commit.assert_called_once()
+
+    def test_load_deserializes_state(self):
+        self.cursor.fetchone.return_value = ('{"offset": 100}',)
+
+        self.assertEqual(self.store.load(1), {'offset': 100})
+        self.database.commit.assert_called_once_with()
+
+    def test_load_without_checkpoint_returns_none(self):
+        self.cursor.fetchone.return_value = None
+
+        self.assertIsNone(self.store.load(1))
+
+    def test_bind_to_another_database(self):
+        database = MagicMock()
+
+        self.assertIs(self.store.bind(self.database), self.store)
+        self.assertIs(self.store.bind(database).database, database)
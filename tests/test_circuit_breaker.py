@@ -0,0 +1,64 @@
+from unittest import TestCase
+from pyworker.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(error_rate_threshold=0.5, window_size=4,
+            min_calls=4, cooldown=60, clock=lambda: self.now)
+
+    def trip(self, class_name='FailingJob'):
+        for _ in range(4):
+            self.breaker.record(class_name, True)
+
+    def test_unknown_class_is_closed(self):
+        self.assertEqual(self.breaker.state('SomeJob'), CLOSED)
+        self.assertEqual(self.breaker.excluded_classes(), [])
+
+    def test_does_not_open_before_min_calls(self):
+        for _ in range(3):
+            self.assertIsNone(self.breaker.record('FailingJob', True))
+
+        self.assertEqual(self.breaker.state('FailingJob'), CLOSED)
+
+    def test_opens_when_error_rate_reaches_threshold(self):
+        self.breaker.record('FailingJob', False)
+        self.breaker.record('FailingJob', False)
+        self.breaker.record('FailingJob', True)
+
+        self.assertEqual(self.breaker.record('FailingJob', True), OPEN)
+        self.assertEqual(self.breaker.excluded_classes(), ['FailingJob'])
+
+    def test_stays_closed_below_threshold(self):
+        for error in [False, False, False, True]:
+            self.breaker.record('FailingJob', error)
+
+        self.assertEqual(self.breaker.state('FailingJob'), CLOSED)
+
+    def test_becomes_half_open_after_cooldown(self):
+        self.trip()
+        self.now = 60
+
+        self.assertEqual(self.breaker.state('FailingJob'), HALF_OPEN)
+        self.assertEqual(self.breaker.excluded_classes(), [])
+
+    def test_half_open_success_closes(self):
+        self.trip()
+        self.now = 60
+
+        self.assertEqual(self.breaker.record('FailingJob', False), CLOSED)
+
+    def test_half_open_error_opens_again(self):
+        self.trip()
+        self.now = 60
+
+        self.assertEqual(self.breaker.record('FailingJob', True), OPEN)
+        self.now = 100
+        self.assertEqual(self.breaker.excluded_classes(), ['FailingJob'])
+
+    def test_classes_are_independent(self):
+        self.trip()
+
+        self.assertEqual(self.breaker.state('HealthyJob'), CLOSED)
+        self.assertEqual(self.breaker.excluded_classes(), ['FailingJob'])
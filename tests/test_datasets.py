@@ -0,0 +1,104 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase, skipUnless
+from unittest.mock import MagicMock
+from pyworker.datasets import SharedDatasetCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestSharedDatasetCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SharedDatasetCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_acquire_loads_once_across_caches(self):
+        loader = MagicMock(return_value=b'embeddings')
+        other = SharedDatasetCache(self.directory)
+
+        with self.cache.open('model', loader) as dataset:
+            self.assertEqual(bytes(dataset.buffer), b'embeddings')
+        with other.open('model', loader) as dataset:
+            self.assertEqual(bytes(dataset.buffer), b'embeddings')
+
+        loader.assert_called_once_with()
+        self.assertEqual((self.cache.loads, other.hits), (1, 1))
+
+    def test_acquire_maps_datasets_loaded_by_other_processes(self):
+        with self.cache.open('model', lambda: b'embeddings'):
+            pass
+
+        result = subprocess.run([sys.executable, '-c',
+            'from pyworker.datasets import SharedDatasetCache; ' \
+            'cache = SharedDatasetCache(%r); ' \
+            'dataset = cache.acquire("model", lambda: b"reloaded"); ' \
+            'print(bytes(dataset.buffer).decode(), cache.loads)' % self.directory],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+
+        self.assertEqual(result.stdout.split(), ['embeddings', '0'])
+
+    def test_acquire_counts_references_in_process(self):
+        first = self.cache.acquire('model', lambda: b'data')
+        second = self.cache.acquire('model', lambda: b'data')
+
+        self.assertIs(first, second)
+        self.cache.release(first)
+        self.assertEqual(bytes(second.buffer), b'data')
+        self.cache.release(second)
+
+    def test_release_keeps_dataset_mapped_while_views_are_alive(self):
+        dataset = self.cache.acquire('model', lambda: b'data')
+        view = dataset.buffer
+
+        self.cache.release(dataset)
+
+        self.assertEqual(bytes(view), b'data')
+        self.assertIs(self.cache.acquire('model', lambda: b'other'), dataset)
+
+    def test_evict_removes_least_recently_used_unheld_datasets(self):
+        self.cache.max_bytes = 300
+        with self.cache.open('old', lambda: b'a' * 100):
+            pass
+        os.utime(self.cache._path('old'), (0, 0))
+        held = self.cache.acquire('held', lambda: b'b' * 100)
+        os.utime(self.cache._path('held'), (0, 0))
+
+        with self.cache.open('new', lambda: b'c' * 100):
+            pass
+
+        self.assertFalse(os.path.exists(self.cache._path('old')))
+        self.assertTrue(os.path.exists(self.cache._path('held')))
+        self.assertTrue(os.path.exists(self.cache._path('new')))
+        self.cache.release(held)
+
+    def test_evict_keeps_everything_within_max_bytes(self):
+        self.cache.max_bytes = 10 ** 6
+        with self.cache.open('model', lambda: b'data'):
+            pass
+
+        self.assertEqual(self.cache.evict(), 0)
+
+    @skipUnless(numpy, 'numpy is not installed')
+    def test_array_is_a_read_only_view(self):
+        array = numpy.arange(12, dtype='float32').reshape(3, 4)
+
+        with self.cache.open('table', lambda: array) as dataset:
+            view = dataset.array()
+            self.assertEqual(view.shape, (3, 4))
+            self.assertTrue((view == array).all())
+            self.assertFalse(view.flags.writeable)
+            del view
+
+    def test_array_of_bytes_dataset_raises(self):
+        with self.cache.open('model', lambda: b'data') as dataset:
+            with self.assertRaises((ValueError, ImportError)):
+                dataset.array()
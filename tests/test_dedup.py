@@ -0,0 +1,48 @@
+import hashlib
+from unittest import TestCase
+from pyworker.dedup import attributes_digest, handler_digest, DigestCache
+
+
+class TestDigests(TestCase):
+    def test_attributes_digest_ignores_key_order(self):
+        self.assertEqual(
+            attributes_digest('Job', {'a': 1, 'b': [1, 2]}),
+            attributes_digest('Job', {'b': [1, 2], 'a': 1}))
+
+    def test_attributes_digest_depends_on_class_name(self):
+        self.assertNotEqual(
+            attributes_digest('Job', {'a': 1}),
+            attributes_digest('OtherJob', {'a': 1}))
+
+    def test_handler_digest_matches_postgres_md5(self):
+        handler = '--- !ruby/object:Delayed::PerformableMethod\n'
+        self.assertEqual(handler_digest(handler),
+            hashlib.md5(handler.encode('utf-8')).hexdigest())
+
+
+class TestDigestCache(TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.cache = DigestCache(maxsize=2, clock=lambda: self.now)
+
+    def test_seen_within_window(self):
+        self.cache.add('a')
+        self.now += 30
+
+        self.assertTrue(self.cache.seen_within('a', 60))
+        self.assertFalse(self.cache.seen_within('b', 60))
+
+    def test_expires_after_window(self):
+        self.cache.add('a')
+        self.now += 61
+
+        self.assertFalse(self.cache.seen_within('a', 60))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_added(self):
+        self.cache.add('a')
+        self.cache.add('b')
+        self.cache.add('c')
+
+        self.assertFalse(self.cache.seen_within('a', 60))
+        self.assertTrue(self.cache.seen_within('c', 60))
@@ -0,0 +1,69 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.durations import DurationEstimate, DurationEstimator
+
+
+class TestDurationEstimate(TestCase):
+    def test_update_moves_mean_and_deviation_towards_sample(self):
+        estimate = DurationEstimate(10.0)
+
+        estimate.update(20.0, 0.5)
+
+        self.assertEqual(estimate.mean, 15.0)
+        self.assertEqual(estimate.deviation, 5.0)
+        self.assertEqual(estimate.samples, 2)
+
+    def test_high_adds_deviations_to_mean(self):
+        self.assertEqual(DurationEstimate(10.0, 2.0).high(), 16.0)
+
+
+class TestDurationEstimator(TestCase):
+    def setUp(self):
+        self.estimator = DurationEstimator(alpha=0.5, min_samples=3,
+            limit_factor=2, min_run_time=10)
+
+    def record(self, class_name, *samples):
+        for seconds in samples:
+            self.estimator.record(class_name, seconds)
+
+    def test_expected_is_none_until_min_samples(self):
+        self.record('TestJob', 5, 5)
+        self.assertIsNone(self.estimator.expected('TestJob'))
+        self.assertIsNone(self.estimator.expected('OtherJob'))
+
+        self.record('TestJob', 5)
+        self.assertEqual(self.estimator.expected('TestJob'), 5)
+
+    def test_run_time_limit_defaults_until_min_samples(self):
+        self.record('TestJob', 30, 30)
+
+        self.assertEqual(self.estimator.run_time_limit('TestJob', 3600), 3600)
+
+    def test_run_time_limit_is_limit_factor_times_high_estimate(self):
+        self.record('TestJob', 30, 30, 30)
+
+        self.assertEqual(self.estimator.run_time_limit('TestJob', 3600), 60)
+
+    def test_run_time_limit_is_bounded(self):
+        self.record('FastJob', 1, 1, 1)
+        self.record('SlowJob', 3000, 3000, 3000)
+
+        self.assertEqual(self.estimator.run_time_limit('FastJob', 3600), 10)
+        self.assertEqual(self.estimator.run_time_limit('SlowJob', 3600), 3600)
+
+    def test_sync_upserts_local_estimates_and_adopts_shared_ones(self):
+        self.record('TestJob', 30)
+        database = MagicMock()
+        cursor = database.cursor.return_value
+        cursor.fetchall.return_value = [('TestJob', 40.0, 4.0, 12),
+                                        ('OtherJob', 2.0, 0.5, 7)]
+
+        self.estimator.sync(database)
+
+        query, params = cursor.execute.call_args_list[0][0]
+        self.assertIn('ON CONFLICT (class_name) DO UPDATE', query)
+        self.assertEqual(params['class_name'], 'TestJob')
+        self.assertEqual(params['mean'], 30)
+        self.assertEqual(self.estimator.expected('TestJob'), 40.0)
+        self.assertEqual(self.estimator.expected('OtherJob'), 2.0)
+        database.commit.assert_called_once_with()
@@ -0,0 +1,142 @@
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from pyworker.index_advisor import IndexAdvisor
+from pyworker.job import Job
+
+
+class TestIndexAdvisor(TestCase):
+    def setUp(self):
+        self.worker = MagicMock(queue_names='default,mailers', archiver=None,
+            aging_interval=None, fair_share_column=None, queue_stats=None)
+        self.worker.claim_query.return_value = 'UPDATE delayed_jobs ...'
+        self.database = MagicMock()
+        self.cursor = self.database.cursor.return_value
+        self.advisor = IndexAdvisor(self.worker, database=self.database, runs=3)
+
+    def test_recommended_indexes_match_claim_queues(self):
+        name, definition = self.advisor.recommended_indexes()[0]
+
+        self.assertEqual(name, 'index_delayed_jobs_pyworker_claim_default_mailers')
+        self.assertEqual(definition, 'ON delayed_jobs (priority, run_at) ' \
+            "WHERE failed_at IS NULL AND queue IN ('default', 'mailers')")
+
+    def test_recommended_indexes_include_run_at_when_aging(self):
+        self.worker.aging_interval = 300
+
+        indexes = dict(self.advisor.recommended_indexes())
+
+        self.assertEqual(indexes['index_delayed_jobs_pyworker_aging_default_mailers'],
+            'ON delayed_jobs (run_at) ' \
+            "WHERE failed_at IS NULL AND queue IN ('default', 'mailers')")
+
+    def test_recommended_indexes_include_tenant_index_when_fair_sharing(self):
+        self.worker.fair_share_column = 'user_id'
+
+        indexes = dict(self.advisor.recommended_indexes())
+
+        self.assertEqual(indexes['index_delayed_jobs_pyworker_user_id_default_mailers'],
+            'ON delayed_jobs (user_id, priority, run_at) ' \
+            "WHERE failed_at IS NULL AND queue IN ('default', 'mailers')")
+
+    def test_recommended_indexes_include_failed_at_when_archiving(self):
+        self.worker.archiver = MagicMock()
+
+        names = [name for name, _ in self.advisor.recommended_indexes()]
+
+        self.assertIn('index_delayed_jobs_pyworker_failed_at', names)
+
+    def test_recommended_indexes_include_stats_indexes_with_queue_stats(self):
+        self.worker.queue_stats = MagicMock()
+
+        names = [name for name, _ in self.advisor.recommended_indexes()]
+
+        self.assertIn('index_delayed_jobs_pyworker_stats', names)
+        self.assertIn('index_delayed_jobs_pyworker_failed_at', names)
+
+    def test_recommended_indexes_include_handler_md5_when_deduplicating(self):
+        with patch.object(Job, 'deduplicate', True):
+            names = [name for name, _ in self.advisor.recommended_indexes()]
+
+        self.assertIn('index_delayed_jobs_pyworker_handler_md5', names)
+
+    def test_missing_indexes_skips_existing_definition_of_any_name(self):
+        # as printed by postgres
+        self.cursor.fetchall.return_value = [('index_delayed_jobs_on_claim',
+            'CREATE INDEX index_delayed_jobs_on_claim ON public.delayed_jobs ' \
+            'USING btree (priority, run_at) WHERE ((failed_at IS NULL) AND ' \
+            "((queue)::text = ANY ((ARRAY['default'::character varying, " \
+            "'mailers'::character varying])::text[])))")]
+
+        self.assertEqual(self.advisor.missing_indexes(), [])
+
+    def test_missing_indexes_compares_single_queue_predicate(self):
+        self.worker.queue_names = 'default'
+        self.cursor.fetchall.return_value = [('index_delayed_jobs_on_claim',
+            'CREATE INDEX index_delayed_jobs_on_claim ON public.delayed_jobs ' \
+            'USING btree (priority, run_at) WHERE ((failed_at IS NULL) AND ' \
+            "((queue)::text = 'default'::text))")]
+
+        self.assertEqual(self.advisor.missing_indexes(), [])
+
+    def test_missing_indexes_compares_expressions(self):
+        self.cursor.fetchall.return_value = [('index_delayed_jobs_on_handler',
+            'CREATE INDEX index_delayed_jobs_on_handler ON public.delayed_jobs ' \
+            'USING btree (md5(handler)) WHERE (failed_at IS NULL)')]
+
+        with patch.object(Job, 'deduplicate', True):
+            names = [name for name, _ in self.advisor.missing_indexes()]
+
+        self.assertNotIn('index_delayed_jobs_pyworker_handler_md5', names)
+
+    def test_missing_indexes_reports_same_name_with_other_definition(self):
+        # e.g. created for another list of queues
+        self.cursor.fetchall.return_value = [(
+            'index_delayed_jobs_pyworker_claim_default_mailers',
+            'CREATE INDEX index_delayed_jobs_pyworker_claim_default_mailers ' \
+            'ON public.delayed_jobs USING btree (priority, run_at) ' \
+            "WHERE ((failed_at IS NULL) AND ((queue)::text = 'default'::text))")]
+
+        [(name, definition)] = self.advisor.missing_indexes()
+
+        self.assertTrue(name.startswith(
+            'index_delayed_jobs_pyworker_claim_default_mailers_'))
+        self.assertLessEqual(len(name), 63)
+        self.assertIn("queue IN ('default', 'mailers')", definition)
+
+    def test_explain_runs_claim_query_and_rolls_back(self):
+        self.cursor.fetchall.return_value = [
+            ('Update on delayed_jobs',), ('Execution Time: 1.250 ms',)]
+
+        plan, execution_time = self.advisor.explain()
+
+        self.cursor.execute.assert_called_once_with(
+            'EXPLAIN (ANALYZE, BUFFERS) UPDATE delayed_jobs ...')
+        self.database.rollback.assert_called_once_with()
+        self.assertEqual(len(plan), 2)
+        self.assertEqual(execution_time, 1.25)
+
+    def test_advise_creates_missing_indexes_and_measures_again(self):
+        self.advisor.explain = MagicMock(side_effect=[
+            (['before'], 9.0), (['before'], 10.0), (['before'], 11.0), (['before'], 12.0),
+            (['after'], 1.0), (['after'], 2.0), (['after'], 3.0), (['after'], 4.0)])
+        self.cursor.fetchall.return_value = []
+
+        report = self.advisor.advise(create=True)
+
+        self.assertEqual(report['latency_before_ms'], 11.0)
+        self.assertEqual(report['latency_after_ms'], 3.0)
+        self.assertEqual(report['plan_after'], ['after'])
+        self.database.set_autocommit.assert_any_call(True)
+        query = self.cursor.execute.call_args[0][0]
+        self.assertTrue(query.startswith(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS index_delayed_jobs_pyworker_claim'))
+
+    def test_advise_without_create_only_reports(self):
+        self.advisor.explain = MagicMock(return_value=(['plan'], 5.0))
+        self.cursor.fetchall.return_value = []
+
+        report = self.advisor.advise()
+
+        self.assertEqual(len(report['missing_indexes']), 1)
+        self.assertIsNone(report['latency_after_ms'])
+        self.database.set_autocommit.assert_not_called()
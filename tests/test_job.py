@@ -1,7 +1,12 @@
 import datetime
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
+from pyworker.affinity import handler_key
 from pyworker.job import Job, get_current_time, get_time_delta
+from pyworker.backoff import LinearBackoff, RetryAfterException
+from pyworker.payload import PayloadCodec
+from pyworker.dedup import handler_digest
+from pyworker.archiver import Archiver
 
 
 class RegisteredJob(Job): # matching the registered class fixture
@@ -163,6 +168,76 @@ class TestJob(TestCase):
 
         self.assertEqual(job.reporter, mock_reporter)
 
+    def test_from_row_with_payload_codec_decodes_attributes(self):
+        codec = PayloadCodec(compress_threshold=10)
+        attributes = {'id': 100, 'title': 'long title ' * 10}
+        handler = Job.build_handler('RegisteredJob', codec.encode(attributes))
+
+        job = Job.from_row((1, 0, self.mock_run_at, 'default', handler),
+            self.mock_max_attempts, MagicMock(), MagicMock(), payload_codec=codec)
+
+        self.assertDictEqual(job.attributes, attributes)
+
+    def test_from_row_with_undecodable_payload_returns_failing_job(self):
+        # e.g. a blob reference on a worker without blob store
+        handler = Job.build_handler('RegisteredJob',
+            {'title': 'pyworker:ref:zlib:abc'})
+
+        job = Job.from_row((1, 0, self.mock_run_at, 'default', handler),
+            self.mock_max_attempts, MagicMock(), MagicMock(),
+            payload_codec=PayloadCodec())
+
+        self.assertTrue(job.abstract)
+        self.assertIsInstance(job.load_error, ValueError)
+
+    def test_enqueue_without_commit_keeps_blobs_in_transaction(self):
+        codec = MagicMock()
+        codec.encode.return_value = {'title': 'x'}
+        database = MagicMock()
+
+        RegisteredJob.enqueue(database, {'title': 'x'}, payload_codec=codec,
+            commit=False)
+
+        codec.encode.assert_called_once_with({'title': 'x'}, commit=False)
+
+    #********** .enqueue tests **********#
+
+    def test_build_handler_can_be_parsed_back(self):
+        attributes = {'id': 100, 'title': 'review title',
+            'description': 'review description\nmultiline\n', 'is_blind': True}
+        handler = Job.build_handler('RegisteredJob', attributes)
+
+        job = Job.from_row((1, 0, self.mock_run_at, 'default', handler),
+            self.mock_max_attempts, MagicMock(), MagicMock())
+
+        self.assertEqual(job.class_name, 'RegisteredJob')
+        self.assertDictEqual(job.attributes, attributes)
+
+    @patch('pyworker.job.get_current_time')
+    def test_enqueue_inserts_job_and_returns_id(self, mock_get_current_time):
+        mock_get_current_time.return_value = self.mock_now
+        database = MagicMock()
+        cursor = database.cursor.return_value
+        cursor.fetchone.return_value = (42,)
+
+        job_id = RegisteredJob.enqueue(database, {'id': 1}, queue='q', priority=3)
+
+        self.assertEqual(job_id, 42)
+        query, values = cursor.execute.call_args[0]
+        self.assertIn('INSERT INTO delayed_jobs', query)
+        self.assertEqual(values[0], 3)
+        self.assertIn('object: !ruby/object:RegisteredJob', values[1])
+        self.assertEqual(values[2:], (self.mock_now, 'q', self.mock_now, self.mock_now))
+        database.commit.assert_called_once_with()
+
+    def test_enqueue_without_commit(self):
+        database = MagicMock()
+        database.cursor.return_value.fetchone.return_value = (42,)
+
+        RegisteredJob.enqueue(database, commit=False)
+
+        database.commit.assert_not_called()
+
     #********** .set_error_unlock tests **********#
 
     def assert_job_updated_field(self, job, field, value):
@@ -266,6 +341,49 @@ class TestJob(TestCase):
 
         self.assert_job_updated_run_at(job, attempts=3, expected_value=datetime.datetime(2023, 10, 7, 0, 4, 21))
 
+    ## run_at
+    @patch('pyworker.job.get_current_time')
+    def test_set_error_unlock_uses_worker_default_backoff(
+            self, mock_get_current_time):
+        mock_get_current_time.return_value = self.mock_now
+        job = self.load_registered_job()
+        job.default_backoff = LinearBackoff(step=10, base=5)
+
+        self.assert_job_updated_run_at(job, attempts=1, expected_value=datetime.datetime(2023, 10, 7, 0, 0, 25))
+
+    ## run_at
+    @patch('pyworker.job.get_current_time')
+    def test_set_error_unlock_class_backoff_overrides_worker_default_backoff(
+            self, mock_get_current_time):
+        mock_get_current_time.return_value = self.mock_now
+        job = self.load_registered_job()
+        job.default_backoff = LinearBackoff(step=10, base=5)
+        job.backoff = LinearBackoff(step=1, base=0)
+
+        self.assert_job_updated_run_at(job, attempts=1, expected_value=datetime.datetime(2023, 10, 7, 0, 0, 2))
+
+    ## run_at
+    @patch('pyworker.job.get_current_time')
+    def test_set_error_unlock_uses_retry_after_hint_from_exception(
+            self, mock_get_current_time):
+        mock_get_current_time.return_value = self.mock_now
+        job = self.load_registered_job()
+
+        job.set_error_unlock('some error', RetryAfterException('busy', retry_after=120))
+
+        self.assert_job_updated_field(job, 'run_at', '2023-10-07 00:02:00')
+
+    ## run_at
+    @patch('pyworker.job.get_current_time')
+    def test_set_error_unlock_caps_retry_after_hint_to_max_backoff_delay_seconds(
+            self, mock_get_current_time):
+        mock_get_current_time.return_value = self.mock_now
+        job = self.load_registered_job(max_backoff_delay_seconds=60)
+
+        job.set_error_unlock('some error', RetryAfterException('busy', retry_after=120))
+
+        self.assert_job_updated_field(job, 'run_at', '2023-10-07 00:01:00')
+
     ## failed_at
     @patch('pyworker.job.get_current_time')
     def test_set_error_unlock_if_max_attempts_not_exceeded_does_not_update_failed_at(
@@ -376,3 +494,269 @@ class TestJob(TestCase):
 
         self.assertTrue(job.set_error_unlock('some error'))
 
+
+    #********** .unlock tests **********#
+
+    def test_unlock_nullifies_lock_without_counting_attempt(self):
+        job = self.load_registered_job()
+
+        job.unlock()
+
+        self.assert_job_updated_field(job, 'locked_at', None)
+        self.assert_job_updated_field(job, 'locked_by', None)
+        self.assert_job_non_updated_field(job, 'attempts')
+
+
+    #********** deduplication tests **********#
+
+    def test_from_row_when_deduplicating_sets_handler_digest(self):
+        with patch.object(RegisteredJob, 'deduplicate', True):
+            job = self.load_registered_job()
+
+        handler = self.load_fixture('handler_registered.yaml')
+        self.assertEqual(job.handler_digest, handler_digest(handler))
+
+    def test_from_row_when_not_deduplicating_skips_handler_digest(self):
+        job = self.load_registered_job()
+
+        self.assertIsNone(job.handler_digest)
+
+    def test_dataset_without_cache_raises(self):
+        job = self.load_registered_job()
+
+        with self.assertRaises(ValueError):
+            job.dataset('model', lambda: b'data')
+
+    def test_release_datasets_releases_acquired_datasets(self):
+        job = self.load_registered_job()
+        job.dataset_cache = MagicMock()
+
+        dataset = job.dataset('model', lambda: b'data')
+        job.release_datasets()
+        job.release_datasets()
+
+        job.dataset_cache.release.assert_called_once_with(dataset)
+
+    def test_affinity_key_reads_affinity_attribute(self):
+        with patch.object(RegisteredJob, 'affinity_attribute', 'id'):
+            job = self.load_registered_job()
+
+            self.assertEqual(job.affinity_key, '100')
+
+    def test_affinity_key_is_the_unquoted_handler_text(self):
+        # YAML quotes strings looking like numbers or booleans
+        handler = Job.build_handler('RegisteredJob',
+            {'id': '00123', 'name': "it's", 'flag': 'yes'})
+
+        with patch.object(RegisteredJob, 'affinity_attribute', 'id'):
+            job = Job.from_row((1, 0, self.mock_run_at, 'default', handler),
+                self.mock_max_attempts, MagicMock(), MagicMock())
+            self.assertEqual(job.affinity_key, '00123')
+        for attribute, key in [('name', "it's"), ('flag', 'yes')]:
+            self.assertEqual(handler_key(handler, attribute), key)
+
+    def test_affinity_key_without_affinity_attribute_is_none(self):
+        self.assertIsNone(self.load_registered_job().affinity_key)
+
+    def test_coalesce_locks_duplicates(self):
+        job = self.load_registered_job()
+        job.handler_digest = 'abc'
+        cursor = job.database.cursor.return_value
+        cursor.fetchall.return_value = [(2,), (3,)]
+
+        self.assertEqual(job.coalesce('worker', 3600), [2, 3])
+
+        query, values = cursor.execute.call_args[0]
+        self.assertIn('md5(handler) = %s AND id <> %s', query)
+        self.assertIn('FOR UPDATE SKIP LOCKED', query)
+        self.assertEqual(values[1:5], ('worker', 'abc', 1, 'default'))
+        job.database.commit.assert_called_once()
+
+    def test_remove_deletes_coalesced_duplicates(self):
+        job = self.load_registered_job()
+        job.coalesced_ids = [2, 3]
+
+        job.remove()
+
+        job.database.cursor.return_value.execute.assert_called_once_with(
+            'DELETE FROM delayed_jobs WHERE id IN (1, 2, 3)')
+
+    def test_set_error_unlock_releases_coalesced_duplicates(self):
+        job = self.load_registered_job()
+        job.coalesced_ids = [2, 3]
+
+        job.set_error_unlock('some error')
+
+        job.database.cursor.return_value.execute.assert_called_once_with(
+            'UPDATE delayed_jobs SET locked_at = NULL, locked_by = NULL ' \
+            'WHERE id = ANY(%s)', ([2, 3],))
+        self.assertEqual(job.coalesced_ids, [])
+
+    #********** checkpoint tests **********#
+
+    def test_checkpoint_saves_state(self):
+        job = self.load_registered_job()
+        job.checkpoint_store = MagicMock()
+
+        job.checkpoint({'offset': 100})
+
+        job.checkpoint_store.save.assert_called_once_with(1, {'offset': 100})
+        self.assertEqual(job.restored_state, {'offset': 100})
+        job.checkpoint_store.load.assert_not_called()
+
+    def test_checkpoint_without_store_raises(self):
+        job = self.load_registered_job()
+
+        with self.assertRaises(ValueError):
+            job.checkpoint({'offset': 100})
+
+    def test_restored_state_loads_last_checkpoint_once(self):
+        job = self.load_registered_job()
+        job.checkpoint_store = MagicMock()
+        job.checkpoint_store.load.return_value = {'offset': 100}
+
+        self.assertEqual(job.restored_state, {'offset': 100})
+        self.assertEqual(job.restored_state, {'offset': 100})
+        job.checkpoint_store.load.assert_called_once_with(1)
+
+    def test_restored_state_without_store_is_none(self):
+        job = self.load_registered_job()
+
+        self.assertIsNone(job.restored_state)
+
+    #********** lock ownership tests **********#
+
+    def load_owned_job(self):
+        job = self.load_job('handler_registered.yaml')
+        job.locked_by = 'host:pytest pid:1'
+        return job
+
+    def test_update_job_is_guarded_on_lock_owner(self):
+        job = self.load_owned_job()
+        cursor = job.database.cursor.return_value
+
+        job.unlock()
+
+        query, values = cursor.execute.call_args[0]
+        self.assertTrue(query.endswith('WHERE id = 1 AND locked_by = %s'))
+        self.assertEqual(values, (None, None, 'host:pytest pid:1'))
+
+    def test_remove_is_guarded_on_lock_owner(self):
+        job = self.load_owned_job()
+        cursor = job.database.cursor.return_value
+
+        job.remove()
+
+        cursor.execute.assert_called_once_with(
+            'DELETE FROM delayed_jobs WHERE id = 1 AND locked_by = %s',
+            ('host:pytest pid:1',))
+
+    def test_remove_when_lock_was_taken_over_reports_lost_lock(self):
+        job = self.load_owned_job()
+        job.reporter = MagicMock()
+        job.database.cursor.return_value.rowcount = 0
+
+        job.remove()
+
+        job.reporter.record_metric.assert_called_once_with(
+            'Custom/Job/LockLost', 1)
+
+    def test_set_error_unlock_rolls_back_failed_completion_first(self):
+        # e.g. archive_completed failed on a missing partition
+        job = self.load_owned_job()
+        calls = MagicMock()
+        job.database.rollback = calls.rollback
+        job.database.cursor.return_value.execute = calls.execute
+
+        job.set_error_unlock('some error')
+
+        self.assertEqual([name for name, _, _ in calls.mock_calls][:2],
+            ['rollback', 'execute'])
+
+    #********** transactional tests **********#
+
+    def load_transactional_job(self):
+        job = self.load_owned_job()
+        job.transactional = True
+        return job
+
+    def test_set_error_unlock_when_transactional_rolls_back_job_writes(self):
+        job = self.load_transactional_job()
+        calls = MagicMock()
+        job.database.rollback = calls.rollback
+        job.database.cursor.return_value.execute = calls.execute
+
+        job.set_error_unlock('some error')
+
+        self.assertEqual([name for name, _, _ in calls.mock_calls][:2],
+            ['rollback', 'execute'])
+
+    def test_remove_when_transactional_commits_once(self):
+        job = self.load_transactional_job()
+
+        job.remove()
+
+        job.database.commit.assert_called_once_with()
+        job.database.rollback.assert_not_called()
+
+    def test_remove_when_lock_was_taken_over_rolls_back_job_writes(self):
+        job = self.load_transactional_job()
+        job.database.cursor.return_value.rowcount = 0
+
+        job.remove()
+
+        job.database.rollback.assert_called_once_with()
+        job.database.commit.assert_not_called()
+
+    def test_remove_with_archiver_commits_archiving_with_job_writes(self):
+        job = self.load_transactional_job()
+        job.archiver = MagicMock(include_completed=True)
+        job.archiver.archive_completed.return_value = 1
+
+        job.remove()
+
+        job.archiver.archive_completed.assert_called_once_with([1],
+            locked_by='host:pytest pid:1', commit=False)
+        job.database.commit.assert_called_once_with()
+
+    def test_remove_with_archiver_when_lock_was_taken_over_commits_nothing(self):
+        job = self.load_transactional_job()
+        job.archiver = Archiver(job.database, MagicMock(), include_completed=True)
+        job.database.cursor.return_value.rowcount = 0
+
+        job.remove()
+
+        job.database.commit.assert_not_called()
+        job.database.rollback.assert_called_once_with()
+
+    def test_checkpoint_when_transactional_raises(self):
+        job = self.load_transactional_job()
+        job.checkpoint_store = MagicMock()
+
+        with self.assertRaises(ValueError):
+            job.checkpoint({'done': 1})
+
+        job.checkpoint_store.save.assert_not_called()
+        self.assertIsNone(job.restored_state)
+        job.checkpoint_store.load.assert_not_called()
+
+    def test_enqueue_followup_when_transactional_does_not_commit(self):
+        job = self.load_transactional_job()
+        followup = MagicMock()
+
+        job.enqueue_followup(followup, attributes={'a': 1})
+
+        followup.enqueue.assert_called_once_with(job.database,
+            attributes={'a': 1}, commit=False)
+
+    def test_refresh_lock_renews_locked_at_when_still_owned(self):
+        job = self.load_owned_job()
+        cursor = job.database.cursor.return_value
+        cursor.rowcount = 1
+
+        self.assertTrue(job.refresh_lock())
+
+        query, values = cursor.execute.call_args[0]
+        self.assertEqual(query,
+            'UPDATE delayed_jobs SET locked_at = %s WHERE id = 1 AND locked_by = %s')
+        self.assertEqual(values[1], 'host:pytest pid:1')
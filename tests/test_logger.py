@@ -0,0 +1,89 @@
+import logging
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from pyworker.logger import Logger, start_async_logging
+
+
+class CountingRepr(object):
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return 'formatted'
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLogger(TestCase):
+    def setUp(self):
+        self.handler = ListHandler()
+        self.std_logger = logging.getLogger('pyworker.tests.%s' % self._testMethodName)
+        self.std_logger.addHandler(self.handler)
+        self.std_logger.propagate = False
+        self.std_logger.setLevel(logging.INFO)
+        self.logger = Logger(self.std_logger)
+
+    def test_disabled_level_does_not_format_args(self):
+        payload = CountingRepr()
+
+        self.logger.debug('payload: %s', payload)
+
+        self.assertEqual(payload.count, 0)
+        self.assertEqual(self.handler.records, [])
+
+    def test_enabled_level_formats_args(self):
+        self.logger.info('Job %d: %s', 1, 'done')
+
+        self.assertEqual(self.handler.records[0].getMessage(), 'Job 1: done')
+
+    def test_fields_are_record_attributes(self):
+        logger = self.logger.bind(job_id=1, queue='default')
+
+        logger.info('Running', phase='run')
+
+        record = self.handler.records[0]
+        self.assertEqual(record.job_id, 1)
+        self.assertEqual(record.queue, 'default')
+        self.assertEqual(record.phase, 'run')
+        self.assertEqual(record.fields, {'job_id': 1, 'queue': 'default', 'phase': 'run'})
+
+    def test_bind_does_not_change_parent_fields(self):
+        self.logger.bind(job_id=1)
+
+        self.assertEqual(self.logger.fields, {})
+
+    @patch('builtins.print')
+    def test_without_logger_prints_formatted_message_and_fields(self, mock_print):
+        logger = Logger(None).bind(job_id=1)
+
+        logger.error('Job %d failed', 1, phase='error')
+
+        mock_print.assert_called_once_with('ERROR: Job 1 failed [job_id=1 phase=error]')
+
+    @patch('builtins.print')
+    def test_custom_logger_with_level_methods_only(self, mock_print):
+        custom = MagicMock(spec=['debug', 'info', 'warning', 'error'])
+        logger = Logger(custom).bind(job_id=1)
+
+        logger.info('Job %d done', 1)
+
+        custom.info.assert_called_once_with('Job 1 done [job_id=1]')
+        mock_print.assert_not_called()
+
+    def test_start_async_logging_delivers_records_through_listener(self):
+        listener = start_async_logging(self.std_logger)
+        try:
+            self.logger.info('async %s', 'message')
+        finally:
+            listener.stop()
+
+        self.assertEqual(self.handler.records[0].getMessage(), 'async message')
+        self.assertIsInstance(self.std_logger.handlers[0], logging.handlers.QueueHandler)
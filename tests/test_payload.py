@@ -0,0 +1,136 @@
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.payload import PayloadCodec, FileBlobStore, CachedBlobStore, \
+    DatabaseBlobStore, LazyAttributes
+
+
+class CountingStore(object):
+    def __init__(self):
+        self.blobs = {}
+        self.gets = 0
+        self.commits = []
+
+    def put(self, data, key=None, commit=True):
+        self.commits.append(commit)
+        key = key or 'key%d' % len(self.blobs)
+        self.blobs[key] = bytes(data)
+        return key
+
+    def get(self, key):
+        self.gets += 1
+        return self.blobs.get(key)
+
+
+class TestPayloadCodec(TestCase):
+    def setUp(self):
+        self.large = 'abc' * 1000
+        self.store = CountingStore()
+
+    def test_small_values_are_kept_inline(self):
+        codec = PayloadCodec(compress_threshold=100)
+
+        self.assertEqual(codec.encode({'a': 'small', 'b': 1}), {'a': 'small', 'b': 1})
+
+    def test_zlib_roundtrip(self):
+        codec = PayloadCodec(compress_threshold=100)
+
+        encoded = codec.encode({'a': self.large})
+
+        self.assertTrue(encoded['a'].startswith('pyworker:zlib:'))
+        self.assertLess(len(encoded['a']), len(self.large))
+        self.assertEqual(codec.decode(encoded), {'a': self.large})
+
+    def test_lzma_roundtrip(self):
+        codec = PayloadCodec(compression='lzma', compress_threshold=100)
+
+        encoded = codec.encode({'a': self.large})
+
+        self.assertTrue(encoded['a'].startswith('pyworker:lzma:'))
+        self.assertEqual(codec.decode(encoded), {'a': self.large})
+
+    def test_unsupported_compression_raises(self):
+        with self.assertRaises(ValueError):
+            PayloadCodec(compression='zstd')
+
+    def test_large_values_are_stored_and_fetched_lazily(self):
+        codec = PayloadCodec(compress_threshold=100, store=self.store,
+            external_threshold=10)
+
+        encoded = codec.encode({'a': self.large, 'b': 1})
+        decoded = codec.decode(encoded)
+
+        self.assertTrue(encoded['a'].startswith('pyworker:ref:zlib:'))
+        self.assertIsInstance(decoded, LazyAttributes)
+        self.assertEqual(self.store.gets, 0)
+        self.assertEqual(decoded['b'], 1)
+        self.assertEqual(self.store.gets, 0)
+        self.assertEqual(decoded['a'], self.large)
+        self.assertEqual(decoded.get('a'), self.large)
+        self.assertEqual(self.store.gets, 1)
+
+    def test_encode_without_commit_leaves_blobs_uncommitted(self):
+        codec = PayloadCodec(compress_threshold=100, store=self.store,
+            external_threshold=10)
+
+        codec.encode({'a': self.large}, commit=False)
+
+        self.assertEqual(self.store.commits, [False])
+
+    def test_reference_without_store_raises(self):
+        with self.assertRaises(ValueError):
+            PayloadCodec().decode({'a': 'pyworker:ref:zlib:abc'})
+
+
+class TestBlobStores(TestCase):
+    def test_file_blob_store_roundtrip_is_content_addressed(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = FileBlobStore(root)
+
+            key = store.put(b'some data')
+
+            self.assertEqual(store.put(b'some data'), key)
+            self.assertEqual(bytes(store.get(key)), b'some data')
+            self.assertIsNone(store.get('missing'))
+
+    def test_cached_blob_store_fetches_once(self):
+        remote = CountingStore()
+        key = remote.put(b'shared data')
+        with tempfile.TemporaryDirectory() as root:
+            store = CachedBlobStore(remote, root)
+
+            self.assertEqual(bytes(store.get(key)), b'shared data')
+            self.assertEqual(bytes(store.get(key)), b'shared data')
+            self.assertEqual(remote.gets, 1)
+
+    def test_database_blob_store_put_ignores_duplicates(self):
+        database = MagicMock()
+        store = DatabaseBlobStore(database)
+
+        key = store.put(b'data')
+
+        query, values = database.cursor.return_value.execute.call_args[0]
+        self.assertIn('ON CONFLICT (key) DO NOTHING', query)
+        self.assertEqual(values, (key, b'data'))
+        database.commit.assert_called_once_with()
+
+    def test_database_blob_store_get_ends_its_read_transaction(self):
+        database = MagicMock()
+        database.in_transaction.return_value = False
+        database.cursor.return_value.fetchone.return_value = (b'data',)
+
+        self.assertEqual(DatabaseBlobStore(database).get('key'), b'data')
+
+        database.rollback.assert_called_once_with()
+        database.commit.assert_not_called()
+
+    def test_database_blob_store_get_leaves_job_transaction_open(self):
+        # e.g. fetched by a transactional job after its first writes
+        database = MagicMock()
+        database.in_transaction.return_value = True
+        database.cursor.return_value.fetchone.return_value = None
+
+        self.assertIsNone(DatabaseBlobStore(database).get('key'))
+
+        database.rollback.assert_not_called()
+        database.commit.assert_not_called()
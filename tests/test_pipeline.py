@@ -0,0 +1,67 @@
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.pipeline import PreparePipeline
+
+
+class TestPreparePipeline(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.pipeline = PreparePipeline(lookahead=1, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.pipeline.release()
+
+    def make_job(self, job_id):
+        return MagicMock(job_id=job_id, abstract=False, prepared=None)
+
+    def test_push_runs_prepare_on_background_thread(self):
+        job = self.make_job(1)
+        threads = []
+        job.prepare.side_effect = lambda: threads.append(threading.current_thread())
+
+        self.pipeline.push(job)
+        job.prepared.result(timeout=1)
+
+        self.assertNotEqual(threads, [threading.current_thread()])
+
+    def test_full_after_lookahead_jobs_besides_the_next(self):
+        self.pipeline.push(self.make_job(1))
+        self.assertFalse(self.pipeline.full())
+
+        self.pipeline.push(self.make_job(2))
+        self.assertTrue(self.pipeline.full())
+
+    def test_pop_in_claim_order_with_waited_seconds(self):
+        first, second = self.make_job(1), self.make_job(2)
+        self.pipeline.push(first)
+        self.pipeline.push(second)
+        self.now = 5
+
+        self.assertEqual(self.pipeline.pop(), (first, 5))
+        self.assertEqual(self.pipeline.pop(), (second, 5))
+        self.assertEqual(self.pipeline.pop(), (None, 0))
+
+    def test_job_ids_of_waiting_jobs(self):
+        self.pipeline.push(self.make_job(1))
+        self.pipeline.push(self.make_job(2))
+        self.pipeline.pop()
+
+        self.assertEqual(self.pipeline.job_ids(), [2])
+
+    def test_abstract_jobs_are_not_prepared(self):
+        job = self.make_job(1)
+        job.abstract = True
+
+        self.pipeline.push(job)
+
+        self.assertIsNone(job.prepared)
+
+    def test_release_unlocks_waiting_jobs(self):
+        job = self.make_job(1)
+        self.pipeline.push(job)
+
+        self.pipeline.release()
+
+        job.unlock.assert_called_once_with()
+        self.assertEqual(len(self.pipeline), 0)
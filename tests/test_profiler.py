@@ -0,0 +1,130 @@
+import functools
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.profiler import StackSampler, SamplingProfiler
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class SlowJob(object):
+    class_name = 'SlowJob'
+    job_id = 7
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.logger = MagicMock()
+
+    def run(self):
+        busy(self.seconds)
+
+
+def traced(method):
+    @functools.wraps(method)
+    def wrapper(self):
+        return method(self)
+    return wrapper
+
+
+class DecoratedJob(SlowJob):
+    class_name = 'DecoratedJob'
+
+    @traced
+    def run(self):
+        busy(self.seconds)
+
+
+class TestStackSampler(TestCase):
+    def test_sample_counts_stacks_from_root_code(self):
+        sampler = StackSampler(threading.get_ident(),
+            root_code=self.test_sample_counts_stacks_from_root_code.__code__)
+
+        sampler.sample()
+        sampler.sample()
+
+        stack, count = sampler.collapsed().rsplit(' ', 1)
+        self.assertTrue(stack.startswith('test_sample_counts_stacks_from_root_code ('))
+        self.assertIn(';sample (', stack)
+        self.assertEqual(count, '2\n')
+
+
+class TestSamplingProfiler(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def profiles(self):
+        return os.listdir(self.directory)
+
+    def test_delay_for_listed_classes_and_sampled_jobs(self):
+        self.rate = 0.5
+        profiler = SamplingProfiler(self.directory, classes=['SlowJob'],
+            sample_rate=0.1, slow_threshold=30, rng=lambda: self.rate)
+
+        self.assertEqual(profiler.delay_for('SlowJob'), 0)
+        self.assertEqual(profiler.delay_for('OtherJob'), 30)
+        self.rate = 0.05
+        self.assertEqual(profiler.delay_for('OtherJob'), 0)
+
+    def test_profile_writes_collapsed_stacks_of_run(self):
+        profiler = SamplingProfiler(self.directory, classes=['SlowJob'],
+            interval=0.001)
+        job = SlowJob(0.1)
+
+        with profiler.profile(job):
+            job.run()
+
+        name, = self.profiles()
+        self.assertTrue(name.startswith('SlowJob.7.'))
+        with open(os.path.join(self.directory, name)) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith('run (') for line in lines))
+        self.assertTrue(any(';busy (' in line for line in lines))
+
+    def test_profile_of_decorated_run_starts_at_wrapped_run(self):
+        profiler = SamplingProfiler(self.directory, classes=['DecoratedJob'],
+            interval=0.001)
+        job = DecoratedJob(0.1)
+
+        with profiler.profile(job):
+            job.run()
+
+        name, = self.profiles()
+        with open(os.path.join(self.directory, name)) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith('run (') for line in lines))
+
+    def test_profile_samples_only_past_slow_threshold(self):
+        profiler = SamplingProfiler(self.directory, slow_threshold=0.2,
+            interval=0.001)
+
+        job = SlowJob(0.05)
+        with profiler.profile(job):
+            job.run()
+        self.assertEqual(self.profiles(), [])
+
+        job = SlowJob(0.3)
+        with profiler.profile(job):
+            job.run()
+        self.assertEqual(len(self.profiles()), 1)
+
+    def test_profile_skips_unselected_jobs(self):
+        profiler = SamplingProfiler(self.directory, interval=0.001)
+
+        job = SlowJob(0.05)
+        with profiler.profile(job):
+            job.run()
+
+        self.assertEqual(self.profiles(), [])
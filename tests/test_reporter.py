@@ -63,6 +63,16 @@ class TestReporter(TestCase):
                 group='DelayedJob'
             )
 
+    #********** .record_metric tests **********#
+
+    @patch('pyworker.reporter.newrelic.agent')
+    def test_reporter_record_metric_calls_newrelic_record_custom_metric(self, newrelic_agent):
+        reporter = Reporter()
+        reporter.record_metric('Custom/Test', 1)
+
+        newrelic_agent.record_custom_metric.assert_called_once_with(
+            'Custom/Test', 1, application=reporter._newrelic_app)
+
     #********** .shutdown tests **********#
 
     @patch('pyworker.reporter.newrelic.agent')
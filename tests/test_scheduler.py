@@ -0,0 +1,186 @@
+import datetime
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.job import Job
+from pyworker.scheduler import Scheduler, IntervalSpec, CronSpec, ALL, ONCE, SKIP
+
+
+class ScheduledJob(Job):
+    def run(self):
+        pass
+
+
+def at(*args):
+    return datetime.datetime(2023, 10, *args)
+
+
+class TestIntervalSpec(TestCase):
+    def test_next_after_is_aligned_on_epoch(self):
+        spec = IntervalSpec(300)
+
+        self.assertEqual(spec.next_after(at(7, 0, 1, 30)), at(7, 0, 5))
+        self.assertEqual(spec.next_after(at(7, 0, 5)), at(7, 0, 10))
+
+    def test_latest(self):
+        spec = IntervalSpec(300)
+
+        self.assertEqual(spec.latest(at(7, 0, 0), at(7, 0, 17)), at(7, 0, 15))
+        self.assertIsNone(spec.latest(at(7, 0, 15), at(7, 0, 17)))
+
+
+class TestCronSpec(TestCase):
+    def test_next_after_every_15_minutes(self):
+        spec = CronSpec('*/15 * * * *')
+
+        self.assertEqual(spec.next_after(at(7, 0, 1)), at(7, 0, 15))
+        self.assertEqual(spec.next_after(at(7, 23, 45)), at(8, 0, 0))
+
+    def test_next_after_weekday_range(self):
+        spec = CronSpec('30 9 * * 1-5')
+
+        # 2023-10-07 is a saturday
+        self.assertEqual(spec.next_after(at(7, 12, 0)), at(9, 9, 30))
+
+    def test_next_after_skips_months(self):
+        spec = CronSpec('0 0 1 1 *')
+
+        self.assertEqual(spec.next_after(at(7, 0, 0)),
+            datetime.datetime(2024, 1, 1, 0, 0))
+
+    def test_day_and_weekday_either_match(self):
+        spec = CronSpec('0 0 15 * 0')
+
+        # sunday the 8th comes before the 15th
+        self.assertEqual(spec.next_after(at(7, 0, 0)), at(8, 0, 0))
+
+    def test_last_occurrences_after_long_downtime(self):
+        spec = CronSpec('*/15 * * * *')
+
+        self.assertEqual(spec.last_occurrences(at(1, 0, 0), at(7, 0, 40), 3),
+            [at(7, 0, 0), at(7, 0, 15), at(7, 0, 30)])
+        self.assertEqual(spec.last_occurrences(at(7, 0, 10), at(7, 0, 40), 3),
+            [at(7, 0, 15), at(7, 0, 30)])
+        self.assertEqual(spec.latest(at(1, 0, 0), at(7, 0, 40)), at(7, 0, 30))
+
+    def test_invalid_expression_raises(self):
+        with self.assertRaises(ValueError):
+            CronSpec('* * *')
+        with self.assertRaises(ValueError):
+            CronSpec('61 * * * *')
+
+
+class TestScheduler(TestCase):
+    def setUp(self):
+        self.now = at(7, 0, 0)
+        self.database = MagicMock()
+        self.cursor = self.database.cursor.return_value
+        self.cursor.fetchone.side_effect = [(True,), None]
+        self.scheduler = Scheduler(self.database, MagicMock(),
+            clock=lambda: self.now)
+        ScheduledJob.enqueue = MagicMock()
+
+    def tearDown(self):
+        del ScheduledJob.enqueue
+
+    def test_register_requires_one_spec(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.register(ScheduledJob)
+
+    def test_tick_before_next_fire_does_nothing(self):
+        self.scheduler.register(ScheduledJob, every=300)
+        self.scheduler.tick(self.now) # checks the missed occurrences
+        self.cursor.execute.reset_mock()
+
+        self.assertEqual(self.scheduler.tick(at(7, 0, 4)), 0)
+
+        self.cursor.execute.assert_not_called()
+
+    def test_tick_enqueues_due_schedule_under_advisory_lock(self):
+        self.scheduler.register(ScheduledJob, every=300, queue='cron')
+
+        self.assertEqual(self.scheduler.tick(at(7, 0, 5)), 1)
+
+        lock_query = self.cursor.execute.call_args_list[0][0][0]
+        self.assertIn('pg_try_advisory_xact_lock', lock_query)
+        ScheduledJob.enqueue.assert_called_once_with(self.database,
+            attributes=None, queue='cron', priority=0, run_at=at(7, 0, 5),
+            commit=False)
+        self.database.commit.assert_called_once()
+        self.assertEqual(self.scheduler.seconds_until_next(at(7, 0, 5)), 300)
+
+    def test_tick_without_lock_retries_schedule_later(self):
+        self.cursor.fetchone.side_effect = [(False,)]
+        self.scheduler.register(ScheduledJob, every=300)
+
+        self.assertEqual(self.scheduler.tick(at(7, 0, 5)), 0)
+
+        ScheduledJob.enqueue.assert_not_called()
+        self.database.rollback.assert_called_once()
+        self.assertEqual(self.scheduler.seconds_until_next(at(7, 0, 5)), 10)
+
+    def test_tick_failure_rolls_back_and_retries_schedule_later(self):
+        self.cursor.execute.side_effect = Exception('connection lost')
+        self.scheduler.register(ScheduledJob, every=300)
+
+        with self.assertRaises(Exception):
+            self.scheduler.tick(at(7, 0, 5))
+
+        self.database.rollback.assert_called_once()
+        self.assertEqual(self.scheduler.seconds_until_next(at(7, 0, 5)), 10)
+
+    def test_tick_skips_occurrence_fired_by_another_worker(self):
+        self.cursor.fetchone.side_effect = [(True,), (at(7, 0, 5),)]
+        self.scheduler.register(ScheduledJob, every=300)
+
+        self.assertEqual(self.scheduler.tick(at(7, 0, 6)), 0)
+
+        ScheduledJob.enqueue.assert_not_called()
+
+    def test_register_catches_up_on_first_tick(self):
+        # restarted at 01:00 after missing the daily run of 00:00
+        self.now = at(7, 1, 0)
+        self.cursor.fetchone.side_effect = [(True,), (at(6, 0, 0),)]
+        self.scheduler.register(ScheduledJob, cron='0 0 * * *', catch_up=ONCE)
+
+        self.assertEqual(self.scheduler.seconds_until_next(), 0)
+        self.assertEqual(self.scheduler.tick(), 1)
+
+        self.assertEqual(ScheduledJob.enqueue.call_args[1]['run_at'], at(7, 0, 0))
+        self.assertEqual(self.scheduler.seconds_until_next(), 23 * 3600)
+
+    def test_catch_up_all_only_walks_last_occurrences(self):
+        # every second, after a day without worker
+        self.cursor.fetchone.side_effect = [(True,), (at(6, 0, 0),)]
+        schedule = self.scheduler.register(ScheduledJob, every=1,
+            catch_up=ALL, max_catch_up=3)
+        schedule.spec.next_after = MagicMock(
+            side_effect=IntervalSpec(1).next_after)
+
+        self.scheduler.tick(at(7, 0, 0))
+
+        run_ats = [call[1]['run_at'] for call in ScheduledJob.enqueue.call_args_list]
+        self.assertEqual(run_ats,
+            [at(6, 23, 59, 58), at(6, 23, 59, 59), at(7, 0, 0)])
+        self.assertLess(schedule.spec.next_after.call_count, 10)
+
+    def assert_catch_up(self, expected_run_ats, **options):
+        self.cursor.fetchone.side_effect = [(True,), (at(7, 0, 0),)]
+        self.scheduler.register(ScheduledJob, every=300, **options)
+
+        self.scheduler.tick(at(7, 0, 16))
+
+        run_ats = [call[1]['run_at'] for call in ScheduledJob.enqueue.call_args_list]
+        self.assertEqual(run_ats, expected_run_ats)
+
+    def test_catch_up_all_enqueues_every_missed_occurrence(self):
+        self.assert_catch_up([at(7, 0, 5), at(7, 0, 10), at(7, 0, 15)],
+            catch_up=ALL)
+
+    def test_catch_up_once_enqueues_latest_occurrence(self):
+        self.assert_catch_up([at(7, 0, 15)], catch_up=ONCE)
+
+    def test_catch_up_skip_drops_occurrences_past_misfire_grace(self):
+        self.assert_catch_up([], catch_up=SKIP, misfire_grace=30)
+
+    def test_catch_up_skip_enqueues_occurrence_within_misfire_grace(self):
+        self.assert_catch_up([at(7, 0, 15)], catch_up=SKIP, misfire_grace=60)
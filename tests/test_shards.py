@@ -0,0 +1,65 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.shards import Shard, ShardSelector, WEIGHTED
+
+
+class TestShardSelector(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.shards = [Shard(MagicMock(), 'shard-%d' % i) for i in range(3)]
+        self.selector = ShardSelector(self.shards, max_backoff=8,
+            clock=lambda: self.now)
+
+    def names(self, shards):
+        return [shard.name for shard in shards]
+
+    def test_round_robin_rotates_first_shard(self):
+        self.assertEqual(self.names(self.selector.order()), ['shard-0', 'shard-1', 'shard-2'])
+        self.assertEqual(self.names(self.selector.order()), ['shard-1', 'shard-2', 'shard-0'])
+        self.assertEqual(self.names(self.selector.order()), ['shard-2', 'shard-0', 'shard-1'])
+
+    def test_empty_shard_is_skipped_with_exponential_backoff(self):
+        shard = self.shards[0]
+
+        self.selector.record(shard, False)
+        self.assertNotIn(shard, self.selector.order())
+        self.now = 1
+        self.assertIn(shard, self.selector.order())
+
+        self.selector.record(shard, False)
+        self.selector.record(shard, False)
+        self.assertEqual(shard.skip_until, 1 + 4)
+
+    def test_backoff_is_capped(self):
+        shard = self.shards[0]
+
+        for _ in range(10):
+            self.selector.record(shard, False)
+
+        self.assertEqual(shard.skip_until, 8)
+
+    def test_found_job_resets_backoff(self):
+        shard = self.shards[0]
+        self.selector.record(shard, False)
+
+        self.selector.record(shard, True)
+
+        self.assertIn(shard, self.selector.order())
+        self.assertEqual(shard.empty_polls, 0)
+
+    def test_single_shard_is_never_skipped(self):
+        selector = ShardSelector(self.shards[:1], clock=lambda: self.now)
+
+        selector.record(self.shards[0], False)
+
+        self.assertEqual(selector.order(), self.shards[:1])
+
+    def test_weighted_prefers_deeper_shards(self):
+        self.selector.policy = WEIGHTED
+        self.shards[0].depth = 0
+        self.shards[1].depth = 1000
+        self.shards[2].depth = 0
+
+        firsts = [self.selector.order()[0].name for _ in range(200)]
+
+        self.assertGreater(firsts.count('shard-1'), 150)
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+
+# generous budget, importing the worker takes a few tens of ms locally
+IMPORT_TIME_BUDGET_MS = 150
+
+
+class TestStartup(TestCase):
+
+    def run_python(self, *args):
+        return subprocess.run([sys.executable] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+
+    def test_worker_import_does_not_load_optional_dependencies(self):
+        result = self.run_python('-c',
+            'import sys, pyworker.worker; ' \
+            'print(" ".join(sorted(m.split(".")[0] for m in sys.modules)))')
+        loaded = set(result.stdout.split())
+
+        for module in ['newrelic', 'yaml', 'psycopg2', 'dateutil']:
+            self.assertNotIn(module, loaded)
+
+    def test_worker_import_time_within_budget(self):
+        timings = []
+        for _ in range(3):
+            result = self.run_python('-X', 'importtime', '-c', 'import pyworker.worker')
+            for line in result.stderr.splitlines():
+                if line.endswith('| pyworker.worker'):
+                    timings.append(int(line.split('|')[1]) / 1000.0)
+
+        self.assertLess(min(timings), IMPORT_TIME_BUDGET_MS)
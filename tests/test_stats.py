@@ -0,0 +1,125 @@
+import datetime
+import json
+import urllib.request
+from unittest import TestCase
+from unittest.mock import MagicMock
+from pyworker.stats import QueueStats, start_stats_server
+
+
+class TestQueueStats(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2023, 10, 7, 0, 0, 30)
+        self.database = MagicMock()
+        self.cursor = self.database.cursor.return_value
+        self.reporter = MagicMock()
+        self.stats = QueueStats(self.database, MagicMock(),
+            reporter=self.reporter, clock=lambda: self.now)
+        self.stored_rows = [
+            ('default', 5, 1, 2, 3, datetime.datetime(2023, 10, 7, 0, 0, 0),
+             self.now)]
+
+    def executed_queries(self):
+        return [call[0][0] for call in self.cursor.execute.call_args_list]
+
+    def test_refresh_with_lock_counts_and_stores(self):
+        self.cursor.fetchone.side_effect = [(True,), (None, None, None)]
+        self.cursor.fetchall.side_effect = [
+            [('default', 5, 1, 2, datetime.datetime(2023, 10, 7, 0, 0, 0))],
+            [('default', 3)],
+            self.stored_rows]
+
+        self.stats.refresh()
+
+        queries = self.executed_queries()
+        self.assertTrue(any('WHERE failed_at IS NULL' in q for q in queries))
+        self.assertTrue(any('WHERE failed_at IS NOT NULL' in q for q in queries))
+        self.reporter.record_metric.assert_any_call('Custom/Queue/default/Ready', 5)
+        self.reporter.record_metric.assert_any_call('Custom/Queue/default/Lag', 30)
+        self.assertEqual(self.stats.queues['default'], {'ready': 5, 'locked': 1,
+            'scheduled': 2, 'failed': 3, 'lag_seconds': 30})
+
+    def test_refresh_counts_only_jobs_failed_since_last_count(self):
+        counted_at = self.now - datetime.timedelta(seconds=600)
+        self.cursor.fetchone.side_effect = [(True,), (counted_at, counted_at,
+            counted_at)]
+        self.cursor.fetchall.side_effect = [[], [('default', 2)],
+            self.stored_rows]
+
+        self.stats.refresh()
+
+        failed_query = [call for call in self.cursor.execute.call_args_list
+            if 'failed_at >' in call[0][0]][0]
+        self.assertEqual(failed_query[0][1], (counted_at, self.now))
+        upsert = [q for q in self.executed_queries() if 'failed =' in q][-1]
+        self.assertIn('pyworker_queue_stats.failed + EXCLUDED.failed', upsert)
+        self.assertFalse(any('failed_at IS NOT NULL' in q
+                             for q in self.executed_queries()))
+
+    def test_refresh_recounts_failed_jobs_after_recount_interval(self):
+        counted_at = self.now - datetime.timedelta(seconds=600)
+        recounted_at = self.now - datetime.timedelta(days=1)
+        self.cursor.fetchone.side_effect = [(True,), (counted_at, counted_at,
+            recounted_at)]
+        self.cursor.fetchall.side_effect = [[], [('default', 3)],
+            self.stored_rows]
+
+        self.stats.refresh()
+
+        self.assertTrue(any('failed_at IS NOT NULL' in q
+                            for q in self.executed_queries()))
+
+    def test_refresh_without_lock_only_reads(self):
+        self.cursor.fetchone.side_effect = [(False,)]
+        self.cursor.fetchall.side_effect = [self.stored_rows]
+
+        self.stats.refresh()
+
+        self.assertFalse(any('FROM delayed_jobs' in q
+                             for q in self.executed_queries()))
+        self.reporter.record_metric.assert_not_called()
+        self.assertEqual(self.stats.queues['default']['ready'], 5)
+
+    def test_refresh_failing_read_rolls_back(self):
+        self.cursor.fetchone.side_effect = [(False,)]
+        self.cursor.fetchall.side_effect = Exception('no such table')
+
+        with self.assertRaises(Exception):
+            self.stats.refresh()
+
+        self.database.rollback.assert_called_once_with()
+
+    def test_refresh_skips_counting_when_recently_counted(self):
+        self.cursor.fetchone.side_effect = [(True,), (self.now, self.now, self.now)]
+        self.cursor.fetchall.side_effect = [self.stored_rows]
+
+        self.stats.refresh()
+
+        self.assertFalse(any('FROM delayed_jobs' in q
+                             for q in self.executed_queries()))
+
+    def test_maybe_refresh_at_most_every_interval(self):
+        self.stats.refresh = MagicMock()
+
+        self.assertTrue(self.stats.maybe_refresh())
+        self.now += datetime.timedelta(seconds=29)
+        self.assertFalse(self.stats.maybe_refresh())
+        self.now += datetime.timedelta(seconds=1)
+        self.assertTrue(self.stats.maybe_refresh())
+
+        self.assertEqual(self.stats.refresh.call_count, 2)
+
+
+class TestStatsServer(TestCase):
+    def test_serves_snapshot_as_json(self):
+        stats = MagicMock()
+        stats.snapshot.return_value = {'queues': {'default': {'ready': 5}}}
+        server = start_stats_server(stats, 0)
+        try:
+            url = 'http://127.0.0.1:%d/stats' % server.server_address[1]
+            with urllib.request.urlopen(url) as response:
+                body = json.loads(response.read().decode('utf-8'))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(body, {'queues': {'default': {'ready': 5}}})
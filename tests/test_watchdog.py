@@ -0,0 +1,49 @@
+import threading
+from unittest import TestCase
+from pyworker.watchdog import MemoryWatchdog, current_rss, SOFT_LIMIT, HARD_LIMIT
+
+
+class TestMemoryWatchdog(TestCase):
+    def setUp(self):
+        self.rss = 0
+        self.watchdog = MemoryWatchdog(soft_limit=100, hard_limit=200,
+            check_interval=0.01, rss=lambda: self.rss)
+
+    def test_current_rss_is_positive(self):
+        self.assertGreater(current_rss(), 0)
+
+    def test_check_below_limits(self):
+        self.rss = 99
+
+        self.assertIsNone(self.watchdog.check())
+
+    def test_check_soft_limit(self):
+        self.rss = 150
+
+        self.assertEqual(self.watchdog.check(), SOFT_LIMIT)
+
+    def test_check_hard_limit(self):
+        self.rss = 200
+
+        self.assertEqual(self.watchdog.check(), HARD_LIMIT)
+
+    def test_monitor_calls_back_once_past_hard_limit(self):
+        called = threading.Event()
+        self.rss = 250
+
+        with self.watchdog.monitor(called.set):
+            self.assertTrue(called.wait(1))
+
+    def test_monitor_does_not_call_back_below_hard_limit(self):
+        called = threading.Event()
+        self.rss = 150
+
+        with self.watchdog.monitor(called.set):
+            self.assertFalse(called.wait(0.05))
+
+    def test_monitor_without_interval_starts_no_thread(self):
+        watchdog = MemoryWatchdog(hard_limit=200)
+        threads = threading.active_count()
+
+        with watchdog.monitor(lambda: None):
+            self.assertEqual(threading.active_count(), threads)
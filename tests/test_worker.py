@@ -1,7 +1,21 @@
 import datetime
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from pyworker.worker import Worker, TerminatedException
+import signal
+import time
+from pyworker.worker import Worker, TerminatedException, MemoryLimitException
+from pyworker.watchdog import MemoryWatchdog
+from pyworker.circuit_breaker import OPEN
+from pyworker.accounting import ResourceAccountant
+from pyworker.durations import DurationEstimator
+from pyworker.affinity import Affinity
+from pyworker.job import Job
+from pyworker.pipeline import PreparePipeline
+from pyworker.shards import WEIGHTED, NO_TENANT
+
+
+class ProjectJob(Job):
+    affinity_attribute = 'project_id'
 
 class TestWorker(TestCase):
     @patch('pyworker.worker.DBConnector')
@@ -19,7 +33,11 @@ class TestWorker(TestCase):
             job_name='test_job',
             queue='default',
             attempts=0,
-            run_at=mocked_run_at)
+            run_at=mocked_run_at,
+            deduplicate=False,
+            handler_digest=None,
+            prepared=None,
+            load_error=None)
         self.mock_extra_fields = {
             'extra_field1_str': 'extra_field1_value',
             'extra_field2_int': 100,
@@ -60,7 +78,7 @@ class TestWorker(TestCase):
     @patch('pyworker.worker.DBConnector')
     @patch('pyworker.worker.os.environ', {
         'NEW_RELIC_LICENSE_KEY': 'test', 'NEW_RELIC_APP_NAME': 'test'})
-    @patch('pyworker.worker.Reporter')
+    @patch('pyworker.reporter.Reporter')
     def test_worker_init_with_reporter(self, mock_reporter, *_):
         mock_reporter.return_value = MagicMock()
         worker = Worker('dummy', reported_attributes_prefix='test_prefix')
@@ -69,6 +87,15 @@ class TestWorker(TestCase):
         mock_reporter.assert_called_once_with(
             attribute_prefix='test_prefix', logger=worker.logger)
 
+    @patch('pyworker.worker.DBConnector')
+    @patch('pyworker.worker.start_async_logging')
+    def test_worker_init_with_async_logging(self, mock_start_async_logging, *_):
+        logger = MagicMock()
+        worker = Worker('dummy', logger=logger, async_logging=True)
+
+        mock_start_async_logging.assert_called_once_with(logger)
+        self.assertEqual(worker._log_listener, mock_start_async_logging.return_value)
+
     #********** .run tests **********#
 
     @patch('pyworker.worker.Worker.get_job', return_value=None)
@@ -80,6 +107,16 @@ class TestWorker(TestCase):
         self.worker.database.connect.assert_called_once_with()
         self.worker.database.disconnect.assert_called_once_with()
 
+    @patch('pyworker.worker.Worker.get_job', return_value=None)
+    @patch('pyworker.worker.time.sleep', side_effect=TerminatedException('SIGTERM'))
+    def test_worker_run_creates_archive_partitions_when_archiving_completed(self, *_):
+        self.worker.archiver = MagicMock(include_completed=True)
+        self.worker.archiver.bind.return_value = self.worker.archiver
+
+        self.worker.run()
+
+        self.worker.archiver.ensure_partitions.assert_called_once_with()
+
     @patch('pyworker.worker.Worker.get_job', return_value=None)
     @patch('pyworker.worker.time.sleep', side_effect=TerminatedException('SIGTERM'))
     def test_worker_run_shuts_down_reporter(self, *_):
@@ -105,6 +142,545 @@ class TestWorker(TestCase):
         mock_get_job.assert_called_once_with()
         mock_handle_job.assert_called_once_with(mock_get_job.return_value)
 
+    @patch('pyworker.worker.Worker.get_job')
+    def test_worker_run_when_draining_finishes_job_then_stops(self, mock_get_job):
+        self.worker.drain_timeout = 60
+        def drain(job):
+            self.worker._draining = True
+        self.worker.handle_job = MagicMock(side_effect=drain)
+
+        self.worker.run()
+
+        mock_get_job.assert_called_once_with()
+        self.worker.handle_job.assert_called_once_with(mock_get_job.return_value)
+        self.worker.database.disconnect.assert_called_once_with()
+
+    @patch('pyworker.worker.Worker.get_job')
+    def test_worker_run_when_draining_skips_maintenance(self, mock_get_job):
+        self.worker.drain_timeout = 60
+        def drain(job):
+            self.worker._draining = True
+        self.worker.handle_job = MagicMock(side_effect=drain)
+        self.worker.run_maintenance = MagicMock()
+
+        self.worker.run()
+
+        self.worker.run_maintenance.assert_not_called()
+
+    @patch('pyworker.worker.Worker.get_job', return_value=None)
+    @patch('pyworker.worker.time.sleep', side_effect=TerminatedException('SIGTERM'))
+    def test_worker_run_shutdown_is_not_interrupted_by_signals(self, *_):
+        self.worker._drain_timer = MagicMock()
+        self.worker.reporter = MagicMock()
+        handlers = {}
+        def signal_handler(signum, handler):
+            handlers[signum] = handler
+        # e.g. the drain deadline firing while disconnecting
+        self.worker.database.disconnect.side_effect = \
+            lambda: handlers[signal.SIGTERM](15, None)
+
+        with patch('pyworker.worker.signal.signal', side_effect=signal_handler):
+            self.worker.run()
+
+        self.worker._drain_timer.cancel.assert_called()
+        self.worker.reporter.shutdown.assert_called_once_with()
+
+    @patch('pyworker.worker.Worker.get_job')
+    def test_worker_run_when_signaled_while_claiming_unlocks_job(self, mock_get_job):
+        self.worker.drain_timeout = 60
+        job = MagicMock()
+        def claim():
+            self.worker._draining = True
+            return job
+        mock_get_job.side_effect = claim
+        self.worker.handle_job = MagicMock()
+
+        self.worker.run()
+
+        job.unlock.assert_called_once_with()
+        self.worker.handle_job.assert_not_called()
+
+    @patch('pyworker.worker.Worker.handle_job')
+    @patch('pyworker.worker.Worker.get_job')
+    def test_worker_run_when_soft_memory_limit_exceeded_recycles_after_job(
+            self, mock_get_job, mock_handle_job):
+        self.worker.memory_watchdog = MemoryWatchdog(soft_limit=100, rss=lambda: 150)
+        self.worker.reporter = MagicMock()
+
+        self.worker.run()
+
+        mock_handle_job.assert_called_once_with(mock_get_job.return_value)
+        self.assertEqual(self.worker.recycle_reason, 'soft_memory_limit')
+        self.worker.reporter.record_metric.assert_called_once_with(
+            'Custom/Worker/Recycle/soft_memory_limit', 1)
+        self.worker.database.disconnect.assert_called_once_with()
+
+    @patch('pyworker.worker.Worker.handle_job', side_effect=MemoryLimitException())
+    @patch('pyworker.worker.Worker.get_job')
+    def test_worker_run_when_hard_memory_limit_exceeded_recycles(self, *_):
+        self.worker.run()
+
+        self.assertEqual(self.worker.recycle_reason, 'hard_memory_limit')
+
+    def test_worker_handle_job_when_hard_memory_limit_exceeded_unlocks_job(self):
+        self.worker.memory_watchdog = MemoryWatchdog(hard_limit=100,
+            check_interval=0.01, rss=lambda: 150)
+        job = self.mock_job
+        job.run.side_effect = lambda: time.sleep(1)
+
+        with self.assertRaises(MemoryLimitException):
+            self.worker.handle_job(job)
+
+        job.unlock.assert_called_once_with()
+        job.set_error_unlock.assert_not_called()
+
+    #********** signal handling tests **********#
+
+    def get_signal_handler(self):
+        with patch('pyworker.worker.signal.signal') as mock_signal:
+            with self.worker._terminatable():
+                pass
+        return mock_signal.call_args[0][1]
+
+    def test_worker_signal_without_drain_timeout_raises(self):
+        handler = self.get_signal_handler()
+
+        with self.assertRaises(TerminatedException):
+            handler(15, None)
+
+    @patch('pyworker.worker.threading.Timer')
+    def test_worker_signal_with_drain_timeout_starts_draining(self, mock_timer):
+        self.worker.drain_timeout = 60
+        handler = self.get_signal_handler()
+
+        handler(15, None) # no error raised
+
+        self.assertTrue(self.worker._draining)
+        mock_timer.assert_called_once()
+        self.assertEqual(mock_timer.call_args[0][0], 60)
+        mock_timer.return_value.start.assert_called_once_with()
+
+    @patch('pyworker.worker.threading.Timer')
+    def test_worker_second_signal_while_draining_raises(self, mock_timer):
+        self.worker.drain_timeout = 60
+        handler = self.get_signal_handler()
+
+        handler(15, None)
+        with self.assertRaises(TerminatedException):
+            handler(15, None)
+
+    def test_worker_signal_while_sleeping_raises(self):
+        self.worker.drain_timeout = 60
+        self.worker._interruptible = True
+        handler = self.get_signal_handler()
+
+        with self.assertRaises(TerminatedException):
+            handler(15, None)
+
+    #********** shards tests **********#
+
+    @patch('pyworker.worker.DBConnector')
+    def test_worker_init_with_multiple_databases_creates_shards(self, mock_db):
+        worker = Worker(['dummy1', 'dummy2'])
+
+        self.assertEqual(len(worker.shards), 2)
+        self.assertEqual(worker.database, worker.shards[0].database)
+
+    @patch('pyworker.worker.Job.from_row')
+    @patch('pyworker.worker.DBConnector')
+    def test_worker_get_job_claims_from_next_shard_when_first_is_empty(
+            self, mock_db, mock_from_row):
+        worker = Worker(['dummy1', 'dummy2'])
+        for shard in worker.shards:
+            shard.database = MagicMock()
+            shard.cursor = MagicMock()
+        worker.shards[0].cursor.fetchone.return_value = None
+        worker.shards[1].cursor.fetchone.return_value = ('row',)
+
+        worker.get_job()
+
+        self.assertEqual(mock_from_row.call_args[1]['database'], worker.shards[1].database)
+        self.assertEqual(worker.shards[0].empty_polls, 1)
+
+    @patch('pyworker.worker.Job.from_row')
+    @patch('pyworker.worker.DBConnector')
+    def test_worker_get_job_skips_failing_shard(self, mock_db, mock_from_row):
+        worker = Worker(['dummy1', 'dummy2'])
+        for shard in worker.shards:
+            shard.database = MagicMock()
+            shard.cursor = MagicMock()
+        failing = worker.shards[0]
+        failing.cursor.execute.side_effect = Exception('connection refused')
+        failing.database.rollback.side_effect = Exception('connection closed')
+        worker.shards[1].cursor.fetchone.return_value = ('row',)
+
+        worker.get_job()
+
+        self.assertEqual(mock_from_row.call_args[1]['database'], worker.shards[1].database)
+        failing.database.connect.assert_called_once_with()
+        self.assertGreater(failing.skip_until, 0)
+        self.assertNotIn(failing, worker.shard_selector.order())
+
+    @patch('pyworker.worker.DBConnector')
+    def test_worker_refresh_shard_depths_skips_failing_shard(self, mock_db):
+        worker = Worker(['dummy1', 'dummy2'])
+        worker.shard_selector.policy = WEIGHTED
+        for shard in worker.shards:
+            shard.database = MagicMock()
+            shard.cursor = MagicMock()
+        worker.shards[0].cursor.execute.side_effect = Exception('timeout')
+        worker.shards[1].cursor.fetchone.return_value = (7,)
+
+        worker._refresh_shard_depths()
+
+        worker.shards[0].database.rollback.assert_called_once_with()
+        self.assertEqual(worker.shards[1].depth, 7)
+        self.assertEqual(worker.shards[0].empty_polls, 1)
+
+    @patch('pyworker.worker.Job.from_row')
+    def test_worker_get_job_commits_claim_and_passes_lock_owner(self, mock_from_row):
+        shard = self.worker.shards[0]
+        shard.database = MagicMock()
+        shard.cursor = MagicMock()
+        shard.cursor.fetchone.return_value = ('row',)
+
+        self.worker.get_job()
+
+        shard.database.commit.assert_called_once_with()
+        self.assertEqual(mock_from_row.call_args[1]['locked_by'], self.worker.name)
+
+    @patch('pyworker.worker.DBConnector')
+    def test_worker_run_connects_to_and_disconnects_from_all_shards(self, mock_db):
+        worker = Worker(['dummy1', 'dummy2'])
+        worker.shards[1].database = MagicMock()
+        worker.get_job = MagicMock(return_value=None)
+
+        with patch('pyworker.worker.time.sleep', side_effect=TerminatedException('SIGTERM')):
+            worker.run()
+
+        worker.shards[1].database.connect.assert_called_once_with()
+        worker.shards[1].database.disconnect.assert_called_once_with()
+
+    #********** ._next_job tests **********#
+
+    def test_worker_next_job_with_lookahead_claims_ahead(self):
+        jobs = [MagicMock(abstract=False, prepared=None) for _ in range(3)]
+        self.worker.get_job = MagicMock(side_effect=jobs)
+        self.worker.lookahead = 1
+
+        self.assertIs(self.worker._next_job(), jobs[0])
+        self.assertEqual(self.worker.get_job.call_count, 2)
+        jobs[1].prepared.result(timeout=1)
+        jobs[1].prepare.assert_called_once_with()
+
+        self.assertIs(self.worker._next_job(), jobs[1])
+        self.assertEqual(self.worker.get_job.call_count, 3)
+
+        self.worker._pipeline.release()
+        jobs[2].unlock.assert_called_once_with()
+
+    def test_worker_claim_query_orders_by_priority_then_run_at(self):
+        query = self.worker.claim_query()
+
+        self.assertIn('ORDER BY priority ASC, run_at ASC LIMIT 1 FOR UPDATE', query)
+        self.assertNotIn('UNION', query)
+
+    def test_worker_claim_query_with_aging_compares_bounded_candidates(self):
+        self.worker.aging_interval = 300
+        self.worker.aging_candidates = 50
+
+        query = self.worker.claim_query()
+
+        self.assertIn('ORDER BY priority ASC, run_at ASC LIMIT 50', query)
+        self.assertIn('ORDER BY run_at ASC LIMIT 50', query)
+        self.assertIn('candidates.run_at) / 300) ASC', query)
+        self.assertTrue(query.rstrip().endswith('FOR UPDATE) RETURNING\n' \
+            '                id, attempts, run_at, queue, handler'))
+
+    def test_worker_claim_query_with_fair_share_starts_from_first_tenant(self):
+        self.worker.fair_share_column = 'user_id'
+
+        query = self.worker.claim_query()
+
+        self.assertIn('user_id = (SELECT min(user_id) FROM delayed_jobs', query)
+        self.assertTrue(query.rstrip().endswith('queue, handler, user_id'))
+
+    @patch('pyworker.worker.Job.from_row')
+    def test_worker_get_job_with_fair_share_continues_after_last_tenant(
+            self, mock_from_row):
+        self.worker.fair_share_column = 'user_id'
+        shard = self.worker.shards[0]
+        cursor = shard.cursor = MagicMock()
+        cursor.fetchone.return_value = (1, 0, None, 'default', 'handler', 42)
+        self.worker.get_job()
+
+        query = self.worker.claim_query(shard)
+
+        self.assertEqual(shard.last_tenant, 42)
+        self.assertIn('AND user_id > 42)', query)
+        # then the jobs without tenant, then the first tenant again
+        self.assertLess(query.index('user_id > 42'), query.index('user_id IS NULL'))
+        self.assertLess(query.index('user_id IS NULL'), query.rindex('min(user_id)'))
+
+    @patch('pyworker.worker.Job.from_row')
+    def test_worker_get_job_with_fair_share_serves_jobs_without_tenant_in_turn(
+            self, mock_from_row):
+        self.worker.fair_share_column = 'user_id'
+        shard = self.worker.shards[0]
+        cursor = shard.cursor = MagicMock()
+        cursor.fetchone.return_value = (1, 0, None, 'default', 'handler', None)
+        self.worker.get_job()
+
+        query = self.worker.claim_query(shard)
+
+        self.assertIs(shard.last_tenant, NO_TENANT)
+        self.assertNotIn('user_id >', query)
+        self.assertLess(query.index('min(user_id)'), query.index('user_id IS NULL'))
+
+    @patch('pyworker.worker.DBConnector')
+    def test_worker_fair_share_rotation_is_per_shard(self, mock_db):
+        worker = Worker(['dummy1', 'dummy2'])
+        worker.fair_share_column = 'user_id'
+        worker.shards[0].last_tenant = 42
+
+        self.assertIn('user_id > 42', worker.claim_query(worker.shards[0]))
+        self.assertNotIn('user_id >', worker.claim_query(worker.shards[1]))
+
+    def test_worker_claim_query_excludes_jobs_claimed_ahead(self):
+        self.worker._pipeline = MagicMock()
+        self.worker._pipeline.__len__.return_value = 2
+        self.worker._pipeline.job_ids.return_value = [3, 4]
+
+        self.assertIn('AND delayed_jobs.id NOT IN (3, 4)', self.worker.claim_query())
+
+    def test_worker_claim_query_with_shortest_job_first_orders_by_expected_run_time(
+            self):
+        self.worker.shortest_job_first = True
+        self.worker.sjf_candidates = 20
+        self.worker.duration_estimator = DurationEstimator(min_samples=1)
+        self.worker.duration_estimator.record('Slow_Job', 120)
+        self.worker.duration_estimator.record('FastJob', 2)
+
+        query = self.worker.claim_query()
+
+        self.assertIn('ORDER BY priority ASC, run_at ASC LIMIT 20', query)
+        self.assertIn("WHEN candidates.handler LIKE " \
+            "'%object: !ruby/object:FastJob\n%' THEN 2.000000", query)
+        self.assertIn("LIKE '%object: !ruby/object:Slow\\_Job\n%' THEN 120.000000",
+            query)
+        self.assertIn("interval '600 seconds' DESC", query)
+
+    def test_worker_claim_query_with_shortest_job_first_needs_estimates(self):
+        self.worker.shortest_job_first = True
+        self.worker.duration_estimator = DurationEstimator()
+
+        self.assertIn('ORDER BY priority ASC, run_at ASC LIMIT 1 FOR UPDATE',
+            self.worker.claim_query())
+
+    def test_worker_claim_query_with_affinity_column_prefers_warm_keys(self):
+        self.worker.affinity = Affinity(MagicMock(), column='project_id',
+            max_wait=20)
+        self.worker.affinity.live_workers = ['worker-b']
+        self.worker.affinity.served(42)
+
+        query = self.worker.claim_query()
+
+        self.assertIn('project_id::text AS affinity_key', query)
+        self.assertIn("ORDER BY candidates.priority ASC, " \
+            "(candidates.affinity_key IN ('42')) IS TRUE DESC", query)
+        self.assertIn("(VALUES ('%s'), ('worker-b'))" % self.worker.name, query)
+        self.assertIn("interval '20 seconds'", query)
+        self.assertTrue(query.rstrip().endswith('queue, handler, project_id'))
+
+    def test_worker_claim_query_with_affinity_attribute_reads_handler(self):
+        self.worker.affinity = Affinity(MagicMock())
+
+        query = self.worker.claim_query()
+
+        self.assertIn("WHEN handler LIKE '%object: !ruby/object:ProjectJob\n%' " \
+            "THEN (SELECT coalesce(replace(key_match.groups[1]", query)
+        self.assertIn("FROM regexp_match(handler, E'\\n    project_id: ", query)
+        self.assertIn('OR false', query)
+
+    @patch('pyworker.worker.Job.from_row')
+    def test_worker_get_job_with_affinity_records_served_key(self, mock_from_row):
+        self.worker.affinity = Affinity(MagicMock(), column='project_id')
+        cursor = self.worker.shards[0].cursor = MagicMock()
+        cursor.fetchone.return_value = (1, 0, None, 'default', 'handler', 42)
+
+        self.worker.get_job()
+
+        self.assertEqual(self.worker.affinity.warm(), ['42'])
+
+    def test_worker_next_job_refreshes_lock_of_long_waiting_job(self):
+        job = MagicMock(abstract=False, prepared=None)
+        job.refresh_lock.return_value = False
+        self.worker.get_job = MagicMock(side_effect=[job, None])
+        self.worker.lookahead = 1
+        self.worker.max_run_time = 0
+
+        self.assertIsNone(self.worker._next_job())
+
+        job.refresh_lock.assert_called_once_with()
+
+    def test_worker_next_job_refreshes_lock_of_any_waiting_job(self):
+        # waited 1 second, far less than max_run_time / 2
+        job = MagicMock(abstract=False, prepared=None)
+        job.refresh_lock.return_value = True
+        self.worker.get_job = MagicMock(side_effect=[job, None])
+        self.worker.lookahead = 1
+        self.worker._pipeline = PreparePipeline(1,
+            clock=MagicMock(side_effect=[100, 101]))
+
+        self.assertIs(self.worker._next_job(), job)
+
+        job.refresh_lock.assert_called_once_with()
+        self.worker._pipeline.release()
+
+    #********** .run_maintenance tests **********#
+
+    @patch('pyworker.worker.time.time', return_value=1000)
+    def test_worker_run_maintenance_archives_once_per_interval(self, mock_time):
+        self.worker.archiver = MagicMock(max_batches=None)
+        self.worker.archiver.bind.return_value = self.worker.archiver
+
+        self.worker.run_maintenance()
+        mock_time.return_value = 1000 + self.worker.archive_interval - 1
+        self.worker.run_maintenance()
+
+        self.worker.archiver.archive.assert_called_once_with(
+            self.worker.archive_max_batches)
+
+        mock_time.return_value = 1000 + self.worker.archive_interval
+        self.worker.run_maintenance()
+
+        self.assertEqual(self.worker.archiver.archive.call_count, 2)
+
+    def test_worker_run_maintenance_failure_rolls_back_and_continues(self):
+        self.worker.archiver = MagicMock(max_batches=3)
+        self.worker.archiver.bind.return_value = self.worker.archiver
+        self.worker.archiver.archive.side_effect = Exception('missing column')
+        self.worker.database.rollback = MagicMock()
+
+        self.worker.run_maintenance()
+
+        self.worker.archiver.archive.assert_called_once_with(3)
+        self.worker.database.rollback.assert_called_once_with()
+
+    @patch('pyworker.worker.DBConnector')
+    def test_worker_run_maintenance_archives_every_shard(self, mock_db):
+        mock_db.side_effect = lambda url, logger: MagicMock()
+        worker = Worker(['postgres://.../shard1', 'postgres://.../shard2'])
+        first, second = [shard.database for shard in worker.shards]
+        worker.archiver = MagicMock(max_batches=5)
+        bound = worker.archiver.bind.return_value
+        bound.archive.side_effect = Exception('no archive table')
+
+        worker.run_maintenance()
+
+        self.assertEqual([call[0][0] for call in worker.archiver.bind.call_args_list],
+            [first, second])
+        self.assertEqual(bound.archive.call_count, 2)
+        self.assertEqual(first.rollback.call_count, 1)
+        self.assertEqual(second.rollback.call_count, 1)
+
+    def test_worker_run_maintenance_lets_termination_through(self):
+        self.worker.archiver = MagicMock()
+        self.worker.archiver.bind.return_value = self.worker.archiver
+        self.worker.archiver.archive.side_effect = TerminatedException('SIGTERM')
+
+        with self.assertRaises(TerminatedException):
+            self.worker.run_maintenance()
+
+    def test_worker_run_maintenance_ticks_scheduler(self):
+        self.worker.scheduler = MagicMock()
+
+        self.worker.run_maintenance()
+
+        self.worker.scheduler.tick.assert_called_once_with()
+
+    def test_worker_run_maintenance_heartbeats_affinity(self):
+        self.worker.affinity = MagicMock()
+
+        self.worker.run_maintenance()
+
+        self.worker.affinity.maybe_heartbeat.assert_called_once_with(
+            self.worker.name)
+
+    def test_worker_run_maintenance_refreshes_queue_stats(self):
+        self.worker.queue_stats = MagicMock()
+
+        self.worker.run_maintenance()
+
+        self.worker.queue_stats.maybe_refresh.assert_called_once_with()
+
+    @patch('pyworker.worker.time.time', return_value=1000)
+    def test_worker_run_maintenance_syncs_durations_once_per_interval(
+            self, mock_time):
+        self.worker.duration_estimator = MagicMock()
+        self.worker.duration_sync_interval = 60
+
+        self.worker.run_maintenance()
+        mock_time.return_value = 1059
+        self.worker.run_maintenance()
+
+        self.worker.duration_estimator.sync.assert_called_once_with(
+            self.worker.database)
+
+    @patch('pyworker.worker.time.sleep')
+    def test_worker_admission_deferred_leaves_jobs_and_reports(
+            self, mock_time_sleep):
+        self.worker.admission = MagicMock(retry_delay=5)
+        self.worker.admission.check.return_value = ('LoadAverage', 'busy')
+        self.worker.reporter = MagicMock()
+        self.worker._pipeline = MagicMock()
+
+        self.assertTrue(self.worker._admission_deferred())
+
+        self.worker._pipeline.release.assert_called_once_with()
+        self.worker.reporter.record_metric.assert_called_once_with(
+            'Custom/Admission/Deferred/LoadAverage', 1)
+        mock_time_sleep.assert_called_once_with(5)
+
+    def test_worker_admission_admits_without_checks(self):
+        self.assertFalse(self.worker._admission_deferred())
+
+        self.worker.admission = MagicMock()
+        self.worker.admission.check.return_value = None
+        self.assertFalse(self.worker._admission_deferred())
+
+    @patch('pyworker.worker.time.sleep')
+    def test_worker_run_does_not_claim_while_deferred(self, mock_time_sleep):
+        self.worker.admission = MagicMock(retry_delay=1)
+        self.worker.admission.check.side_effect = [('InFlight', 'full'), None]
+        self.worker.get_job = MagicMock(return_value=self.mock_job)
+        self.worker.handle_job = MagicMock(
+            side_effect=lambda job: setattr(self.worker, '_draining', True))
+
+        self.worker.run()
+
+        self.worker.get_job.assert_called_once_with()
+        self.worker.admission.track.assert_called_once_with()
+
+    @patch('pyworker.worker.time.sleep')
+    def test_worker_sleep_for_late_schedule_is_not_a_busy_loop(
+            self, mock_time_sleep):
+        self.worker.scheduler = MagicMock()
+        self.worker.scheduler.seconds_until_next.return_value = 0
+
+        self.worker._sleep()
+
+        mock_time_sleep.assert_called_once_with(1)
+
+    @patch('pyworker.worker.time.sleep')
+    def test_worker_sleep_wakes_up_for_next_schedule(self, mock_time_sleep):
+        self.worker.scheduler = MagicMock()
+        self.worker.scheduler.seconds_until_next.return_value = 2
+
+        self.worker._sleep()
+
+        mock_time_sleep.assert_called_once_with(2)
+
     #********** .handle_job tests **********#
 
     def assert_instrument_context_reports_custom_attributes(self, job, reporter):
@@ -131,6 +707,17 @@ class TestWorker(TestCase):
         job.set_error_unlock.assert_called_once()
         assert 'Unsupported Job' in job.set_error_unlock.call_args[0][0]
 
+    def test_worker_handle_job_when_payload_could_not_be_decoded_sets_error(self):
+        job = self.mock_job
+        job.abstract = True
+        job.load_error = ValueError('no blob store is configured')
+
+        self.worker.handle_job(job)
+
+        job.set_error_unlock.assert_called_once()
+        self.assertIn('no blob store', job.set_error_unlock.call_args[0][0])
+        job.run.assert_not_called()
+
     @patch('pyworker.worker.get_current_time')
     def test_worker_handle_job_when_job_is_unsupported_type_reports_error(
             self, get_current_time):
@@ -188,6 +775,117 @@ class TestWorker(TestCase):
         reporter.report_raw.assert_any_call(error=False)
         self.assert_instrument_context_reports_custom_attributes(job, reporter)
 
+    @patch('pyworker.worker.get_current_time')
+    def test_worker_handle_job_with_profiler_profiles_run(self, get_current_time):
+        get_current_time.return_value = self.mocked_now
+        self.worker.profiler = MagicMock()
+        profile = self.worker.profiler.profile.return_value
+        profile.__enter__.side_effect = lambda *args: \
+            self.mock_job.run.assert_not_called()
+        profile.__exit__.side_effect = lambda *args: \
+            self.mock_job.run.assert_called_once_with()
+
+        self.worker.handle_job(self.mock_job)
+
+        self.worker.profiler.profile.assert_called_once_with(self.mock_job)
+        profile.__exit__.assert_called_once()
+
+    @patch('pyworker.worker.get_current_time')
+    def test_worker_handle_job_releases_datasets_of_failed_jobs(
+            self, get_current_time):
+        get_current_time.return_value = self.mocked_now
+        self.worker.dataset_cache = MagicMock()
+        self.mock_job.run.side_effect = Exception('test error')
+
+        self.worker.handle_job(self.mock_job)
+
+        self.mock_job.release_datasets.assert_called_once_with()
+
+    @patch('pyworker.worker.get_current_time')
+    def test_worker_handle_job_records_duration_of_successful_runs(
+            self, get_current_time):
+        get_current_time.return_value = self.mocked_now
+        self.mock_job.class_name = 'TestJob'
+        self.worker.duration_estimator = DurationEstimator(min_samples=1)
+
+        self.worker.handle_job(self.mock_job)
+        self.mock_job.run.side_effect = Exception('test error')
+        self.worker.handle_job(self.mock_job)
+
+        self.assertEqual(
+            self.worker.duration_estimator.estimates['TestJob'].samples, 1)
+
+    @patch('pyworker.worker.get_current_time')
+    def test_worker_handle_job_with_adaptive_run_time_limits_known_classes(
+            self, get_current_time):
+        get_current_time.return_value = self.mocked_now
+        self.mock_job.class_name = 'TestJob'
+        self.worker.adaptive_run_time = True
+        self.worker.duration_estimator = MagicMock()
+        self.worker.duration_estimator.run_time_limit.return_value = 90
+        self.worker._time_limit = MagicMock()
+
+        self.worker.handle_job(self.mock_job)
+
+        self.worker.duration_estimator.run_time_limit.assert_called_once_with(
+            'TestJob', self.worker.max_run_time)
+        self.worker._time_limit.assert_called_once_with(90)
+
+    @patch('pyworker.worker.get_current_time')
+    def test_worker_handle_job_with_resource_accountant_reports_usage(
+            self, get_current_time):
+        get_current_time.return_value = self.mocked_now
+        self.mock_job.class_name = 'TestJob'
+        self.worker.resource_accountant = ResourceAccountant()
+        reporter = MagicMock()
+        self.worker.reporter = reporter
+
+        self.worker.handle_job(self.mock_job)
+
+        self.assertEqual(self.worker.resource_accountant.stats['TestJob']['count'], 1)
+        kwargs = [call[1] for call in reporter.report.call_args_list]
+        self.assertTrue(any('job_cpu_user_seconds' in k for k in kwargs))
+
+    def test_worker_handle_job_when_deduplicating_coalesces_duplicates(self):
+        self.mock_job.deduplicate = True
+        self.mock_job.handler_digest = 'abc'
+        self.mock_job.digest = 'digest'
+
+        self.worker.handle_job(self.mock_job)
+
+        self.mock_job.coalesce.assert_called_once_with(
+            self.worker.name, self.worker.max_run_time)
+        self.mock_job.run.assert_called_once()
+        self.assertTrue(self.worker.dedup_cache.seen_within('digest', 60))
+
+    def test_worker_handle_job_when_duplicate_completed_recently_skips_run(self):
+        self.mock_job.deduplicate = True
+        self.mock_job.dedup_window = 60
+        self.mock_job.digest = 'digest'
+        self.worker.dedup_cache.add('digest')
+
+        self.worker.handle_job(self.mock_job)
+
+        self.mock_job.run.assert_not_called()
+        self.mock_job.coalesce.assert_not_called()
+        self.mock_job.remove.assert_called_once()
+
+    def test_worker_handle_job_calls_prepare_hook_first(self):
+        self.worker.handle_job(self.mock_job)
+
+        self.mock_job.prepare.assert_called_once_with()
+
+    def test_worker_handle_job_when_prepare_failed_ahead_sets_error(self):
+        job = self.mock_job
+        job.prepared = MagicMock()
+        job.prepared.result.side_effect = IOError('download failed')
+
+        self.worker.handle_job(job)
+
+        job.prepare.assert_not_called()
+        job.run.assert_not_called()
+        job.set_error_unlock.assert_called_once()
+
     def test_worker_handle_job_when_error_sets_error_and_unlocks_job(self):
         job = self.mock_job
         job.run.side_effect = Exception('test error')
@@ -242,3 +940,50 @@ class TestWorker(TestCase):
 
         with self.assertRaises(TerminatedException):
             self.worker.handle_job(job)
+
+    #********** circuit breaker tests **********#
+
+    def test_worker_get_job_excludes_open_circuit_classes_from_claim(self):
+        cursor = self.worker.shards[0].cursor = MagicMock()
+        cursor.fetchone.return_value = None
+        self.worker.circuit_breaker = MagicMock()
+        self.worker.circuit_breaker.excluded_classes.return_value = ['Failing_Job']
+
+        self.worker.get_job()
+
+        query = cursor.execute.call_args[0][0]
+        self.assertIn("handler NOT LIKE '%object: !ruby/object:Failing\\_Job\n%'", query)
+
+    def test_worker_handle_job_records_circuit_breaker_outcome(self):
+        job = self.mock_job
+        job.class_name = 'TestJob'
+        job.run.side_effect = Exception('test error')
+        self.worker.circuit_breaker = MagicMock()
+        self.worker.circuit_breaker.record.return_value = OPEN
+        self.worker.reporter = MagicMock()
+
+        self.worker.handle_job(job)
+
+        self.worker.circuit_breaker.record.assert_called_once_with('TestJob', True)
+        self.worker.reporter.record_metric.assert_called_once_with(
+            'Custom/CircuitBreaker/TestJob/Open', 1)
+
+    def test_worker_handle_job_without_class_name_skips_circuit_breaker(self):
+        job = self.mock_job
+        job.abstract = True
+        job.class_name = None
+        self.worker.circuit_breaker = MagicMock()
+
+        self.worker.handle_job(job)
+
+        self.worker.circuit_breaker.record.assert_not_called()
+
+    def test_worker_handle_job_does_not_record_termination_in_circuit_breaker(self):
+        job = self.mock_job
+        job.run.side_effect = TerminatedException('SIGTERM')
+        self.worker.circuit_breaker = MagicMock()
+
+        with self.assertRaises(TerminatedException):
+            self.worker.handle_job(job)
+
+        self.worker.circuit_breaker.record.assert_not_called()